@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from app.api.api_v1.endpoints import analyze, tasks, health, users, chat, cancel
+from app.api.api_v1.endpoints import analyze, tasks, health, users, chat, cancel, tiles, detections
 
 api_router = APIRouter()
 api_router.include_router(analyze.router, prefix="/analyze", tags=["analyze"])
@@ -8,3 +8,5 @@ api_router.include_router(health.router, prefix="/health", tags=["health"])
 api_router.include_router(users.router, prefix="/users", tags=["users"])
 api_router.include_router(chat.router, prefix="/chat", tags=["chat"])
 api_router.include_router(cancel.router, prefix="/cancel", tags=["cancel"])
+api_router.include_router(tiles.router, prefix="/tiles", tags=["tiles"])
+api_router.include_router(detections.router, prefix="/detections", tags=["detections"])
@@ -1,22 +1,71 @@
 from fastapi import APIRouter, File, UploadFile, Form, HTTPException, BackgroundTasks, Query, Body, Depends
 from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 import uuid
 import os
 import time
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from sqlalchemy.orm import Session
 
 from app.core.config import UPLOAD_FOLDER
 from app.worker.tasks import process_image_task
 from app.models.analyze import AnalyzeRequest, AnalyzeResponse
 from app.services.zhipuai_service import zhipuai_service
+from app.services.execution_profiles import execution_profiles
+from app.services.image_pipeline import normalize_upload_async, derived_image_path
 from app.db.database import get_db
-from app.services.user_service import MessageService, ChatService
+from app.services.user_service import MessageService, ChatService, UploadService, UploadTooLargeError
 from app.api.api_v1.endpoints.users import get_current_user
-from app.db.models import User
+from app.db.models import User, Upload, Message
 
 router = APIRouter()
 
+
+def _store_upload_with_messages(db: Session, tmp_path: str, sha256: str, size: int, extension: str,
+                                chat_id: str, prompt: str) -> Tuple[Upload, List[Message]]:
+    """
+    保存上传文件，并记录用户消息和拥有该文件引用的系统消息（同步执行，请放到线程池调用）
+    
+    先写入两条消息，再增加引用计数，三者在同一个事务中提交；任何一步失败都整体回滚，
+    不会留下没有消息拥有的引用。在线程池中整体执行，请求被取消时也不会停在中途。
+    
+    Returns:
+        (上传记录, [用户消息, 系统消息])
+    """
+    try:
+        user_message = MessageService.create_message(db=db, chat_id=chat_id, text=prompt, sender="user",
+                                                     commit=False)
+        system_message = MessageService.create_message(db=db, chat_id=chat_id, text="已上传图像", sender="system",
+                                                       commit=False)
+        upload = UploadService.store_upload(db, tmp_path, sha256, size, extension, commit=False)
+        system_message.image_path = f"/api/uploads/{upload.filename}"  # 图片的访问URL
+        db.commit()
+    except Exception:
+        db.rollback()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    db.refresh(upload)
+    return upload, [user_message, system_message]
+
+
+def _discard_upload_messages(db: Session, messages: List[Message]) -> None:
+    """
+    后续步骤失败时删除_store_upload_with_messages记录的消息并释放它们拥有的上传文件引用
+    """
+    db.rollback()
+    image_paths = [message.image_path for message in messages if message.image_path]
+    for message in messages:
+        db.delete(message)
+    released = UploadService.release_uploads(db, image_paths)
+    try:
+        db.commit()
+    except Exception:
+        db.rollback()
+        UploadService.restore_released(released)
+        raise
+    UploadService.remove_released(released)
+
 @router.post("/image", response_model=AnalyzeResponse)
 @router.post("/image/", response_model=AnalyzeResponse)
 async def analyze_image(
@@ -25,6 +74,9 @@ async def analyze_image(
     task_type: str = Form("description"),
     model: str = Form("glm-4.5v"),
     chat_id: Optional[str] = Form(None),
+    use_cache: bool = Form(True),
+    profile: Optional[str] = Form(None),
+    tiled: Optional[bool] = Form(None),
     background_tasks: BackgroundTasks = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -36,7 +88,19 @@ async def analyze_image(
     - **prompt**: 分析提示或问题
     - **task_type**: 分析任务类型 (可选: description, detection, segmentation)
     - **model**: 使用的模型 (默认: glm-4.5v)
+    - **use_cache**: 是否使用分析结果缓存 (默认: true，传false强制重新分析)
+    - **profile**: 执行档位 (可选: fast, balanced, deep；任务积压时会自动降档)
+    - **tiled**: 是否分块分析大幅场景 (默认: 最长边超过TILED_ANALYSIS_MIN_SIDE时自动分块)
     """
+    # 确定执行档位
+    try:
+        execution_profile, _ = await execution_profiles.resolve(profile)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+    
     # 检查chat_id是否有效
     if chat_id:
         chat = ChatService.get_chat_by_id(db, chat_id)
@@ -61,54 +125,66 @@ async def analyze_image(
             detail="仅支持图像文件"
         )
     
-    # 保存上传的文件
+    # 在线程池中分块写入磁盘并计算哈希，不把整个文件读入内存，也不阻塞事件循环
     file_extension = os.path.splitext(file.filename)[1] if file.filename else ".jpg"
-    image_filename = f"{task_id}{file_extension}"
-    image_path = os.path.join(UPLOAD_FOLDER, image_filename)
     
     try:
-        contents = await file.read()
-        with open(image_path, "wb") as f:
-            f.write(contents)
+        tmp_path, sha256, size = await run_in_threadpool(UploadService.receive_upload, file.file)
+    except UploadTooLargeError as e:
+        raise HTTPException(
+            status_code=413,
+            detail=str(e)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"保存文件时出错: {str(e)}"
         )
     
-    # 将用户消息保存到数据库
-    MessageService.create_message(
-        db=db,
-        chat_id=chat_id,
-        text=prompt,
-        sender="user"
-    )
-    
-    # 记录系统消息（图片上传）
-    MessageService.create_message(
-        db=db,
-        chat_id=chat_id,
-        text="已上传图像",
-        sender="system",
-        image_path=f"/api/uploads/{image_filename}"  # 图片的访问URL
-    )
-    
-    # 记录处理中消息
-    MessageService.create_message(
-        db=db,
-        chat_id=chat_id,
-        text="正在分析图像，请稍候...",
-        sender="system"
-    )
-    
-    # 启动异步任务，传递chat_id参数
-    process_image_task.delay(task_id, image_path, prompt, task_type, chat_id)
+    # 按内容哈希保存上传的文件，相同图像只保存一份，并记录用户消息和图片上传消息（移动文件和数据库写入放到线程池执行）
+    try:
+        upload, messages = await run_in_threadpool(
+            _store_upload_with_messages, db, tmp_path, sha256, size, file_extension, chat_id, prompt
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"保存文件时出错: {str(e)}"
+        )
+    
+    image_filename = upload.filename
+    image_path = os.path.join(UPLOAD_FOLDER, image_filename)
+    
+    # 之后任何一步失败（包括请求被取消）都删除上面的消息并释放文件引用，不留下只有图片没有分析的对话
+    try:
+        # 第一次保存该图像时读取尺寸和地理参考（GeoTIFF的仿射变换和坐标参考系），用于导出地图坐标
+        if upload.width is None:
+            await run_in_threadpool(UploadService.update_georeference, db, upload)
+        
+        # 在进程池中生成一次供模型使用的标准化图像，后续分析和追问都直接读取它
+        if not os.path.exists(derived_image_path(image_path)):
+            await normalize_upload_async(image_path)
+        
+        # 记录处理中消息
+        messages.append(MessageService.create_message(
+            db=db,
+            chat_id=chat_id,
+            text="正在分析图像，请稍候...",
+            sender="system"
+        ))
+        
+        # 启动异步任务，传递chat_id参数
+        process_image_task.delay(task_id, image_path, prompt, task_type, chat_id, use_cache, execution_profile.name, tiled)
+    except BaseException:
+        _discard_upload_messages(db, messages)
+        raise
     
     return {
         "task_id": task_id,
         "chat_id": chat_id,
         "status": "processing",
-        "message": "图像已成功上传，分析正在进行中"
+        "message": "图像已成功上传，分析正在进行中",
+        "profile": execution_profile.name
     }
 
 @router.post("/image/url", response_model=AnalyzeResponse)
@@ -124,7 +200,8 @@ async def analyze_image_url(
       "image_url": "https://example.com/image.jpg",
       "prompt": "分析这张遥感图像",
       "task_type": "description",
-      "model": "glm-4.5v"
+      "model": "glm-4.5v",
+      "use_cache": true
     }
     ```
     """
@@ -144,6 +221,7 @@ async def analyze_image_url(
     prompt = data["prompt"]
     task_type = data.get("task_type", "description")
     model = data.get("model", "glm-4.5v")
+    use_cache = data.get("use_cache", True)
     
     # 生成唯一任务ID
     task_id = str(uuid.uuid4())
@@ -154,7 +232,8 @@ async def analyze_image_url(
             image_url=image_url, 
             prompt=prompt, 
             task_type=task_type, 
-            model=model
+            model=model,
+            use_cache=use_cache
         )
         
         if hasattr(result, "content"):
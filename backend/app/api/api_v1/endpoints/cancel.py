@@ -7,6 +7,7 @@ import logging
 from app.core.config import REDIS_HOST, REDIS_PORT, REDIS_DB
 from app.api.api_v1.endpoints.users import get_current_user
 from app.db.models import User
+from app.services.cancellation import publish_cancel
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -41,8 +42,8 @@ async def cancel_task(
         }
     
     try:
-        # 设置取消标志
-        redis.setex(f"task_cancel:{task_id}", 3600, "1")
+        # 设置取消标志并推送取消通知，正在执行的任务会立即中止上游调用
+        publish_cancel(redis, task_id)
         
         logger.info(f"用户 {current_user.username} 已请求取消任务 {task_id}")
         
@@ -1,19 +1,27 @@
 from fastapi import APIRouter, Body, Depends, HTTPException
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import Dict, Any, Optional
 import asyncio
+import logging
 import uuid
 import time
 import json
 
+from app.core.config import CONTEXT_MAX_MESSAGES
 from app.db.database import get_db
 from app.services.user_service import MessageService, ChatService
 from app.api.api_v1.endpoints.users import get_current_user
 from app.db.models import User, Message
 from app.services.zhipuai_service import zhipuai_service
+from app.services.context_builder import build_context_messages
+from app.services.execution_profiles import execution_profiles
+from app.services.artifact_store import artifact_store
+from app.utils.detection_parser import extract_object_coordinates
 from app.worker.tasks import process_text_task
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 @router.post("/text")
 async def process_text_message(
@@ -29,7 +37,9 @@ async def process_text_message(
     {
       "prompt": "问题文本",
       "chat_id": "聊天会话ID",
-      "task_type": "description" // 可选，可以是"mark_object"表示标记物体
+      "task_type": "description", // 可选，可以是"mark_object"表示标记物体
+      "use_cache": true, // 可选，传false强制重新分析
+      "profile": "balanced" // 可选，执行档位fast/balanced/deep，任务积压时会自动降档
     }
     ```
     """
@@ -48,6 +58,16 @@ async def process_text_message(
     prompt = data["prompt"]
     chat_id = data["chat_id"]
     task_type = data.get("task_type", "description")
+    use_cache = data.get("use_cache", True)
+    
+    # 确定执行档位
+    try:
+        execution_profile, _ = await execution_profiles.resolve(data.get("profile"))
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
     
     # 验证chat_id是否有效
     chat = ChatService.get_chat_by_id(db, chat_id)
@@ -65,11 +85,10 @@ async def process_text_message(
         sender="user"
     )
     
-    # 构建上下文，获取最近10条消息
-    messages = db.query(Message).filter(Message.chat_id == chat_id).order_by(Message.timestamp.desc()).limit(10).all()
+    # 获取最近的消息，按token预算打包上下文
+    messages = MessageService.get_last_messages(db, chat_id, CONTEXT_MAX_MESSAGES)
     messages = sorted(messages, key=lambda x: x.timestamp)
     
-    context_messages = []
     # 查找是否有图片消息
     has_image = False
     image_path = None
@@ -78,17 +97,9 @@ async def process_text_message(
         if msg.sender == "system" and msg.image_path:
             has_image = True
             image_path = msg.image_path
-        
-        if msg.sender == "user":
-            context_messages.append({
-                "role": "user", 
-                "content": msg.text
-            })
-        elif msg.sender == "ai":
-            context_messages.append({
-                "role": "assistant", 
-                "content": msg.text
-            })
+    
+    context_messages, context_tokens = build_context_messages(messages, current_prompt=prompt)
+    logger.info(f"聊天 {chat_id} 上下文: {len(context_messages)} 条消息, 约 {context_tokens} tokens")
     
     if not has_image:
         # 没有图片，返回错误
@@ -137,39 +148,34 @@ async def process_text_message(
     )
     
     try:
-        # 尝试使用base64编码图像而不是URL，这样可以更好地控制图像格式
-        import base64
-        
         # 根据task_type设置不同的任务类型
         api_task_type = task_type
         if task_type == "mark_object":
             api_task_type = "detection"
         
-        try:
-            # 读取图像文件并转换为base64
-            with open(local_image_path, "rb") as image_file:
-                image_base64 = base64.b64encode(image_file.read()).decode('utf-8')
-            
-            # 使用base64调用API
-            result = await zhipuai_service.analyze_image(
-                image_base64=image_base64,
-                prompt=prompt,
-                task_type=api_task_type,
-                context_messages=context_messages
-            )
-        except Exception as img_error:
-            # 如果base64方式失败，回退到URL方式尝试
-            image_url = f"http://localhost:8000{image_path.replace('/api', '')}"
-            result = await zhipuai_service.analyze_image(
-                image_url=image_url,
-                prompt=prompt,
-                task_type=api_task_type,
-                context_messages=context_messages
-            )
+        # 等待模型回复之前结束读事务，把数据库连接还给连接池；否则并发请求数超过连接池大小时，
+        # 后续请求在事件循环中等待连接，整个进程停止响应
+        db.commit()
+        
+        # 复用已生成的图像载荷（按档位限制分辨率），在线程池中读取，避免阻塞事件循环
+        # 始终以相同的方式传入图像，保证同一对话的请求前缀一致
+        image_base64, image_sha256 = await run_in_threadpool(
+            artifact_store.get, local_image_path, execution_profile.max_image_size
+        )
+        
+        result = await zhipuai_service.analyze_image(
+            image_base64=image_base64,
+            prompt=prompt,
+            task_type=api_task_type,
+            context_messages=context_messages,
+            use_cache=use_cache,
+            image_sha256=image_sha256,
+            profile=execution_profile.name
+        )
         
         # 处理结果
         if hasattr(result, "content"):
-            # 结果应该已经被zhipuai_service中的_clean_special_tags处理过
+            # 特殊标记已经在zhipuai_service接收流式输出时清理过
             content = result.content
         else:
             content = str(result)
@@ -177,88 +183,14 @@ async def process_text_message(
         # 删除处理中消息
         db.delete(processing_message)
         
-        # 再次确认内容已经被清理（以防漏网之鱼）
-        if content and hasattr(zhipuai_service, "_clean_special_tags"):
-            content = zhipuai_service._clean_special_tags(content)
         
         # 提取对象坐标（如果是标记物体任务）
         object_coordinates = None
         if task_type == "mark_object":
-            try:
-                # 尝试从结果中提取坐标信息
-                import re
-                import json
-                
-                # 首先尝试提取整个回复作为JSON
-                try:
-                    full_json = json.loads(content)
-                    # 检查是否是有效的坐标格式
-                    if isinstance(full_json, dict) and ('bbox' in full_json or 
-                            ('x' in full_json and 'y' in full_json and 'width' in full_json and 'height' in full_json)):
-                        object_coordinates = content
-                    elif isinstance(full_json, list) and len(full_json) > 0:
-                        # 如果是列表，检查第一个元素是否有效
-                        if isinstance(full_json[0], dict) and ('bbox' in full_json[0] or 
-                                ('x' in full_json[0] and 'y' in full_json[0] and 'width' in full_json[0] and 'height' in full_json[0])):
-                            object_coordinates = content
-                        # 检查是否是坐标数组 [x1,y1,x2,y2]
-                        elif len(full_json) >= 4 and all(isinstance(item, (int, float)) for item in full_json[:4]):
-                            object_coordinates = content
-                except:
-                    # 不是有效JSON，尝试提取JSON部分
-                    
-                    # 提取JSON格式的坐标信息，优先查找包含bbox或坐标的JSON
-                    bbox_json_pattern = r'\{"label":[^}]+,"bbox":\[[^\]]+\]\}'
-                    bbox_matches = re.findall(bbox_json_pattern, content)
-                    
-                    if bbox_matches:
-                        # 找到了bbox格式的JSON
-                        object_coordinates = bbox_matches[0]
-                    else:
-                        # 尝试查找一般的JSON对象
-                        json_pattern = r'\{(?:[^{}]|(?:\{[^{}]*\}))*\}'
-                        json_matches = re.findall(json_pattern, content)
-                        
-                        # 也尝试寻找方括号格式的数组
-                        array_pattern = r'\[(?:[^\[\]]|\[[^\[\]]*\])*\]'
-                        array_matches = re.findall(array_pattern, content)
-                        
-                        if json_matches:
-                            for match in json_matches:
-                                try:
-                                    obj = json.loads(match)
-                                    if isinstance(obj, dict) and ('bbox' in obj or 
-                                        ('x' in obj and 'y' in obj and 'width' in obj and 'height' in obj) or
-                                        'label' in obj):
-                                        object_coordinates = match
-                                        break
-                                except:
-                                    pass
-                                    
-                        if not object_coordinates and array_matches:
-                            for match in array_matches:
-                                try:
-                                    arr = json.loads(match)
-                                    if isinstance(arr, list):
-                                        if len(arr) >= 4 and all(isinstance(item, (int, float)) for item in arr[:4]):
-                                            # 可能是坐标数组 [x1,y1,x2,y2]
-                                            object_coordinates = match
-                                            break
-                                        elif len(arr) > 0 and isinstance(arr[0], dict):
-                                            # 检查是否是对象列表
-                                            if ('bbox' in arr[0] or 
-                                                ('x' in arr[0] and 'y' in arr[0] and 'width' in arr[0] and 'height' in arr[0])):
-                                                object_coordinates = match
-                                                break
-                                except:
-                                    pass
-                
-                # 如果还是没找到，但是知道这是标记物体任务，创建一个默认坐标
-                if not object_coordinates:
-                    print(f"无法从内容中提取坐标信息: {content}")
-                    # 不创建默认坐标，让前端处理
-            except Exception as e:
-                print(f"提取坐标信息时出错: {e}")
+            object_coordinates = extract_object_coordinates(content)
+            if not object_coordinates:
+                # 不创建默认坐标，让前端处理
+                logger.warning(f"无法从内容中提取坐标信息: {content}")
         
         # 添加AI回复
         MessageService.create_message(
@@ -268,7 +200,8 @@ async def process_text_message(
             sender="ai",
             thinking=result.thinking if hasattr(result, "thinking") else None,
             object_coordinates=object_coordinates,
-            is_object_mark=(task_type == "mark_object")
+            is_object_mark=(task_type == "mark_object"),
+            prompt_version=getattr(result, "prompt_version", None)
         )
         
         db.commit()
@@ -278,7 +211,9 @@ async def process_text_message(
             "result": content,
             "thinking": result.thinking if hasattr(result, "thinking") else None,
             "object_coordinates": object_coordinates,
-            "is_object_mark": (task_type == "mark_object")
+            "is_object_mark": (task_type == "mark_object"),
+            "context_tokens": context_tokens,
+            "profile": execution_profile.name
         }
         
     except Exception as e:
@@ -324,7 +259,9 @@ async def process_text_message_async(
     {
       "prompt": "问题文本",
       "chat_id": "聊天会话ID",
-      "task_type": "description" // 可选，可以是"mark_object"表示标记物体
+      "task_type": "description", // 可选，可以是"mark_object"表示标记物体
+      "use_cache": true, // 可选，传false强制重新分析
+      "profile": "balanced" // 可选，执行档位fast/balanced/deep，任务积压时会自动降档
     }
     ```
     
@@ -352,6 +289,16 @@ async def process_text_message_async(
     prompt = data["prompt"]
     chat_id = data["chat_id"]
     task_type = data.get("task_type", "description")
+    use_cache = data.get("use_cache", True)
+    
+    # 确定执行档位
+    try:
+        execution_profile, _ = await execution_profiles.resolve(data.get("profile"))
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
     
     # 验证chat_id是否有效
     chat = ChatService.get_chat_by_id(db, chat_id)
@@ -384,6 +331,7 @@ async def process_text_message_async(
         "chat_id": chat_id,
         "prompt": prompt,
         "task_type": task_type,
+        "profile": execution_profile.name,
         "user_id": current_user.id,
         "status": "submitted",
         "submitted_at": time.time()
@@ -397,12 +345,13 @@ async def process_text_message_async(
     
     # 提交异步任务
     try:
-        process_text_task.delay(task_id, prompt, chat_id, task_type)
+        process_text_task.delay(task_id, prompt, chat_id, task_type, use_cache, execution_profile.name)
         
         return {
             "task_id": task_id,
             "status": "submitted", 
-            "message": "文本处理任务已提交"
+            "message": "文本处理任务已提交",
+            "profile": execution_profile.name
         }
         
     except Exception as e:
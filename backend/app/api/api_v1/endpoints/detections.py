@@ -0,0 +1,114 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from typing import Dict, Any, Optional
+
+from app.db.database import get_db
+from app.db.models import User
+from app.services.geo_export import stream_detections, MEDIA_TYPES, FORMAT_GEOJSON
+from app.services.user_service import ChatService, DetectionService
+from app.api.api_v1.endpoints.users import get_current_user
+
+router = APIRouter()
+
+
+def _parse_bbox(bbox: str):
+    """解析查询参数中的区域：x1,y1,x2,y2（0-1相对坐标）"""
+    try:
+        values = [float(v) for v in bbox.split(",")]
+    except ValueError:
+        values = []
+    if len(values) != 4:
+        raise HTTPException(
+            status_code=400,
+            detail="bbox格式应为x1,y1,x2,y2"
+        )
+    x1, y1, x2, y2 = values
+    return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+
+
+@router.get("")
+@router.get("/")
+async def query_detections(
+    label: Optional[str] = None,
+    bbox: Optional[str] = None,
+    chat_id: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+) -> Dict[str, Any]:
+    """
+    查询当前用户所有聊天中的检测结果
+
+    - **label**: 只返回该标签的检测框（可选）
+    - **bbox**: 查询区域x1,y1,x2,y2，0-1相对坐标，只返回与该区域相交的检测框（可选）
+    - **chat_id**: 只返回该聊天中的检测框（可选）
+    - **limit**: 最多返回的数量，默认100
+    """
+    detections = DetectionService.query(
+        db,
+        current_user.id,
+        label=label,
+        bbox=_parse_bbox(bbox) if bbox is not None else None,
+        chat_id=chat_id,
+        limit=limit
+    )
+
+    result = []
+    for detection in detections:
+        pixel_bbox = None
+        if detection.pixel_x1 is not None:
+            pixel_bbox = [detection.pixel_x1, detection.pixel_y1, detection.pixel_x2, detection.pixel_y2]
+        result.append({
+            "id": detection.id,
+            "message_id": detection.message_id,
+            "chat_id": detection.chat_id,
+            "label": detection.label,
+            "bbox": [detection.x1, detection.y1, detection.x2, detection.y2],
+            "pixel_bbox": pixel_bbox
+        })
+
+    return {
+        "count": len(result),
+        "detections": result
+    }
+
+
+@router.get("/export")
+async def export_detections(
+    chat_id: Optional[str] = None,
+    scene: Optional[str] = None,
+    label: Optional[str] = None,
+    format: str = Query(FORMAT_GEOJSON, pattern="^(geojson|ndjson)$"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    以GeoJSON或NDJSON格式流式导出一个聊天或一幅场景的检测结果
+
+    - **chat_id**: 导出该聊天中的检测框（与scene至少提供一个）
+    - **scene**: 导出该上传图像上的检测框（上传文件名，消息image_path中/api/uploads/之后的部分）
+    - **label**: 只导出该标签的检测框（可选）
+    - **format**: geojson（FeatureCollection，默认）或ndjson（每行一个Feature）
+
+    GeoTIFF上的检测框按上传时读取的仿射变换和坐标参考系投影为WGS84经纬度多边形，
+    没有地理参考的图像上的检测框geometry为null。
+    """
+    if chat_id is None and scene is None:
+        raise HTTPException(
+            status_code=400,
+            detail="需要提供chat_id或scene"
+        )
+    if chat_id is not None:
+        chat = ChatService.get_chat_by_id(db, chat_id)
+        if not chat or chat.user_id != current_user.id:
+            raise HTTPException(
+                status_code=404,
+                detail="聊天会话不存在或不属于当前用户"
+            )
+
+    return StreamingResponse(
+        stream_detections(format, current_user.id, chat_id=chat_id, scene=scene, label=label),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="detections.{format}"'}
+    )
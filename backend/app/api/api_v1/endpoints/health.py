@@ -1,5 +1,15 @@
 from fastapi import APIRouter
 
+from app.services.artifact_store import artifact_store
+from app.services.circuit_breaker import circuit_breakers
+from app.services.execution_profiles import execution_profiles
+from app.services.hedging import hedge_policy
+from app.services.rate_limiter import rate_limiter
+from app.services.result_cache import result_cache
+from app.services.single_flight import single_flight
+from app.services.tile_service import tile_service
+from app.services.zhipuai_service import zhipuai_service
+
 router = APIRouter()
 
 @router.get("/")
@@ -8,3 +18,63 @@ async def health_check():
     健康检查端点
     """
     return {"status": "ok", "message": "服务正常运行"}
+
+@router.get("/cache")
+async def cache_stats():
+    """
+    分析结果缓存的命中统计，以及相同请求合并的统计
+    """
+    stats = await result_cache.stats()
+    stats["single_flight"] = await single_flight.stats()
+    return stats
+
+@router.get("/rate-limits")
+async def rate_limit_stats():
+    """
+    各模型的限流配置，以及每个API密钥（账号）当前的全局并发数和429冷却状态
+    """
+    accounts = {key.account_id: key.masked_key for key in zhipuai_service.key_pool.keys}
+    return await rate_limiter.stats(accounts)
+
+@router.get("/model-keys")
+async def model_key_stats():
+    """
+    当前进程中每个API密钥的吞吐、延迟、错误率和剔除状态
+    """
+    return zhipuai_service.key_pool.stats()
+
+
+@router.get("/hedging")
+async def hedging_stats():
+    """
+    当前进程中各模型的首token延迟分位数、对冲请求数和对冲胜出率
+    """
+    return hedge_policy.stats()
+
+@router.get("/circuit-breakers")
+async def circuit_breaker_stats():
+    """
+    各模型熔断器的状态（关闭/打开/半开）、失败率、慢调用比例和备用模型路由次数
+    """
+    return await circuit_breakers.stats()
+
+@router.get("/profiles")
+async def execution_profile_stats():
+    """
+    各执行档位的配置、调用次数、自动降档次数和延迟分位数，以及当前任务队列长度
+    """
+    return await execution_profiles.stats()
+
+@router.get("/artifacts")
+async def artifact_stats():
+    """
+    当前进程中图像载荷缓存的内存占用、内存/磁盘命中数和淘汰次数
+    """
+    return artifact_store.stats()
+
+@router.get("/tiles")
+async def tile_stats():
+    """
+    当前进程中地图图块缓存的内存占用、内存/磁盘命中数、渲染次数和已生成的金字塔数
+    """
+    return tile_service.stats()
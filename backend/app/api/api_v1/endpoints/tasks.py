@@ -22,6 +22,8 @@ async def get_task_status(task_id: str, redis: Redis = Depends(get_redis_client)
     获取任务状态和结果
     
     - **task_id**: 任务ID，由提交分析请求时返回
+    
+    检测任务处理中时，detections包含已经从流式输出中解析出的检测结果（0-1相对坐标）
     """
     # 从Redis获取任务结果
     task_key = f"task_result:{task_id}"
@@ -33,7 +35,8 @@ async def get_task_status(task_id: str, redis: Redis = Depends(get_redis_client)
             return {
                 "task_id": task_id,
                 "status": "processing",
-                "message": "分析正在进行中"
+                "message": "分析正在进行中",
+                "detections": [json.loads(item) for item in redis.lrange(f"task_progress:{task_id}", 0, -1)]
             }
         else:
             raise HTTPException(status_code=404, detail=f"未找到任务 ID: {task_id}")
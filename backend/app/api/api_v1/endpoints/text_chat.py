@@ -1,15 +1,19 @@
 from fastapi import APIRouter, Body, Depends, HTTPException
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import Dict, Any, Optional
-import asyncio
+import logging
 
 from app.db.database import get_db
 from app.services.user_service import MessageService, ChatService
 from app.api.api_v1.endpoints.users import get_current_user
 from app.db.models import User
 from app.services.zhipuai_service import zhipuai_service
+from app.services.context_builder import build_context_messages
+from app.services.artifact_store import artifact_store
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 @router.post("/text", response_model=Dict[str, Any])
 async def process_text_message(
@@ -25,11 +29,13 @@ async def process_text_message(
     {
         "prompt": "分析这张图像中的...",
         "chat_id": "聊天ID",
+        "use_cache": true // 可选，传false强制重新分析
     }
     ```
     """
     prompt = data.get("prompt")
     chat_id = data.get("chat_id")
+    use_cache = data.get("use_cache", True)
     
     if not prompt:
         raise HTTPException(status_code=400, detail="缺少必要参数: prompt")
@@ -78,19 +84,9 @@ async def process_text_message(
         sender="system"
     )
     
-    # 构建上下文消息
-    context_messages = []
-    for msg in messages:
-        if msg.sender == "user":
-            context_messages.append({
-                "role": "user",
-                "content": msg.text
-            })
-        elif msg.sender == "ai":
-            context_messages.append({
-                "role": "assistant",
-                "content": msg.text
-            })
+    # 在token预算内从最近的对话开始构建上下文消息
+    context_messages, context_tokens = build_context_messages(messages, current_prompt=prompt)
+    logger.info(f"聊天 {chat_id} 上下文: {len(context_messages)} 条消息, 约 {context_tokens} tokens")
     
     try:
         # 从图像路径获取图像
@@ -100,21 +96,23 @@ async def process_text_message(
         
         import os
         from app.core.config import UPLOAD_FOLDER
-        import base64
         
         full_image_path = os.path.join(UPLOAD_FOLDER, image_path)
         
-        # 读取图像并转换为Base64
-        with open(full_image_path, "rb") as image_file:
-            image_base64 = base64.b64encode(image_file.read()).decode('utf-8')
+        # 等待模型回复之前结束读事务，把数据库连接还给连接池
+        db.commit()
+        
+        # 在线程池中获取已生成的图像载荷，避免阻塞事件循环
+        image_base64, image_sha256 = await run_in_threadpool(artifact_store.get, full_image_path)
         
         # 调用智谱AI分析图像
-        loop = asyncio.get_event_loop()
         result = await zhipuai_service.analyze_image(
             image_base64=image_base64,
             prompt=prompt,
             task_type="description",
-            context_messages=context_messages
+            context_messages=context_messages,
+            use_cache=use_cache,
+            image_sha256=image_sha256
         )
         
         if hasattr(result, "content"):
@@ -134,14 +132,16 @@ async def process_text_message(
             chat_id=chat_id,
             text=content,
             sender="ai",
-            thinking=thinking
+            thinking=thinking,
+            prompt_version=getattr(result, "prompt_version", None)
         )
         
         return {
             "status": "success",
             "message": "文本处理成功",
             "result": content,
-            "thinking": thinking
+            "thinking": thinking,
+            "context_tokens": context_tokens
         }
         
     except Exception as e:
@@ -0,0 +1,85 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
+import logging
+import os
+
+from app.core.config import API_PREFIX, UPLOAD_FOLDER
+from app.services.tile_service import tile_service
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# 图块按内容寻址，可以长期缓存
+_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _upload_path(filename: str) -> str:
+    """检查文件名并返回上传文件的本地路径"""
+    path = os.path.join(UPLOAD_FOLDER, filename)
+    if os.path.basename(filename) != filename or filename.startswith(".") or not os.path.isfile(path):
+        raise HTTPException(
+            status_code=404,
+            detail="图像不存在"
+        )
+    return path
+
+
+@router.get("/{filename}/info")
+async def tile_info(filename: str):
+    """
+    获取上传图像的金字塔信息，第一次请求时生成金字塔
+    
+    - **filename**: 上传文件名（消息image_path中/api/uploads/之后的部分）
+    
+    返回宽高、图块边长、最高缩放级别和图块URL模板。0级用一个图块覆盖整幅图像，
+    最高级为原始分辨率；右侧和下侧边缘的图块可能小于图块边长。
+    """
+    path = _upload_path(filename)
+    try:
+        info = await tile_service.pyramid_info(path)
+    except Exception as e:
+        logger.error(f"生成金字塔影像时出错: {str(e)}")
+        raise HTTPException(
+            status_code=422,
+            detail=f"无法读取该图像: {str(e)}"
+        )
+    return {
+        **info,
+        "url": f"{API_PREFIX}/tiles/{filename}/{{z}}/{{x}}/{{y}}.jpg"
+    }
+
+
+@router.get("/{filename}/{z}/{x}/{y}.jpg")
+async def get_tile(filename: str, z: int, x: int, y: int, request: Request):
+    """
+    获取上传图像的一个图块（JPEG）
+    
+    - **filename**: 上传文件名
+    - **z**: 缩放级别
+    - **x**: 图块列号
+    - **y**: 图块行号
+    """
+    path = _upload_path(filename)
+    etag = tile_service.etag(path, z, x, y)
+    headers = {"ETag": etag, "Cache-Control": _CACHE_CONTROL}
+    
+    # 浏览器已缓存该图块
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        data = await tile_service.get_tile(path, z, x, y)
+    except Exception as e:
+        logger.error(f"读取图块时出错: {str(e)}")
+        raise HTTPException(
+            status_code=422,
+            detail=f"无法读取该图像: {str(e)}"
+        )
+    if data is None:
+        raise HTTPException(
+            status_code=404,
+            detail="图块超出图像范围"
+        )
+    return Response(content=data, media_type="image/jpeg", headers=headers)
@@ -176,7 +176,8 @@ async def get_chat_messages(
             "thinking": msg.thinking,
             "error": msg.error,
             "object_coordinates": msg.object_coordinates,
-            "is_object_mark": msg.is_object_mark
+            "is_object_mark": msg.is_object_mark,
+            "prompt_version": msg.prompt_version
         }
         result.append(message_data)
     
@@ -1,4 +1,5 @@
 import os
+import json
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -17,6 +18,61 @@ REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 REDIS_DB = int(os.getenv("REDIS_DB", 0))
 REDIS_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}"
 
+# 模型调用限流配置（所有API进程和worker共享）
+# 按模型配置每分钟请求数(rpm)、令牌桶容量(burst)和全局并发数(concurrency)，"default"用于未列出的模型
+# 这些是每个API密钥（服务商账号）的预算：配置N个密钥时总吞吐和总并发为N倍
+MODEL_RATE_LIMITS = json.loads(os.getenv(
+    "MODEL_RATE_LIMITS",
+    '{"glm-4.5v": {"rpm": 60, "burst": 10, "concurrency": 20}, "glm-4v": {"rpm": 120, "burst": 20, "concurrency": 40}}'
+))
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", 30))  # 配额用完时最长排队时间（秒）
+MODEL_RATE_LIMIT_RETRIES = int(os.getenv("MODEL_RATE_LIMIT_RETRIES", 3))  # 收到429后的最大重试次数
+
+# 对冲请求配置：首token迟迟未到达时发起第二个相同的请求，先输出的一方胜出
+MODEL_HEDGING_ENABLED = os.getenv("MODEL_HEDGING_ENABLED", "false").lower() == "true"  # 默认是否启用对冲
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 95))  # 等待时间取首token延迟的该百分位
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", 1.0))  # 最短等待时间（秒）
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", 10.0))  # 延迟样本不足时的等待时间（秒）
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 20))  # 至少有这么多样本才按百分位计算
+HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", 0.1))  # 对冲请求占请求数的最大比例
+HEDGE_WINDOW = float(os.getenv("HEDGE_WINDOW", 60))  # 统计对冲比例的时间窗口（秒）
+
+# 熔断器配置：按模型统计失败率和慢调用比例，熔断时快速失败或改用备用模型
+CIRCUIT_BREAKER_ENABLED = os.getenv("CIRCUIT_BREAKER_ENABLED", "true").lower() == "true"
+CIRCUIT_BREAKER_WINDOW = int(os.getenv("CIRCUIT_BREAKER_WINDOW", 20))  # 统计的最近调用数
+CIRCUIT_BREAKER_MIN_SAMPLES = int(os.getenv("CIRCUIT_BREAKER_MIN_SAMPLES", 10))  # 至少有这么多次调用才判断是否熔断
+CIRCUIT_BREAKER_ERROR_THRESHOLD = float(os.getenv("CIRCUIT_BREAKER_ERROR_THRESHOLD", 0.5))  # 失败率超过该值时熔断
+CIRCUIT_BREAKER_SLOW_SECONDS = float(os.getenv("CIRCUIT_BREAKER_SLOW_SECONDS", 120))  # 超过该耗时（秒）视为慢调用
+CIRCUIT_BREAKER_SLOW_THRESHOLD = float(os.getenv("CIRCUIT_BREAKER_SLOW_THRESHOLD", 0.8))  # 慢调用比例超过该值时熔断
+CIRCUIT_BREAKER_OPEN_SECONDS = float(os.getenv("CIRCUIT_BREAKER_OPEN_SECONDS", 30))  # 熔断持续时间（秒），之后进入半开状态
+CIRCUIT_BREAKER_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_BREAKER_HALF_OPEN_PROBES", 1))  # 半开状态下同时放行的探测请求数
+MODEL_FALLBACKS = json.loads(os.getenv("MODEL_FALLBACKS", '{"glm-4.5v": "glm-4v"}'))  # 熔断时使用的备用模型
+
+# API密钥池配置
+KEY_POOL_WINDOW = int(os.getenv("KEY_POOL_WINDOW", 20))  # 统计错误率的最近调用数
+KEY_POOL_MIN_SAMPLES = int(os.getenv("KEY_POOL_MIN_SAMPLES", 5))  # 至少有这么多次调用才判断是否剔除
+KEY_POOL_ERROR_THRESHOLD = float(os.getenv("KEY_POOL_ERROR_THRESHOLD", 0.5))  # 错误和429比例超过该值时剔除密钥
+KEY_POOL_EJECT_SECONDS = float(os.getenv("KEY_POOL_EJECT_SECONDS", 60))  # 密钥被剔除后的冷却时间（秒）
+
+# Celery Worker配置
+# 模型调用是I/O密集型任务，使用threads池时同一进程可以并发执行多个任务，共享一个常驻事件循环和连接池
+CELERY_WORKER_POOL = os.getenv("CELERY_WORKER_POOL", "prefork")
+CELERY_WORKER_CONCURRENCY = int(os.getenv("CELERY_WORKER_CONCURRENCY", 0)) or None  # 0表示使用Celery默认值
+WORKER_MODEL_CONCURRENCY = int(os.getenv("WORKER_MODEL_CONCURRENCY", 32))  # 每个worker进程同时进行的模型调用数上限
+CELERY_QUEUE_NAME = os.getenv("CELERY_QUEUE_NAME", "celery")  # 分析任务所在的队列，用于判断负载
+
+# 执行档位配置：每个档位指定模型、是否开启思考、图像最长边上限（像素）和最大输出token数
+# downgrade_to为负载过高时降到的档位；默认档位deep与原来的行为一致
+EXECUTION_PROFILES = json.loads(os.getenv(
+    "EXECUTION_PROFILES",
+    '{"fast": {"model": "glm-4.5v", "thinking": false, "max_image_size": 768, "max_tokens": 512}, '
+    '"balanced": {"model": "glm-4.5v", "thinking": false, "max_image_size": 1536, "max_tokens": 2048, "downgrade_to": "fast"}, '
+    '"deep": {"model": "glm-4.5v", "thinking": true, "max_image_size": null, "max_tokens": null, "downgrade_to": "balanced"}}'
+))
+DEFAULT_EXECUTION_PROFILE = os.getenv("DEFAULT_EXECUTION_PROFILE", "deep")
+# 任务队列长度每超过一个阈值就自动降一档（逗号分隔）
+PROFILE_DOWNGRADE_QUEUE_DEPTHS = [int(depth) for depth in os.getenv("PROFILE_DOWNGRADE_QUEUE_DEPTHS", "50,200").split(",") if depth.strip()]
+
 # 数据库配置
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./yaogan_chat.db")
 
@@ -27,11 +83,72 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 60 *
 
 # 智谱AI GLM-4.5v API配置
 ZHIPUAI_API_KEY = os.getenv("ZHIPUAI_API_KEY")
+# 多个账号的API密钥（逗号分隔），请求在这些密钥之间负载均衡；未配置时使用ZHIPUAI_API_KEY
+ZHIPUAI_API_KEYS = [key.strip() for key in os.getenv("ZHIPUAI_API_KEYS", "").split(",") if key.strip()] \
+    or ([ZHIPUAI_API_KEY] if ZHIPUAI_API_KEY else [])
+ZHIPUAI_BASE_URL = os.getenv("ZHIPUAI_BASE_URL", "https://open.bigmodel.cn/api/paas/v4")
+ZHIPUAI_TIMEOUT = float(os.getenv("ZHIPUAI_TIMEOUT", 300))  # 单次调用的读超时（秒）
+ZHIPUAI_MAX_CONNECTIONS = int(os.getenv("ZHIPUAI_MAX_CONNECTIONS", 500))  # 每个进程的最大并发连接数
+
+# 模型后端配置："zhipu"调用智谱AI，"fake"使用离线模拟后端（用于压测，不访问网络）
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "zhipu")
+FAKE_MODEL_TOKENS = int(os.getenv("FAKE_MODEL_TOKENS", 200))  # 每次回复输出的token数
+FAKE_MODEL_THINKING_TOKENS = int(os.getenv("FAKE_MODEL_THINKING_TOKENS", 50))  # 思考过程输出的token数
+FAKE_MODEL_TOKEN_RATE = float(os.getenv("FAKE_MODEL_TOKEN_RATE", 50))  # 每秒输出的token数，0表示不限速
+FAKE_MODEL_LATENCY = os.getenv("FAKE_MODEL_LATENCY", "lognormal:0.8,0.5")  # 首token延迟分布（fixed/uniform/lognormal）
+FAKE_MODEL_ERROR_RATE = float(os.getenv("FAKE_MODEL_ERROR_RATE", 0))  # 模拟500错误的概率
+FAKE_MODEL_RATE_LIMIT_RATE = float(os.getenv("FAKE_MODEL_RATE_LIMIT_RATE", 0))  # 模拟429的概率
+FAKE_MODEL_RETRY_AFTER = float(os.getenv("FAKE_MODEL_RETRY_AFTER", 1))  # 模拟429的retry-after（秒）
+FAKE_MODEL_DETECTIONS = int(os.getenv("FAKE_MODEL_DETECTIONS", 3))  # 检测任务返回的目标数量
+FAKE_MODEL_SEED = int(os.getenv("FAKE_MODEL_SEED")) if os.getenv("FAKE_MODEL_SEED") else None  # 随机数种子
+
+# 分析结果缓存配置
+ANALYSIS_CACHE_ENABLED = os.getenv("ANALYSIS_CACHE_ENABLED", "true").lower() == "true"
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", 7 * 86400))  # 缓存保留7天
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", 10000))
+
+# 对话上下文配置
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 4000))  # 每次请求携带的历史对话token预算
+CONTEXT_MAX_AI_TOKENS = int(os.getenv("CONTEXT_MAX_AI_TOKENS", 800))  # 较早的AI回答被截断到的token数
+CONTEXT_MAX_MESSAGES = int(os.getenv("CONTEXT_MAX_MESSAGES", 50))  # 构建上下文时最多读取的历史消息数
+
+# 相同请求合并配置
+SINGLE_FLIGHT_LOCK_TTL = int(os.getenv("SINGLE_FLIGHT_LOCK_TTL", 600))  # leader锁的最长持有时间（秒）
+SINGLE_FLIGHT_WAIT_TIMEOUT = int(os.getenv("SINGLE_FLIGHT_WAIT_TIMEOUT", 600))  # follower等待leader结果的最长时间（秒）
 
 # 文件上传配置
 BASE_DIR = Path(__file__).resolve().parent.parent
 UPLOAD_FOLDER = os.path.join(BASE_DIR, os.getenv("UPLOAD_FOLDER", "uploads"))
 MAX_CONTENT_LENGTH = int(os.getenv("MAX_CONTENT_LENGTH", 16777216))  # 16MB
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))  # 上传文件分块写入磁盘的大小（字节）
+
+# 上传图像标准化配置：上传时生成一次供模型使用的JPEG派生图像
+# 派生文件（标准化图像、元数据、金字塔和图块缓存）目录，不能放在公开挂载的UPLOAD_FOLDER中
+DERIVED_FOLDER = os.path.join(BASE_DIR, os.getenv("DERIVED_FOLDER", "derived"))
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", 1024))  # 标准化图像的最长边（像素）
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", 90))  # 标准化图像的JPEG质量
+IMAGE_PROCESS_WORKERS = int(os.getenv("IMAGE_PROCESS_WORKERS", 2))  # 图像处理进程池大小
+
+# 图像载荷存储配置：保存编码好的Base64载荷，追问时直接复用
+ARTIFACT_FOLDER = os.path.join(DERIVED_FOLDER, "artifacts")  # 按内容哈希寻址的载荷目录
+ARTIFACT_MEMORY_CACHE_BYTES = int(os.getenv("ARTIFACT_MEMORY_CACHE_MB", 64)) * 1024 * 1024  # 每个进程内LRU缓存的字节上限
+
+# 地图图块服务配置：每个上传图像生成一次金字塔，按缩放级别提供图块
+MAP_TILE_FOLDER = os.path.join(DERIVED_FOLDER, "tiles")  # 图块磁盘缓存目录
+MAP_TILE_SIZE = int(os.getenv("MAP_TILE_SIZE", 256))  # 图块边长（像素）
+MAP_TILE_MEMORY_CACHE_BYTES = int(os.getenv("MAP_TILE_MEMORY_CACHE_MB", 64)) * 1024 * 1024  # 每个进程内图块LRU缓存的字节上限
+
+# 大幅场景分块分析配置
+TILED_ANALYSIS_MIN_SIDE = int(os.getenv("TILED_ANALYSIS_MIN_SIDE", 4096))  # 未指定时，最长边超过该值（像素）自动分块分析
+TILE_SIZE = int(os.getenv("TILE_SIZE", 1024))  # 图块边长（像素）
+TILE_OVERLAP = int(os.getenv("TILE_OVERLAP", 128))  # 相邻图块的重叠宽度（像素），避免目标被切断
+TILE_CONCURRENCY = int(os.getenv("TILE_CONCURRENCY", 4))  # 每个任务同时分析的图块数
+TILE_MAX_TILES = int(os.getenv("TILE_MAX_TILES", 256))  # 单个场景的图块数上限
+TILE_MAX_IMAGE_SIZE = int(os.getenv("TILE_MAX_IMAGE_SIZE", 1024))  # 发送给模型的图块最长边（像素）
+
+# 检测结果导出配置
+DETECTION_EXPORT_CHUNK_SIZE = int(os.getenv("DETECTION_EXPORT_CHUNK_SIZE", 1000))  # 导出时每次从数据库读取并输出的检测框数
 
 # 确保上传文件夹存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(DERIVED_FOLDER, exist_ok=True)
@@ -0,0 +1,31 @@
+import asyncio
+
+from redis import Redis
+from redis import asyncio as aioredis
+
+from app.core.config import REDIS_HOST, REDIS_PORT, REDIS_DB
+
+# 同步客户端在进程内共享一个连接池
+_redis = None
+
+# 异步客户端的连接池不能跨事件循环复用，按事件循环分别创建
+_async_redis = None
+_async_redis_loop = None
+
+
+def get_redis() -> Redis:
+    """获取进程内共享的同步Redis客户端"""
+    global _redis
+    if _redis is None:
+        _redis = Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
+    return _redis
+
+
+def get_async_redis() -> aioredis.Redis:
+    """获取绑定到当前事件循环的异步Redis客户端"""
+    global _async_redis, _async_redis_loop
+    loop = asyncio.get_running_loop()
+    if _async_redis is None or _async_redis_loop is not loop:
+        _async_redis = aioredis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
+        _async_redis_loop = loop
+    return _async_redis
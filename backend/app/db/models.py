@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean, Float, DDL, Index, event
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
@@ -47,7 +47,66 @@ class Message(Base):
     error = Column(Boolean, default=False)  # 是否为错误消息
     object_coordinates = Column(Text, nullable=True)  # 物体坐标信息（JSON格式）
     is_object_mark = Column(Boolean, default=False)  # 是否为物体标记消息
+    prompt_version = Column(String, nullable=True)  # 生成AI回复时使用的提示模板版本
     timestamp = Column(DateTime, default=datetime.utcnow)
     
     # 与Chat表的关系
     chat = relationship("Chat", back_populates="messages")
+    # 与Detection表的关系
+    detections = relationship("Detection", back_populates="message", cascade="all, delete-orphan")
+
+class Upload(Base):
+    __tablename__ = "uploads"
+    
+    sha256 = Column(String, primary_key=True)  # 文件内容的SHA-256，相同内容只保存一份
+    filename = Column(String, unique=True)  # 上传目录中的文件名：{sha256}{扩展名}
+    size = Column(Integer)  # 文件大小（字节）
+    ref_count = Column(Integer, default=0)  # 引用该文件的消息数（Message.image_path）
+    created_at = Column(DateTime, default=datetime.utcnow)
+    width = Column(Integer, nullable=True)  # 原始图像宽度（像素）
+    height = Column(Integer, nullable=True)  # 原始图像高度（像素）
+    crs = Column(Text, nullable=True)  # 坐标参考系（WKT），没有地理参考时为空
+    transform = Column(String, nullable=True)  # 仿射变换系数[a, b, c, d, e, f]（JSON格式），没有地理参考时为空
+
+class Detection(Base):
+    __tablename__ = "detections"
+    __table_args__ = (
+        # 没有R*Tree的数据库（PostgreSQL）按坐标范围查询时使用的组合索引
+        Index("ix_detections_bbox", "x1", "y1", "x2", "y2").ddl_if(dialect="postgresql"),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)  # 与R*Tree索引中的id相同
+    message_id = Column(String, ForeignKey("messages.id"), index=True)  # 检测结果所在的AI消息
+    chat_id = Column(String, ForeignKey("chats.id"), index=True)
+    upload_filename = Column(String, index=True, nullable=True)  # 检测所用的上传图像（Upload.filename）
+    label = Column(String, index=True)
+    # 0-1之间的相对坐标（左上角在前）
+    x1 = Column(Float)
+    y1 = Column(Float)
+    x2 = Column(Float)
+    y2 = Column(Float)
+    # 原始图像上的像素坐标，图像尺寸未知时为空
+    pixel_x1 = Column(Float, nullable=True)
+    pixel_y1 = Column(Float, nullable=True)
+    pixel_x2 = Column(Float, nullable=True)
+    pixel_y2 = Column(Float, nullable=True)
+    
+    # 与Message表的关系
+    message = relationship("Message", back_populates="detections")
+
+# 检测框的R*Tree空间索引（SQLite虚拟表，按相对坐标），由触发器与detections表保持同步
+DETECTIONS_RTREE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS detections_rtree USING rtree(id, min_x, max_x, min_y, max_y)",
+    """CREATE TRIGGER IF NOT EXISTS detections_rtree_insert AFTER INSERT ON detections BEGIN
+        INSERT INTO detections_rtree VALUES (new.id, new.x1, new.x2, new.y1, new.y2);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS detections_rtree_update AFTER UPDATE OF x1, y1, x2, y2 ON detections BEGIN
+        UPDATE detections_rtree SET min_x = new.x1, max_x = new.x2, min_y = new.y1, max_y = new.y2 WHERE id = new.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS detections_rtree_delete AFTER DELETE ON detections BEGIN
+        DELETE FROM detections_rtree WHERE id = old.id;
+    END"""
+]
+
+for _statement in DETECTIONS_RTREE_DDL:
+    event.listen(Detection.__table__, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
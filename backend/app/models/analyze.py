@@ -34,6 +34,7 @@ class AnalyzeResponse(BaseModel):
     error: Optional[str] = Field(None, description="错误信息(如果有)")
     completed_at: Optional[float] = Field(None, description="完成时间戳")
     thinking: Optional[str] = Field(None, description="模型思考过程")
+    profile: Optional[str] = Field(None, description="实际使用的执行档位")
 
 
 class TaskResult(BaseModel):
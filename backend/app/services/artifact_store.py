@@ -0,0 +1,182 @@
+import base64
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from app.core.config import DERIVED_FOLDER, ARTIFACT_FOLDER, ARTIFACT_MEMORY_CACHE_BYTES
+from app.services.image_pipeline import model_image_path
+from app.utils.image_utils import encode_image_file
+
+logger = logging.getLogger(__name__)
+
+
+def _write_atomic(path: str, data: str) -> None:
+    """先写临时文件再替换，避免并发读取到写了一半的文件"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class DerivedArtifactStore:
+    """
+    发送给模型的图像载荷（Base64）存储
+
+    载荷按解码后内容的SHA-256寻址保存在ARTIFACT_FOLDER中，相同图像只保存一份；
+    每个上传图像在DERIVED_FOLDER中有一个引用文件指向它的载荷。同一对话的每一轮追问都直接读取载荷，
+    不再重新打开原图、缩放和编码。进程内另有按字节数淘汰的LRU缓存，命中时连文件都不用读。
+    """
+
+    def __init__(self, folder: str = ARTIFACT_FOLDER, ref_folder: str = DERIVED_FOLDER,
+                 memory_bytes: int = ARTIFACT_MEMORY_CACHE_BYTES):
+        self.folder = folder
+        self.ref_folder = ref_folder
+        self.memory_bytes = memory_bytes
+        self._memory: "OrderedDict[Tuple, Tuple[str, str]]" = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _artifact_path(self, sha256: str) -> str:
+        return os.path.join(self.folder, sha256[:2], f"{sha256}.b64")
+
+    def _ref_path(self, image_path: str, max_side: Optional[int]) -> str:
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        variant = f"max{max_side}" if max_side else "full"
+        return os.path.join(self.ref_folder, f"{stem}.{variant}.ref.json")
+
+    def _memory_get(self, key: Tuple) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+            return entry
+
+    def _memory_put(self, key: Tuple, entry: Tuple[str, str]) -> None:
+        size = len(entry[0])
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = entry
+            self._memory_size += size
+            while self._memory_size > self.memory_bytes:
+                _, (evicted, _) = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+                self.evictions += 1
+
+    def _load(self, ref_path: str, source_stat: os.stat_result) -> Optional[Tuple[str, str]]:
+        """按引用文件读取已生成的载荷，源文件变化或文件缺失时返回None"""
+        try:
+            with open(ref_path, "r", encoding="utf-8") as f:
+                ref = json.load(f)
+            if ref.get("mtime_ns") != source_stat.st_mtime_ns or ref.get("size") != source_stat.st_size:
+                return None
+            with open(self._artifact_path(ref["sha256"]), "r", encoding="utf-8") as f:
+                return f.read(), ref["sha256"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _generate(self, source: str, ref_path: str, source_stat: os.stat_result,
+                  max_side: Optional[int]) -> Tuple[str, str]:
+        """编码图像并保存载荷和引用文件"""
+        image_base64 = encode_image_file(source, max_side)
+        # 与result_cache.hash_image一致：对解码后的图像内容计算哈希
+        sha256 = hashlib.sha256(base64.b64decode(image_base64)).hexdigest()
+        try:
+            artifact_path = self._artifact_path(sha256)
+            if not os.path.exists(artifact_path):
+                os.makedirs(os.path.dirname(artifact_path), exist_ok=True)
+                _write_atomic(artifact_path, image_base64)
+            _write_atomic(ref_path, json.dumps({
+                "sha256": sha256,
+                "source": os.path.basename(source),
+                "mtime_ns": source_stat.st_mtime_ns,
+                "size": source_stat.st_size
+            }))
+        except OSError as e:
+            logger.warning(f"保存图像载荷时出错: {str(e)}")
+        return image_base64, sha256
+
+    def get(self, image_path: str, max_side: Optional[int] = None) -> Tuple[str, str]:
+        """
+        获取上传图像发送给模型的Base64载荷（同步执行，在事件循环中请放到线程池调用）
+
+        优先使用上传时生成的标准化图像；依次查找进程内缓存、磁盘载荷，都没有时编码一次并保存。
+
+        Args:
+            image_path: 上传图像的本地路径
+            max_side: 最长边上限（像素），与执行档位的max_image_size对应，None表示不限制
+
+        Returns:
+            (Base64编码的图像, 图像内容的SHA-256)，SHA-256可直接作为分析结果缓存键的一部分
+        """
+        source = model_image_path(image_path)
+        source_stat = os.stat(source)
+        key = (source, source_stat.st_mtime_ns, source_stat.st_size, max_side)
+
+        entry = self._memory_get(key)
+        if entry is not None:
+            return entry
+
+        ref_path = self._ref_path(image_path, max_side)
+        entry = self._load(ref_path, source_stat)
+        if entry is not None:
+            with self._lock:
+                self.disk_hits += 1
+        else:
+            entry = self._generate(source, ref_path, source_stat, max_side)
+            with self._lock:
+                self.misses += 1
+
+        self._memory_put(key, entry)
+        return entry
+
+    def remove(self, image_path: str) -> None:
+        """删除上传图像的所有引用文件及其指向的载荷，并清除进程内缓存"""
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        for ref_path in glob.glob(os.path.join(self.ref_folder, f"{glob.escape(stem)}.*.ref.json")):
+            try:
+                with open(ref_path, "r", encoding="utf-8") as f:
+                    os.remove(self._artifact_path(json.load(f)["sha256"]))
+            except (OSError, ValueError, KeyError):
+                pass
+            try:
+                os.remove(ref_path)
+            except OSError:
+                pass
+
+        with self._lock:
+            for key in [key for key in self._memory if os.path.splitext(os.path.basename(key[0]))[0] == stem]:
+                self._memory_size -= len(self._memory.pop(key)[0])
+
+    def stats(self) -> Dict[str, Any]:
+        """获取本进程的载荷缓存统计"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "memory_limit_bytes": self.memory_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "memory_hit_rate": self.memory_hits / lookups if lookups else 0.0,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+            }
+
+
+# 创建全局载荷存储实例
+artifact_store = DerivedArtifactStore()
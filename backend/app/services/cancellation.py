@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Dict
+
+from redis import Redis
+
+from app.core.config import REDIS_HOST, REDIS_PORT, REDIS_DB
+from app.core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# 取消通知频道，消息内容为任务ID
+CANCEL_CHANNEL = "task_cancel"
+
+# 监听连接断开后重连的间隔（秒）
+_RECONNECT_INTERVAL = 1.0
+
+
+def cancel_flag_key(task_id: str) -> str:
+    """取消标志键，用于通知在订阅之前（例如仍在排队）的任务"""
+    return f"task_cancel:{task_id}"
+
+
+def publish_cancel(redis: Redis, task_id: str) -> None:
+    """
+    发出取消通知：设置取消标志并推送到取消频道
+
+    Args:
+        redis: 同步Redis客户端
+        task_id: 任务ID
+    """
+    redis.setex(cancel_flag_key(task_id), 3600, "1")
+    redis.publish(CANCEL_CHANNEL, task_id)
+
+
+class CancelToken:
+    """
+    进程内的取消标志
+
+    由监听线程在收到取消通知时设置；同步代码通过is_set()检查，协程可以await wait()。
+    """
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self._flag = threading.Event()
+        self._waiters = []
+        self._lock = threading.Lock()
+
+    def is_set(self) -> bool:
+        return self._flag.is_set()
+
+    def set(self) -> None:
+        with self._lock:
+            self._flag.set()
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    async def wait(self) -> None:
+        """等待直到任务被取消"""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        with self._lock:
+            if self._flag.is_set():
+                return
+            self._waiters.append((loop, event))
+        try:
+            await event.wait()
+        finally:
+            with self._lock:
+                self._waiters.remove((loop, event))
+
+
+class CancellationListener:
+    """
+    订阅取消频道的进程级监听器
+
+    每个进程只有一个后台线程持有一条订阅连接，收到通知后设置对应任务的CancelToken，
+    任务本身不再需要轮询Redis。
+    """
+
+    def __init__(self):
+        self._tokens: Dict[str, CancelToken] = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._ready = threading.Event()
+
+    def _reset_after_fork(self):
+        """fork出的子进程不会继承监听线程"""
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._ready = threading.Event()
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._ready.clear()
+            self._thread = threading.Thread(target=self._listen, name="cancel-listener", daemon=True)
+            self._thread.start()
+        # 等待订阅建立，避免错过紧接着发出的取消通知
+        self._ready.wait(timeout=2)
+
+    def _listen(self):
+        while True:
+            try:
+                redis = Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
+                pubsub = redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CANCEL_CHANNEL)
+                self._ready.set()
+                for message in pubsub.listen():
+                    task_id = message["data"].decode("utf-8")
+                    with self._lock:
+                        token = self._tokens.get(task_id)
+                    if token is not None:
+                        logger.info(f"收到任务 {task_id} 的取消通知")
+                        token.set()
+            except Exception as e:
+                logger.warning(f"取消通知订阅断开，{_RECONNECT_INTERVAL}秒后重连: {str(e)}")
+                time.sleep(_RECONNECT_INTERVAL)
+
+    def register(self, task_id: str) -> CancelToken:
+        """
+        为任务注册取消标志
+
+        注册后会检查一次取消标志键，覆盖在注册之前就已发出的取消请求。
+
+        Args:
+            task_id: 任务ID
+
+        Returns:
+            任务的CancelToken
+        """
+        self._ensure_listener()
+        token = CancelToken(task_id)
+        with self._lock:
+            self._tokens[task_id] = token
+        try:
+            if get_redis().exists(cancel_flag_key(task_id)):
+                token.set()
+        except Exception as e:
+            logger.warning(f"检查任务取消标志时出错: {str(e)}")
+        return token
+
+    def unregister(self, task_id: str) -> None:
+        """任务结束后移除取消标志"""
+        with self._lock:
+            self._tokens.pop(task_id, None)
+
+
+# 创建进程级监听器
+cancellation = CancellationListener()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=cancellation._reset_after_fork)
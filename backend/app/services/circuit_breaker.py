@@ -0,0 +1,253 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Optional, Tuple
+
+from app.core.config import (
+    CIRCUIT_BREAKER_ENABLED, CIRCUIT_BREAKER_WINDOW, CIRCUIT_BREAKER_MIN_SAMPLES, CIRCUIT_BREAKER_ERROR_THRESHOLD,
+    CIRCUIT_BREAKER_SLOW_SECONDS, CIRCUIT_BREAKER_SLOW_THRESHOLD, CIRCUIT_BREAKER_OPEN_SECONDS,
+    CIRCUIT_BREAKER_HALF_OPEN_PROBES, MODEL_FALLBACKS
+)
+from app.core.redis_client import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+# 熔断器状态
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# 调用结果
+RESULT_SUCCESS = "success"
+RESULT_FAILURE = "failure"
+RESULT_IGNORED = "ignored"
+
+
+class CircuitOpenError(Exception):
+    """模型熔断中且没有可用的备用模型"""
+
+
+class ModelCircuitBreaker:
+    """
+    单个模型的熔断器
+
+    按最近window次调用统计失败率和慢调用比例，超过阈值时打开熔断，open_seconds后进入半开状态，
+    只放行少量探测请求；探测成功则关闭熔断，失败则重新打开。
+    """
+
+    def __init__(self, model: str, window: int = CIRCUIT_BREAKER_WINDOW, min_samples: int = CIRCUIT_BREAKER_MIN_SAMPLES,
+                 error_threshold: float = CIRCUIT_BREAKER_ERROR_THRESHOLD, slow_seconds: float = CIRCUIT_BREAKER_SLOW_SECONDS,
+                 slow_threshold: float = CIRCUIT_BREAKER_SLOW_THRESHOLD, open_seconds: float = CIRCUIT_BREAKER_OPEN_SECONDS,
+                 half_open_probes: int = CIRCUIT_BREAKER_HALF_OPEN_PROBES):
+        self.model = model
+        self.min_samples = min_samples
+        self.error_threshold = error_threshold
+        self.slow_seconds = slow_seconds
+        self.slow_threshold = slow_threshold
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        self.state = STATE_CLOSED
+        self.state_since = time.time()
+        self.opened_until = 0.0
+        self.probes_in_flight = 0
+        self.recent = deque(maxlen=window)
+        self.opens = 0
+        self.rejected = 0
+        self.fallbacks = 0
+
+    def _transition(self, state: str) -> None:
+        logger.warning(f"模型 {self.model} 熔断器状态: {self.state} -> {state}")
+        self.state = state
+        self.state_since = time.time()
+        if state == STATE_OPEN:
+            self.opens += 1
+            self.opened_until = time.monotonic() + self.open_seconds
+            self.recent.clear()
+        self.probes_in_flight = 0
+
+    def try_acquire(self) -> Tuple[bool, bool]:
+        """
+        申请一次调用
+
+        Returns:
+            (是否允许调用, 是否为半开状态下的探测请求)
+        """
+        if self.state == STATE_OPEN:
+            if time.monotonic() < self.opened_until:
+                return False, False
+            self._transition(STATE_HALF_OPEN)
+
+        if self.state == STATE_HALF_OPEN:
+            if self.probes_in_flight >= self.half_open_probes:
+                return False, False
+            self.probes_in_flight += 1
+            return True, True
+
+        return True, False
+
+    def record(self, result: str, latency: float, probe: bool) -> None:
+        """
+        记录一次调用的结果
+
+        Args:
+            result: success/failure/ignored
+            latency: 调用耗时（秒）
+            probe: 是否为探测请求
+        """
+        if probe:
+            if self.state != STATE_HALF_OPEN:
+                return
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+            if result == RESULT_SUCCESS and latency < self.slow_seconds:
+                self._transition(STATE_CLOSED)
+            elif result != RESULT_IGNORED:
+                self._transition(STATE_OPEN)
+            return
+
+        if result == RESULT_IGNORED or self.state != STATE_CLOSED:
+            return
+
+        self.recent.append((result == RESULT_FAILURE, latency >= self.slow_seconds))
+        if len(self.recent) < self.min_samples:
+            return
+        failure_rate = sum(1 for failed, _ in self.recent if failed) / len(self.recent)
+        slow_rate = sum(1 for _, slow in self.recent if slow) / len(self.recent)
+        if failure_rate > self.error_threshold or slow_rate > self.slow_threshold:
+            self._transition(STATE_OPEN)
+
+    def stats(self) -> Dict[str, Any]:
+        samples = len(self.recent)
+        return {
+            "state": self.state,
+            "state_since": self.state_since,
+            "open_for": max(0.0, self.opened_until - time.monotonic()) if self.state == STATE_OPEN else 0.0,
+            "samples": samples,
+            "failure_rate": sum(1 for failed, _ in self.recent if failed) / samples if samples else 0.0,
+            "slow_rate": sum(1 for _, slow in self.recent if slow) / samples if samples else 0.0,
+            "opens": self.opens,
+            "rejected": self.rejected,
+            "fallbacks": self.fallbacks
+        }
+
+
+class CircuitBreakerRegistry:
+    """
+    按模型管理熔断器，并在熔断时路由到备用模型
+
+    熔断状态为进程内数据；状态变化时写入Redis，健康检查接口可以看到所有进程的熔断状态。
+    """
+
+    STATES_KEY = "model_circuit_breaker:states"
+
+    def __init__(self, enabled: bool = CIRCUIT_BREAKER_ENABLED, fallbacks: Dict[str, str] = MODEL_FALLBACKS):
+        self.enabled = enabled
+        self.fallbacks = fallbacks
+        self._breakers: Dict[str, ModelCircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self._changed = False
+
+    def _breaker(self, model: str) -> ModelCircuitBreaker:
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            breaker = self._breakers.setdefault(model, ModelCircuitBreaker(model))
+        return breaker
+
+    def acquire(self, model: str) -> Tuple[str, Optional[Tuple[ModelCircuitBreaker, bool]]]:
+        """
+        为一次调用选择模型
+
+        Args:
+            model: 请求的模型
+
+        Returns:
+            (实际使用的模型, 调用许可)，调用结束后需要把许可传给release
+
+        Raises:
+            CircuitOpenError: 模型熔断中且备用模型不可用
+        """
+        if not self.enabled:
+            return model, None
+
+        with self._lock:
+            breaker = self._breaker(model)
+            state = breaker.state
+            allowed, probe = breaker.try_acquire()
+            self._changed |= breaker.state != state
+            if allowed:
+                return model, (breaker, probe)
+            breaker.rejected += 1
+
+            fallback = self.fallbacks.get(model)
+            if fallback and fallback != model:
+                fallback_breaker = self._breaker(fallback)
+                state = fallback_breaker.state
+                allowed, probe = fallback_breaker.try_acquire()
+                self._changed |= fallback_breaker.state != state
+                if allowed:
+                    breaker.fallbacks += 1
+                    logger.info(f"模型 {model} 熔断中，改用备用模型 {fallback}")
+                    return fallback, (fallback_breaker, probe)
+
+        raise CircuitOpenError(f"模型 {model} 暂时不可用（熔断中），请稍后重试")
+
+    def release(self, permit: Optional[Tuple[ModelCircuitBreaker, bool]], result: str, latency: float) -> None:
+        """
+        记录调用结果并归还许可
+
+        Args:
+            permit: acquire返回的许可
+            result: success/failure/ignored
+            latency: 调用耗时（秒）
+        """
+        if permit is None:
+            return
+        breaker, probe = permit
+        with self._lock:
+            state = breaker.state
+            breaker.record(result, latency, probe)
+            self._changed |= breaker.state != state
+
+    async def publish(self) -> None:
+        """状态发生变化时把本进程的熔断状态写入Redis"""
+        with self._lock:
+            if not self._changed:
+                return
+            self._changed = False
+            states = {model: breaker.stats() for model, breaker in self._breakers.items()}
+
+        process = f"{socket.gethostname()}:{os.getpid()}"
+        try:
+            await get_async_redis().hset(self.STATES_KEY, process, json.dumps({
+                "updated_at": time.time(),
+                "models": states
+            }))
+        except Exception as e:
+            logger.warning(f"写入熔断器状态时出错: {str(e)}")
+
+    async def stats(self) -> Dict[str, Any]:
+        """获取本进程和所有进程最近一次上报的熔断状态"""
+        with self._lock:
+            local = {model: breaker.stats() for model, breaker in self._breakers.items()}
+
+        processes = {}
+        try:
+            raw = await get_async_redis().hgetall(self.STATES_KEY)
+            processes = {k.decode("utf-8"): json.loads(v) for k, v in raw.items()}
+        except Exception as e:
+            logger.warning(f"读取熔断器状态时出错: {str(e)}")
+
+        return {
+            "enabled": self.enabled,
+            "fallbacks": self.fallbacks,
+            "local": local,
+            "processes": processes
+        }
+
+
+# 创建全局熔断器实例
+circuit_breakers = CircuitBreakerRegistry()
@@ -0,0 +1,110 @@
+import math
+import re
+from typing import List, Dict, Any, Optional, Tuple
+
+from app.core.config import CONTEXT_TOKEN_BUDGET, CONTEXT_MAX_AI_TOKENS
+
+# 中日韩字符及全角符号，GLM分词器中大致每个字符对应一个token
+_CJK_RE = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+# 其他文本（英文、数字、标点、空白）大致每4个字符对应一个token
+_CHARS_PER_TOKEN = 4
+
+# 裁剪后剩余预算少于此值时不再放入被截断的回复
+_MIN_TRIMMED_TOKENS = 32
+
+# 每条消息的角色、分隔符等额外开销
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+_TRIM_MARKER = "……（内容过长已省略）"
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """
+    在本地估算文本的token数，不依赖模型分词器
+
+    Args:
+        text: 文本
+
+    Returns:
+        估算的token数
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / _CHARS_PER_TOKEN)
+
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    将文本截断到大约max_tokens个token，保留开头部分
+
+    Args:
+        text: 文本
+        max_tokens: token上限
+
+    Returns:
+        截断后的文本
+    """
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    keep = max(int(len(text) * max_tokens / tokens) - len(_TRIM_MARKER), 0)
+    return text[:keep] + _TRIM_MARKER
+
+
+def build_context_messages(
+    messages: List[Any],
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+    max_ai_tokens: int = CONTEXT_MAX_AI_TOKENS,
+    current_prompt: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    在token预算内从最近的对话开始打包上下文
+
+    只使用用户提问和AI回答的正文（不包含thinking），跳过系统消息和错误消息。
+    除最近一条AI回答外，过长的AI回答会先被截断到max_ai_tokens；预算不足时丢弃更早的对话。
+
+    Args:
+        messages: 按时间正序排列的Message对象列表
+        token_budget: 上下文token预算
+        max_ai_tokens: 较早AI回答的token上限
+        current_prompt: 当前提问；如果它已作为最后一条用户消息保存，则不再重复放入上下文
+
+    Returns:
+        (上下文消息列表, 估算的token数)
+    """
+    history = [msg for msg in messages if msg.sender in ("user", "ai") and not msg.error and msg.text]
+
+    # 当前提问在调用前已保存到数据库，会由analyze_image单独附加
+    if current_prompt is not None and history and history[-1].sender == "user" and history[-1].text == current_prompt:
+        history = history[:-1]
+
+    packed = []
+    used = 0
+    seen_ai = False
+
+    for msg in reversed(history):
+        text = msg.text
+        if msg.sender == "ai":
+            # 最近一次回答保持完整，更早的长回答先截断
+            if seen_ai:
+                text = trim_to_tokens(text, max_ai_tokens)
+            seen_ai = True
+
+        cost = estimate_tokens(text) + _MESSAGE_OVERHEAD_TOKENS
+        if used + cost > token_budget:
+            remaining = token_budget - used - _MESSAGE_OVERHEAD_TOKENS
+            if msg.sender == "ai" and remaining >= _MIN_TRIMMED_TOKENS:
+                text = trim_to_tokens(text, remaining)
+                cost = estimate_tokens(text) + _MESSAGE_OVERHEAD_TOKENS
+                if used + cost <= token_budget:
+                    packed.append({"role": "assistant", "content": text})
+                    used += cost
+            break
+
+        packed.append({"role": "user" if msg.sender == "user" else "assistant", "content": text})
+        used += cost
+
+    packed.reverse()
+    return packed, used
@@ -0,0 +1,166 @@
+import logging
+import time
+from typing import Dict, Any, Optional, Tuple
+
+from app.core.config import (
+    EXECUTION_PROFILES, DEFAULT_EXECUTION_PROFILE, PROFILE_DOWNGRADE_QUEUE_DEPTHS, CELERY_QUEUE_NAME
+)
+from app.core.redis_client import get_async_redis
+from app.services.hedging import percentile
+
+logger = logging.getLogger(__name__)
+
+# 队列长度的缓存时间（秒），避免每个请求都查询Redis
+_QUEUE_DEPTH_TTL = 2.0
+
+# 每个档位保留的延迟样本数
+_LATENCY_SAMPLES = 1000
+
+
+class ExecutionProfile:
+    """
+    执行档位：一次分析使用的模型、是否开启思考、图像分辨率上限和最大输出token数
+    """
+
+    def __init__(self, name: str, model: str = "glm-4.5v", thinking: bool = True,
+                 max_image_size: Optional[int] = None, max_tokens: Optional[int] = None,
+                 downgrade_to: Optional[str] = None):
+        self.name = name
+        self.model = model
+        self.thinking = thinking
+        self.max_image_size = max_image_size
+        self.max_tokens = max_tokens
+        self.downgrade_to = downgrade_to
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        """传给模型后端的生成参数"""
+        return {"thinking": self.thinking, "max_tokens": self.max_tokens}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "thinking": self.thinking,
+            "max_image_size": self.max_image_size,
+            "max_tokens": self.max_tokens,
+            "downgrade_to": self.downgrade_to
+        }
+
+
+class ExecutionProfileRegistry:
+    """
+    执行档位注册表
+
+    按名称查找档位；任务队列积压超过阈值时自动降档（例如deep -> balanced -> fast），
+    并在Redis中按档位记录模型调用延迟，便于对照SLO调整档位参数。
+    """
+
+    LATENCY_KEY_PREFIX = "execution_profile:latency:"
+    STATS_KEY = "execution_profile:stats"
+
+    def __init__(self, profiles: Dict[str, Dict[str, Any]] = EXECUTION_PROFILES,
+                 default: str = DEFAULT_EXECUTION_PROFILE, downgrade_depths=PROFILE_DOWNGRADE_QUEUE_DEPTHS,
+                 queue_name: str = CELERY_QUEUE_NAME):
+        self.profiles = {name: ExecutionProfile(name, **spec) for name, spec in profiles.items()}
+        if default not in self.profiles:
+            raise ValueError(f"默认执行档位 {default} 未定义")
+        self.default = default
+        self.downgrade_depths = sorted(downgrade_depths)
+        self.queue_name = queue_name
+        self._queue_depth = 0
+        self._queue_depth_at = 0.0
+
+    def get(self, name: Optional[str] = None) -> ExecutionProfile:
+        """
+        按名称获取档位
+
+        Raises:
+            ValueError: 档位不存在
+        """
+        profile = self.profiles.get(name or self.default)
+        if profile is None:
+            raise ValueError(f"未知的执行档位: {name}，可选: {', '.join(self.profiles)}")
+        return profile
+
+    async def queue_depth(self) -> int:
+        """当前Celery队列中等待执行的任务数（短暂缓存）"""
+        now = time.monotonic()
+        if now - self._queue_depth_at > _QUEUE_DEPTH_TTL:
+            # 先更新时间戳，缓存过期时同时到达的请求只有一个查询Redis
+            self._queue_depth_at = now
+            try:
+                self._queue_depth = await get_async_redis().llen(self.queue_name)
+            except Exception as e:
+                logger.warning(f"读取任务队列长度时出错: {str(e)}")
+        return self._queue_depth
+
+    async def resolve(self, name: Optional[str] = None) -> Tuple[ExecutionProfile, bool]:
+        """
+        根据当前负载确定实际使用的档位
+
+        队列长度每超过一个PROFILE_DOWNGRADE_QUEUE_DEPTHS阈值，就沿downgrade_to降一档。
+
+        Args:
+            name: 请求的档位名称，None表示默认档位
+
+        Returns:
+            (实际使用的档位, 是否被降档)
+
+        Raises:
+            ValueError: 档位不存在
+        """
+        profile = self.get(name)
+        requested = profile
+        depth = await self.queue_depth()
+        steps = sum(1 for threshold in self.downgrade_depths if depth >= threshold)
+        for _ in range(steps):
+            if not profile.downgrade_to:
+                break
+            profile = self.get(profile.downgrade_to)
+
+        if profile is not requested:
+            logger.info(f"任务队列长度 {depth}，执行档位 {requested.name} 降为 {profile.name}")
+            try:
+                await get_async_redis().hincrby(self.STATS_KEY, f"{profile.name}:downgraded", 1)
+            except Exception as e:
+                logger.warning(f"记录执行档位降档时出错: {str(e)}")
+        return profile, profile is not requested
+
+    async def record_latency(self, name: str, seconds: float) -> None:
+        """记录一次模型调用（不含缓存命中）在该档位下的耗时"""
+        try:
+            redis = get_async_redis()
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.lpush(self.LATENCY_KEY_PREFIX + name, f"{seconds:.3f}")
+                pipe.ltrim(self.LATENCY_KEY_PREFIX + name, 0, _LATENCY_SAMPLES - 1)
+                pipe.hincrby(self.STATS_KEY, f"{name}:requests", 1)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"记录执行档位延迟时出错: {str(e)}")
+
+    async def stats(self) -> Dict[str, Any]:
+        """获取各档位的配置、调用次数、降档次数和延迟分位数"""
+        redis = get_async_redis()
+        counters = {k.decode("utf-8"): int(v) for k, v in (await redis.hgetall(self.STATS_KEY)).items()}
+        result = {}
+        for name, profile in self.profiles.items():
+            samples = [float(v) for v in await redis.lrange(self.LATENCY_KEY_PREFIX + name, 0, -1)]
+            result[name] = {
+                **profile.to_dict(),
+                "requests": counters.get(f"{name}:requests", 0),
+                "downgraded": counters.get(f"{name}:downgraded", 0),
+                "latency_p50": percentile(samples, 50),
+                "latency_p95": percentile(samples, 95),
+                "latency_p99": percentile(samples, 99)
+            }
+        return {
+            "default": self.default,
+            "queue_depth": await self.queue_depth(),
+            "downgrade_queue_depths": self.downgrade_depths,
+            "profiles": result
+        }
+
+
+# 创建全局档位注册表
+execution_profiles = ExecutionProfileRegistry()
@@ -0,0 +1,149 @@
+import json
+import logging
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from app.db.database import SessionLocal
+from app.db.models import Upload
+from app.services.user_service import DetectionService
+from app.utils.detection_postprocess import project_boxes, to_pixel
+from app.utils.raster_utils import transform_to_wgs84
+
+logger = logging.getLogger(__name__)
+
+FORMAT_GEOJSON = "geojson"
+FORMAT_NDJSON = "ndjson"
+
+MEDIA_TYPES = {
+    FORMAT_GEOJSON: "application/geo+json",
+    FORMAT_NDJSON: "application/x-ndjson"
+}
+
+
+def _load_georeference(db, filename: Optional[str]) -> Optional[Dict[str, Any]]:
+    """上传图像的尺寸和地理参考，没有上传记录时返回None"""
+    if filename is None:
+        return None
+    upload = db.query(Upload.width, Upload.height, Upload.crs, Upload.transform).filter(
+        Upload.filename == filename
+    ).first()
+    if upload is None:
+        return None
+    return {
+        "size": (upload.width, upload.height) if upload.width else None,
+        "crs": upload.crs,
+        "transform": json.loads(upload.transform) if upload.transform else None
+    }
+
+
+def _project_rows(rows: List[Any], georeference: Optional[Dict[str, Any]]) -> List[Optional[List[List[float]]]]:
+    """
+    把同一上传图像上的一批检测框投影为WGS84经纬度多边形（整批向量化计算）
+
+    Returns:
+        每个检测框的闭合多边形顶点[[经度, 纬度], ...]，图像没有地理参考时为None
+    """
+    if not georeference or not georeference["transform"] or not georeference["crs"]:
+        return [None] * len(rows)
+
+    pixel = np.array([[r.pixel_x1, r.pixel_y1, r.pixel_x2, r.pixel_y2] for r in rows], dtype=np.float64)
+    missing = np.isnan(pixel).any(axis=1)
+    if missing.any():
+        if not georeference["size"]:
+            return [None] * len(rows)
+        relative = np.array([[r.x1, r.y1, r.x2, r.y2] for r in rows], dtype=np.float64)
+        pixel[missing] = to_pixel(relative[missing], georeference["size"])
+
+    rings = project_boxes(pixel, georeference["transform"])
+    lons, lats = transform_to_wgs84(rings[..., 0], rings[..., 1], georeference["crs"])
+    return np.stack([lons, lats], axis=-1).tolist()
+
+
+def _feature(row: Any, ring: Optional[List[List[float]]]) -> Dict[str, Any]:
+    pixel_bbox = None
+    if row.pixel_x1 is not None:
+        pixel_bbox = [row.pixel_x1, row.pixel_y1, row.pixel_x2, row.pixel_y2]
+    return {
+        "type": "Feature",
+        "id": row.id,
+        "geometry": {"type": "Polygon", "coordinates": [ring]} if ring is not None else None,
+        "properties": {
+            "label": row.label,
+            "message_id": row.message_id,
+            "chat_id": row.chat_id,
+            "scene": row.upload_filename,
+            "bbox": [row.x1, row.y1, row.x2, row.y2],
+            "pixel_bbox": pixel_bbox
+        }
+    }
+
+
+def iter_features(user_id: str, chat_id: Optional[str] = None, scene: Optional[str] = None,
+                  label: Optional[str] = None) -> Iterator[List[Dict[str, Any]]]:
+    """
+    分批生成检测结果的GeoJSON要素
+
+    使用单独的数据库会话（流式响应在请求的依赖关闭后才开始输出），每批按上传图像分组投影。
+
+    Args:
+        user_id: 用户ID
+        chat_id: 只导出该聊天中的检测框
+        scene: 只导出该上传图像（Upload.filename）上的检测框
+        label: 只导出该标签的检测框
+
+    Returns:
+        每批要素列表的迭代器
+    """
+    db = SessionLocal()
+    try:
+        georeferences: Dict[Optional[str], Optional[Dict[str, Any]]] = {}
+        for rows in DetectionService.iter_chunks(db, user_id, chat_id=chat_id, upload_filename=scene, label=label):
+            groups: Dict[Optional[str], List[int]] = {}
+            for index, row in enumerate(rows):
+                groups.setdefault(row.upload_filename, []).append(index)
+
+            rings: List[Optional[List[List[float]]]] = [None] * len(rows)
+            for filename, indexes in groups.items():
+                if filename not in georeferences:
+                    georeferences[filename] = _load_georeference(db, filename)
+                try:
+                    projected = _project_rows([rows[i] for i in indexes], georeferences[filename])
+                except Exception as e:
+                    logger.warning(f"投影 {filename} 上的检测框时出错: {str(e)}")
+                    continue
+                for i, ring in zip(indexes, projected):
+                    rings[i] = ring
+
+            yield [_feature(row, ring) for row, ring in zip(rows, rings)]
+    finally:
+        db.close()
+
+
+def stream_detections(fmt: str, user_id: str, chat_id: Optional[str] = None, scene: Optional[str] = None,
+                      label: Optional[str] = None) -> Iterator[str]:
+    """
+    以GeoJSON FeatureCollection或NDJSON（每行一个要素）的形式分块输出检测结果
+
+    每次只保留一批要素，内存占用与导出的总数量无关。坐标为WGS84经纬度（RFC 7946），
+    没有地理参考的图像上的检测框geometry为null，properties中保留相对坐标和像素坐标。
+
+    Args:
+        fmt: FORMAT_GEOJSON或FORMAT_NDJSON
+        其他参数见iter_features
+
+    Returns:
+        文本分块的迭代器
+    """
+    if fmt == FORMAT_NDJSON:
+        for features in iter_features(user_id, chat_id, scene, label):
+            yield "".join(json.dumps(feature, ensure_ascii=False) + "\n" for feature in features)
+        return
+
+    yield '{"type": "FeatureCollection", "features": ['
+    first = True
+    for features in iter_features(user_id, chat_id, scene, label):
+        chunk = ",\n".join(json.dumps(feature, ensure_ascii=False) for feature in features)
+        yield ("\n" if first else ",\n") + chunk
+        first = False
+    yield "\n]}\n"
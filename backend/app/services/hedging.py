@@ -0,0 +1,168 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, Any
+
+from app.core.config import (
+    HEDGE_PERCENTILE, HEDGE_MIN_DELAY, HEDGE_DEFAULT_DELAY, HEDGE_MIN_SAMPLES, HEDGE_MAX_RATE, HEDGE_WINDOW
+)
+
+# 每个模型保留的首token延迟样本数
+_TTFT_SAMPLES = 500
+
+# 每新增这么多样本重新计算一次等待时间，避免每次请求都排序
+_DELAY_REFRESH_SAMPLES = 20
+
+
+def percentile(values, pct):
+    """
+    计算百分位数（最近秩法）
+
+    Args:
+        values: 数值列表
+        pct: 百分位（0-100）
+
+    Returns:
+        百分位数，values为空时返回None
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class _ModelHedgeState:
+    """单个模型的首token延迟样本和对冲统计"""
+
+    def __init__(self):
+        self.ttft = deque(maxlen=_TTFT_SAMPLES)
+        self.ttft_recorded = 0
+        self.delay = None
+        self.delay_recorded = 0
+        self.recent_requests = deque()
+        self.recent_hedges = deque()
+        self.requests = 0
+        self.hedges = 0
+        self.hedges_skipped = 0
+        self.hedge_wins = 0
+        self.primary_wins = 0
+
+
+class HedgePolicy:
+    """
+    对冲请求策略
+
+    首token在该模型首token延迟的指定百分位内仍未到达时，发起第二个相同的请求，先开始输出的一方胜出。
+    对冲请求占所有请求的比例受HEDGE_MAX_RATE限制，避免在服务商整体变慢时把调用量翻倍。
+    统计信息为进程内数据。
+    """
+
+    def __init__(self, pct: float = HEDGE_PERCENTILE, min_delay: float = HEDGE_MIN_DELAY,
+                 default_delay: float = HEDGE_DEFAULT_DELAY, min_samples: int = HEDGE_MIN_SAMPLES,
+                 max_rate: float = HEDGE_MAX_RATE, window: float = HEDGE_WINDOW):
+        self.pct = pct
+        self.min_delay = min_delay
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self.max_rate = max_rate
+        self.window = window
+        self._models: Dict[str, _ModelHedgeState] = {}
+        self._lock = threading.Lock()
+
+    def _state(self, model: str) -> _ModelHedgeState:
+        state = self._models.get(model)
+        if state is None:
+            state = self._models.setdefault(model, _ModelHedgeState())
+        return state
+
+    def _prune(self, state: _ModelHedgeState, now: float) -> None:
+        for recent in (state.recent_requests, state.recent_hedges):
+            while recent and recent[0] < now - self.window:
+                recent.popleft()
+
+    def record_ttft(self, model: str, seconds: float) -> None:
+        """记录一次调用的首token延迟"""
+        with self._lock:
+            state = self._state(model)
+            state.ttft.append(seconds)
+            state.ttft_recorded += 1
+
+    def delay(self, model: str) -> float:
+        """
+        发起对冲请求前的等待时间
+
+        Returns:
+            样本足够时为首token延迟的指定百分位（不低于min_delay），否则为default_delay
+        """
+        with self._lock:
+            state = self._state(model)
+            if len(state.ttft) < self.min_samples:
+                return self.default_delay
+            if state.delay is None or state.ttft_recorded - state.delay_recorded >= _DELAY_REFRESH_SAMPLES:
+                state.delay = max(self.min_delay, percentile(state.ttft, self.pct))
+                state.delay_recorded = state.ttft_recorded
+            return state.delay
+
+    def record_request(self, model: str) -> None:
+        """记录一次启用了对冲的请求"""
+        with self._lock:
+            state = self._state(model)
+            state.requests += 1
+            state.recent_requests.append(time.monotonic())
+
+    def try_hedge(self, model: str) -> bool:
+        """
+        申请发起一次对冲请求
+
+        Returns:
+            最近window秒内对冲比例未超过max_rate时返回True
+        """
+        with self._lock:
+            state = self._state(model)
+            now = time.monotonic()
+            self._prune(state, now)
+            if len(state.recent_hedges) + 1 > self.max_rate * len(state.recent_requests):
+                state.hedges_skipped += 1
+                return False
+            state.hedges += 1
+            state.recent_hedges.append(now)
+            return True
+
+    def record_winner(self, model: str, hedge_won: bool) -> None:
+        """记录发起了对冲的请求中哪一方胜出"""
+        with self._lock:
+            state = self._state(model)
+            if hedge_won:
+                state.hedge_wins += 1
+            else:
+                state.primary_wins += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """获取各模型的首token延迟分位数和对冲统计"""
+        result = {}
+        for model in list(self._models):
+            with self._lock:
+                state = self._models[model]
+                samples = list(state.ttft)
+                counters = {
+                    "requests": state.requests,
+                    "hedges": state.hedges,
+                    "hedges_skipped": state.hedges_skipped,
+                    "hedge_wins": state.hedge_wins,
+                    "primary_wins": state.primary_wins
+                }
+            result[model] = {
+                **counters,
+                "hedge_rate": counters["hedges"] / counters["requests"] if counters["requests"] else 0.0,
+                "hedge_win_rate": counters["hedge_wins"] / counters["hedges"] if counters["hedges"] else 0.0,
+                "ttft_p50": percentile(samples, 50),
+                "ttft_p95": percentile(samples, 95),
+                "ttft_p99": percentile(samples, 99),
+                "hedge_delay": self.delay(model)
+            }
+        return result
+
+
+# 创建全局对冲策略实例
+hedge_policy = HedgePolicy()
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Optional
+
+from app.core.config import DERIVED_FOLDER, IMAGE_MAX_EDGE, IMAGE_JPEG_QUALITY, IMAGE_PROCESS_WORKERS
+from app.utils.image_utils import normalize_image
+from app.utils.raster_utils import normalize_raster
+
+logger = logging.getLogger(__name__)
+
+# 用rasterio降采样读取的格式，PIL会完整解码，大幅场景超过解压炸弹像素数上限
+_RASTER_EXTENSIONS = (".tif", ".tiff")
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """获取图像处理进程池（首次使用时创建）"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # 使用spawn避免fork已持有事件循环和数据库连接的进程
+            _pool = ProcessPoolExecutor(
+                max_workers=IMAGE_PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def shutdown_pool() -> None:
+    """关闭图像处理进程池"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def derived_image_path(image_path: str) -> str:
+    """上传图像对应的标准化图像路径"""
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(DERIVED_FOLDER, f"{stem}.jpg")
+
+
+def image_meta_path(image_path: str) -> str:
+    """上传图像对应的元数据文件路径"""
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(DERIVED_FOLDER, f"{stem}.meta.json")
+
+
+def remove_derived(image_path: str) -> None:
+    """删除上传图像的标准化图像和元数据文件"""
+    for path in (derived_image_path(image_path), image_meta_path(image_path)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def normalize_upload(image_path: str, max_edge: int = IMAGE_MAX_EDGE, quality: int = IMAGE_JPEG_QUALITY) -> Dict[str, Any]:
+    """
+    为上传图像生成标准化图像和元数据文件（同步执行，在进程池中调用）
+
+    Args:
+        image_path: 上传图像的本地路径
+        max_edge: 最长边上限（像素）
+        quality: JPEG质量
+
+    Returns:
+        图像元数据，见normalize_image
+    """
+    output_path = derived_image_path(image_path)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    normalize = normalize_raster if image_path.lower().endswith(_RASTER_EXTENSIONS) else normalize_image
+    try:
+        meta = normalize(image_path, tmp_path, max_edge, quality)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    # 与标准化图像一样按进程区分临时文件，多个进程同时标准化同一图像时不会互相覆盖
+    meta_path = image_meta_path(image_path)
+    meta_tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+    try:
+        with open(meta_tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(meta_tmp_path, meta_path)
+    finally:
+        if os.path.exists(meta_tmp_path):
+            os.remove(meta_tmp_path)
+    return meta
+
+
+async def run_in_pool(func, *args):
+    """
+    在图像处理进程池中执行函数，不阻塞事件循环
+
+    Args:
+        func: 模块级函数（需要能被子进程导入）
+        args: 函数参数
+
+    Returns:
+        函数返回值
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_pool(), func, *args)
+    except BrokenProcessPool:
+        # 子进程异常退出后进程池不可再用，丢弃以便下次重建
+        logger.warning("图像处理进程池已损坏，将重建")
+        shutdown_pool()
+        raise
+
+
+async def normalize_upload_async(image_path: str) -> Optional[Dict[str, Any]]:
+    """
+    在进程池中标准化上传图像，不阻塞事件循环
+
+    Args:
+        image_path: 上传图像的本地路径
+
+    Returns:
+        图像元数据；图像无法解码时返回None，后续分析直接使用原图
+    """
+    try:
+        return await run_in_pool(normalize_upload, image_path, IMAGE_MAX_EDGE, IMAGE_JPEG_QUALITY)
+    except Exception as e:
+        logger.warning(f"标准化上传图像 {image_path} 时出错，将使用原图: {str(e)}")
+        return None
+
+
+def load_image_meta(image_path: str) -> Optional[Dict[str, Any]]:
+    """
+    读取上传图像的元数据
+
+    Returns:
+        图像元数据，图像未经标准化时返回None
+    """
+    try:
+        with open(image_meta_path(image_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def model_image_path(image_path: str) -> str:
+    """
+    发送给模型的图像路径：存在标准化图像时使用标准化图像，否则使用原图
+
+    Args:
+        image_path: 上传图像的本地路径
+
+    Returns:
+        图像文件路径
+    """
+    derived = derived_image_path(image_path)
+    return derived if os.path.exists(derived) else image_path
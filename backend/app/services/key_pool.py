@@ -0,0 +1,146 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import deque
+from typing import List, Dict, Any, Optional
+
+from app.core.config import KEY_POOL_WINDOW, KEY_POOL_MIN_SAMPLES, KEY_POOL_ERROR_THRESHOLD, KEY_POOL_EJECT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# 调用结果
+OUTCOME_OK = "ok"
+OUTCOME_ERROR = "error"
+OUTCOME_RATE_LIMITED = "rate_limited"
+OUTCOME_CANCELED = "canceled"
+
+# 延迟指数滑动平均的平滑系数
+_LATENCY_ALPHA = 0.2
+
+
+class ApiKeyState:
+    """单个API密钥的调用状态和统计"""
+
+    def __init__(self, api_key: str, window: int):
+        self.api_key = api_key
+        # 限流器等共享状态中使用的账号标识，Redis中不保存密钥本身
+        self.account_id = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.latency_ewma = None
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.recent = deque(maxlen=window)
+        self.created_at = time.monotonic()
+
+    @property
+    def masked_key(self) -> str:
+        """脱敏后的密钥，用于日志和统计"""
+        return f"{self.api_key[:6]}…{self.api_key[-4:]}" if len(self.api_key) > 10 else "…"
+
+    def is_available(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+
+class ApiKeyPool:
+    """
+    多个服务商账号的API密钥池
+
+    按最少未完成请求数分配密钥；每个密钥按滑动窗口统计错误率和429比例，
+    超过阈值时暂时剔除，冷却后重新加入。统计信息为进程内数据。
+    """
+
+    def __init__(self, api_keys: List[str], window: int = KEY_POOL_WINDOW, min_samples: int = KEY_POOL_MIN_SAMPLES,
+                 error_threshold: float = KEY_POOL_ERROR_THRESHOLD, eject_seconds: float = KEY_POOL_EJECT_SECONDS):
+        self.keys = [ApiKeyState(key, window) for key in api_keys]
+        self.min_samples = min_samples
+        self.error_threshold = error_threshold
+        self.eject_seconds = eject_seconds
+        self._lock = threading.Lock()
+
+    def acquire(self) -> ApiKeyState:
+        """
+        选择一个密钥用于本次调用
+
+        Returns:
+            未被剔除且未完成请求数最少的密钥；全部被剔除时返回最早恢复的密钥
+        """
+        if not self.keys:
+            raise ValueError("未配置智谱AI API密钥")
+
+        with self._lock:
+            now = time.monotonic()
+            available = [key for key in self.keys if key.is_available(now)]
+            if available:
+                key = min(available, key=lambda k: (k.outstanding, k.latency_ewma or 0.0))
+            else:
+                key = min(self.keys, key=lambda k: k.ejected_until)
+            key.outstanding += 1
+            return key
+
+    def release(self, key: ApiKeyState, latency: float, outcome: str = OUTCOME_OK,
+                retry_after: Optional[float] = None) -> None:
+        """
+        记录一次调用的结果
+
+        Args:
+            key: acquire返回的密钥
+            latency: 调用耗时（秒）
+            outcome: 调用结果（ok/error/rate_limited/canceled）
+            retry_after: 429响应建议的等待时间（秒）
+        """
+        with self._lock:
+            now = time.monotonic()
+            key.outstanding -= 1
+            # 用户取消的调用不反映密钥的健康状况
+            if outcome == OUTCOME_CANCELED:
+                return
+            key.requests += 1
+            key.recent.append(outcome)
+
+            if outcome == OUTCOME_OK:
+                key.latency_ewma = latency if key.latency_ewma is None else \
+                    _LATENCY_ALPHA * latency + (1 - _LATENCY_ALPHA) * key.latency_ewma
+            elif outcome == OUTCOME_RATE_LIMITED:
+                key.rate_limited += 1
+                # 该账号的配额暂时用完，在建议的等待时间内不再分配
+                if retry_after:
+                    key.ejected_until = max(key.ejected_until, now + retry_after)
+            else:
+                key.errors += 1
+
+            failures = sum(1 for item in key.recent if item != OUTCOME_OK)
+            if len(key.recent) >= self.min_samples and failures / len(key.recent) > self.error_threshold:
+                key.ejected_until = max(key.ejected_until, now + self.eject_seconds)
+                key.ejections += 1
+                key.recent.clear()
+                logger.warning(f"API密钥 {key.masked_key} 错误率过高，暂停使用 {self.eject_seconds} 秒")
+
+    def available_count(self) -> int:
+        """当前未被剔除的密钥数"""
+        now = time.monotonic()
+        return sum(1 for key in self.keys if key.is_available(now))
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """获取每个密钥的吞吐、延迟和错误统计"""
+        now = time.monotonic()
+        result = []
+        for key in self.keys:
+            uptime = max(now - key.created_at, 1e-6)
+            result.append({
+                "key": key.masked_key,
+                "available": key.is_available(now),
+                "ejected_for": max(0.0, key.ejected_until - now),
+                "ejections": key.ejections,
+                "outstanding": key.outstanding,
+                "requests": key.requests,
+                "requests_per_minute": key.requests * 60 / uptime,
+                "errors": key.errors,
+                "rate_limited": key.rate_limited,
+                "error_rate": (key.errors + key.rate_limited) / key.requests if key.requests else 0.0,
+                "latency_ewma": key.latency_ewma
+            })
+        return result
@@ -0,0 +1,289 @@
+import asyncio
+import json
+import logging
+import math
+import random
+
+import httpx
+
+from app.core.config import (
+    MODEL_BACKEND, ZHIPUAI_BASE_URL, ZHIPUAI_TIMEOUT, ZHIPUAI_MAX_CONNECTIONS,
+    FAKE_MODEL_TOKENS, FAKE_MODEL_THINKING_TOKENS, FAKE_MODEL_TOKEN_RATE, FAKE_MODEL_LATENCY,
+    FAKE_MODEL_ERROR_RATE, FAKE_MODEL_RATE_LIMIT_RATE, FAKE_MODEL_RETRY_AFTER, FAKE_MODEL_DETECTIONS,
+    FAKE_MODEL_SEED
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ZhipuAiAPIError(Exception):
+    """模型接口返回的非200错误"""
+
+    def __init__(self, status_code, message, retry_after=None):
+        super().__init__(f"Error code: {status_code}, with error text {message}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def is_backend_failure(error):
+    """
+    判断一次调用错误是否说明模型服务本身不健康（用于熔断统计）
+
+    5xx、连接错误、超时和无法解析的响应计为失败；429和其他4xx是配额或请求本身的问题，不计入。
+    """
+    if isinstance(error, ZhipuAiAPIError):
+        return error.status_code >= 500
+    return isinstance(error, (httpx.HTTPError, asyncio.TimeoutError, ValueError))
+
+
+class ModelBackend:
+    """
+    模型后端接口
+
+    后端只负责一次流式chat/completions调用；限流、密钥池、缓存和取消由ZhipuAiService处理。
+    """
+
+    # 是否需要真实的API密钥
+    requires_api_key = True
+
+    async def stream_chat(self, model, messages, api_key, thinking=True, max_tokens=None):
+        """
+        流式调用模型
+
+        Args:
+            model: 模型名称
+            messages: 消息列表
+            api_key: 本次调用使用的API密钥
+            thinking: 是否开启思考模式
+            max_tokens: 最大输出token数，None表示使用模型默认值
+
+        Yields:
+            每个流式分片中的delta字典（content / reasoning_content）
+
+        Raises:
+            ZhipuAiAPIError: 接口返回非200状态码
+        """
+        raise NotImplementedError
+
+    async def aclose(self):
+        """释放后端持有的连接等资源"""
+
+
+class ZhipuHttpBackend(ModelBackend):
+    """通过HTTP SSE调用智谱AI开放平台的后端"""
+
+    def __init__(self, base_url=None):
+        self.base_url = (base_url or ZHIPUAI_BASE_URL).rstrip("/")
+        self._http_client = None
+        self._http_client_loop = None
+
+    def _get_http_client(self):
+        """
+        获取绑定到当前事件循环的异步HTTP客户端
+
+        httpx的连接池不能跨事件循环复用，因此每个事件循环各自持有一个客户端，
+        同一事件循环内的所有调用共享连接池（keep-alive）。
+        """
+        loop = asyncio.get_running_loop()
+        if self._http_client is None or self._http_client_loop is not loop or self._http_client.is_closed:
+            self._http_client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(ZHIPUAI_TIMEOUT, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=ZHIPUAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=ZHIPUAI_MAX_CONNECTIONS
+                )
+            )
+            self._http_client_loop = loop
+        return self._http_client
+
+    async def aclose(self):
+        """关闭HTTP客户端，释放连接池"""
+        if self._http_client is not None and not self._http_client.is_closed:
+            await self._http_client.aclose()
+
+    async def stream_chat(self, model, messages, api_key, thinking=True, max_tokens=None):
+        payload = {
+            "model": model,
+            "messages": messages,
+            "thinking": {"type": "enabled" if thinking else "disabled"},
+            "stream": True
+        }
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+
+        client = self._get_http_client()
+        headers = {"Authorization": f"Bearer {api_key}"}
+        async with client.stream("POST", "/chat/completions", json=payload, headers=headers) as response:
+            if response.status_code != 200:
+                body = await response.aread()
+                raise ZhipuAiAPIError(
+                    response.status_code,
+                    body.decode("utf-8", errors="replace"),
+                    retry_after=self._parse_retry_after(response.headers.get("retry-after"))
+                )
+
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+
+                chunk = json.loads(data)
+                choices = chunk.get("choices") or []
+                if choices:
+                    yield choices[0].get("delta") or {}
+
+    @staticmethod
+    def _parse_retry_after(value):
+        """解析Retry-After响应头（秒数），无法解析时返回None"""
+        try:
+            return float(value) if value else None
+        except ValueError:
+            return None
+
+
+def parse_latency_spec(spec):
+    """
+    解析首token延迟分布配置
+
+    支持的格式：
+    - "fixed:0.5"：固定0.5秒
+    - "uniform:0.2,1.5"：0.2到1.5秒均匀分布
+    - "lognormal:0.8,0.6"：中位数0.8秒、对数标准差0.6的对数正态分布（长尾）
+
+    Args:
+        spec: 分布配置字符串
+
+    Returns:
+        (分布名称, 参数列表)
+    """
+    name, _, params = spec.partition(":")
+    name = name.strip().lower()
+    values = [float(value) for value in params.split(",") if value.strip()]
+    expected = {"fixed": 1, "uniform": 2, "lognormal": 2}
+    if name not in expected or len(values) != expected[name]:
+        raise ValueError(f"无效的延迟分布配置: {spec}")
+    return name, values
+
+
+# 生成文本时使用的词表
+_FAKE_WORDS = [
+    "遥感", "图像", "中", "可以", "看到", "大片", "农田", "与", "道路", "交错", "分布", "，",
+    "建筑", "密集", "区域", "位于", "左上", "方", "植被", "覆盖", "较好", "水体", "边界", "清晰", "。"
+]
+_FAKE_THINKING_WORDS = ["先", "观察", "整体", "纹理", "，", "再", "判断", "地物", "类别", "。"]
+_FAKE_LABELS = ["建筑", "车辆", "船只", "储油罐", "飞机", "操场"]
+
+
+class FakeModelBackend(ModelBackend):
+    """
+    离线模拟后端，用于在不访问网络、不产生费用的情况下压测API和worker
+
+    按配置的速率流式输出token，首token延迟服从配置的分布，并按比例模拟接口错误和429；
+    检测任务（系统提示要求输出bbox）返回随机生成的检测JSON。
+    """
+
+    requires_api_key = False
+
+    def __init__(self, tokens=FAKE_MODEL_TOKENS, thinking_tokens=FAKE_MODEL_THINKING_TOKENS,
+                 token_rate=FAKE_MODEL_TOKEN_RATE, latency=FAKE_MODEL_LATENCY, error_rate=FAKE_MODEL_ERROR_RATE,
+                 rate_limit_rate=FAKE_MODEL_RATE_LIMIT_RATE, retry_after=FAKE_MODEL_RETRY_AFTER,
+                 detections=FAKE_MODEL_DETECTIONS, seed=FAKE_MODEL_SEED):
+        """
+        Args:
+            tokens: 每次回复输出的token数
+            thinking_tokens: 思考过程输出的token数
+            token_rate: 每秒输出的token数，0表示不限速
+            latency: 首token延迟分布，格式见parse_latency_spec
+            error_rate: 返回500错误的概率
+            rate_limit_rate: 返回429的概率
+            retry_after: 429响应中的retry-after（秒）
+            detections: 检测任务中返回的目标数量
+            seed: 随机数种子，None表示不固定
+        """
+        self.tokens = tokens
+        self.thinking_tokens = thinking_tokens
+        self.token_rate = token_rate
+        self.latency = parse_latency_spec(latency)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.detections = detections
+        self._random = random.Random(seed)
+
+    def _sample_latency(self):
+        name, params = self.latency
+        if name == "fixed":
+            return params[0]
+        if name == "uniform":
+            return self._random.uniform(params[0], params[1])
+        return params[0] * math.exp(self._random.gauss(0.0, params[1]))
+
+    @staticmethod
+    def _is_detection(messages):
+        system = next((msg for msg in messages if msg.get("role") == "system"), None)
+        return system is not None and "bbox" in str(system.get("content"))
+
+    def _detection_json(self):
+        items = []
+        for _ in range(self.detections):
+            x1, y1 = self._random.uniform(0, 0.8), self._random.uniform(0, 0.8)
+            w, h = self._random.uniform(0.02, 0.2), self._random.uniform(0.02, 0.2)
+            items.append({
+                "label": self._random.choice(_FAKE_LABELS),
+                "bbox": [round(x1, 3), round(y1, 3), round(min(x1 + w, 1.0), 3), round(min(y1 + h, 1.0), 3)]
+            })
+        lines = ",\n".join("  " + json.dumps(item, ensure_ascii=False) for item in items)
+        return "```json\n[\n" + lines + "\n]\n```"
+
+    async def _emit(self, pieces, field):
+        delay = 1.0 / self.token_rate if self.token_rate > 0 else 0.0
+        for piece in pieces:
+            if delay:
+                await asyncio.sleep(delay)
+            yield {field: piece}
+
+    async def stream_chat(self, model, messages, api_key, thinking=True, max_tokens=None):
+        await asyncio.sleep(self._sample_latency())
+
+        roll = self._random.random()
+        if roll < self.rate_limit_rate:
+            raise ZhipuAiAPIError(429, '{"error": {"code": "1302", "message": "模拟的请求频率超限"}}',
+                                  retry_after=self.retry_after)
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise ZhipuAiAPIError(500, '{"error": {"code": "500", "message": "模拟的服务端错误"}}')
+
+        if thinking:
+            pieces = [self._random.choice(_FAKE_THINKING_WORDS) for _ in range(self.thinking_tokens)]
+            async for delta in self._emit(pieces, "reasoning_content"):
+                yield delta
+
+        if self._is_detection(messages):
+            # 检测结果按行输出，模拟模型逐步生成JSON
+            pieces = [line + "\n" for line in self._detection_json().split("\n")]
+        else:
+            tokens = min(self.tokens, max_tokens) if max_tokens else self.tokens
+            pieces = [self._random.choice(_FAKE_WORDS) for _ in range(tokens)]
+        async for delta in self._emit(pieces, "content"):
+            yield delta
+
+
+def create_model_backend(name=MODEL_BACKEND, base_url=None):
+    """
+    按名称创建模型后端
+
+    Args:
+        name: "zhipu"（默认，调用智谱AI）或"fake"（离线模拟）
+        base_url: 智谱AI接口地址，仅对zhipu后端有效
+
+    Returns:
+        ModelBackend实例
+    """
+    if name == "zhipu":
+        return ZhipuHttpBackend(base_url)
+    if name == "fake":
+        logger.warning("使用离线模拟模型后端，模型输出为随机生成的内容")
+        return FakeModelBackend()
+    raise ValueError(f"未知的模型后端: {name}")
@@ -0,0 +1,128 @@
+from typing import List, Dict, Any, Optional
+
+from app.models.analyze import TaskType
+
+
+class PromptTemplate:
+    """
+    一个任务类型的提示模板
+
+    修改system_prompt或image_text时必须同时提升version，
+    使分析结果缓存失效，并能从消息记录中区分新旧模板生成的回答。
+    """
+
+    def __init__(self, task_type: TaskType, version: str, system_prompt: str,
+                 image_text: str = "这是需要分析的遥感图像。"):
+        self.task_type = task_type
+        self.version = version
+        self.system_prompt = system_prompt
+        self.image_text = image_text
+
+    @property
+    def prompt_version(self) -> str:
+        """记录在消息和缓存键中的模板版本，例如"detection:v1" """
+        return f"{self.task_type.value}:{self.version}"
+
+
+_DETECTION_PROMPT = """你是一个专业的遥感图像分析AI助手。用户要求你在遥感图像中定位特定的目标物体。
+
+请严格按照以下格式输出检测结果：
+返回物体的坐标边界框，你必须使用以下JSON格式：
+```json
+{"label": "物体名称", "bbox": [x1, y1, x2, y2]}
+```
+或者如果有多个物体:
+```json
+[
+  {"label": "物体1", "bbox": [x1, y1, x2, y2]},
+  {"label": "物体2", "bbox": [x3, y3, x4, y4]}
+]
+```
+
+说明:
+- x1,y1是左上角坐标，x2,y2是右下角坐标
+- 所有坐标值必须是0-1之间的相对位置
+- 例如：{"label": "建筑", "bbox": [0.2, 0.3, 0.5, 0.6]}
+
+重要提示：你的回复中必须包含且只包含有效的JSON格式坐标，不要省略或更改格式。"""
+
+PROMPT_TEMPLATES = {
+    TaskType.DESCRIPTION: PromptTemplate(
+        TaskType.DESCRIPTION, "v1",
+        "你是一个专业的遥感图像分析AI助手。请详细描述这张遥感图像中的内容，包括地形、建筑、植被等特征。"
+    ),
+    TaskType.DETECTION: PromptTemplate(TaskType.DETECTION, "v1", _DETECTION_PROMPT),
+    TaskType.SEGMENTATION: PromptTemplate(
+        TaskType.SEGMENTATION, "v1",
+        "你是一个专业的遥感图像分析AI助手。请对这张遥感图像进行语义分割，识别不同类型的地表覆盖物（如建筑、道路、植被、水体等）。"
+    ),
+    TaskType.CUSTOM: PromptTemplate(
+        TaskType.CUSTOM, "v1",
+        "你是一个专业的遥感图像分析AI助手。请分析这张遥感图像并回答问题。针对用户的问题，请基于历史对话的上下文给出相关的答案。"
+    ),
+}
+
+# 前端使用的任务类型别名
+_TASK_TYPE_ALIASES = {
+    "mark_object": TaskType.DETECTION
+}
+
+
+def get_prompt_template(task_type: Optional[str]) -> PromptTemplate:
+    """
+    按任务类型获取提示模板
+
+    Args:
+        task_type: 任务类型，未知或为空时使用custom模板
+
+    Returns:
+        提示模板
+    """
+    if task_type in _TASK_TYPE_ALIASES:
+        return PROMPT_TEMPLATES[_TASK_TYPE_ALIASES[task_type]]
+    try:
+        return PROMPT_TEMPLATES[TaskType(task_type)]
+    except ValueError:
+        return PROMPT_TEMPLATES[TaskType.CUSTOM]
+
+
+def build_messages(
+    template: PromptTemplate,
+    prompt: str,
+    image_url: Optional[str] = None,
+    image_base64: Optional[str] = None,
+    context_messages: Optional[List[Dict[str, Any]]] = None
+) -> List[Dict[str, Any]]:
+    """
+    按固定顺序构建发送给模型的消息：系统提示 -> 图像 -> 历史对话 -> 当前提问
+
+    同一对话中前缀（系统提示和图像）逐字节相同，历史对话只在末尾追加，
+    有利于服务商的前缀缓存和本地分析结果缓存命中。
+
+    Args:
+        template: 提示模板，见get_prompt_template
+        prompt: 当前提问
+        image_url: 图像URL（与image_base64二选一）
+        image_base64: Base64编码的图像
+        context_messages: 历史对话消息列表
+
+    Returns:
+        消息列表
+    """
+    messages = [{"role": "system", "content": template.system_prompt}]
+
+    if image_url or image_base64:
+        url = image_url or f"data:image/jpeg;base64,{image_base64}"
+        messages.append({
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": url}},
+                {"type": "text", "text": template.image_text}
+            ]
+        })
+
+    if context_messages:
+        messages.extend(context_messages)
+
+    messages.append({"role": "user", "content": prompt})
+    return messages
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional
+
+from app.core.config import MODEL_RATE_LIMITS, RATE_LIMIT_MAX_WAIT, ZHIPUAI_TIMEOUT
+from app.core.redis_client import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+# 令牌桶：按Redis服务器时间补充令牌，遵守429返回的冷却时间
+# 返回 {是否获得令牌, 需要等待的秒数}
+_TOKEN_BUCKET_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+
+local blocked_until = tonumber(redis.call('GET', KEYS[2]) or '0')
+if blocked_until > now then
+    return {0, tostring(blocked_until - now)}
+end
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local allowed = 0
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = (1 - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) * 2 + 1)
+return {allowed, tostring(wait)}
+"""
+
+# 全局并发信号量：有序集合中的每个成员是一个带过期时间的租约，进程崩溃后租约自动失效
+_SEMAPHORE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[1]) then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# 收到429后：清空令牌并设置冷却截止时间（只会延长，不会缩短）
+_PENALIZE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local until_ts = now + tonumber(ARGV[1])
+local current = tonumber(redis.call('GET', KEYS[2]) or '0')
+if until_ts > current then
+    redis.call('SET', KEYS[2], tostring(until_ts), 'EX', math.ceil(tonumber(ARGV[1])) + 1)
+end
+redis.call('HSET', KEYS[1], 'tokens', '0', 'ts', tostring(now))
+return 1
+"""
+
+# 轮询等待的最短间隔（秒）
+_MIN_POLL_INTERVAL = 0.05
+_MAX_POLL_INTERVAL = 1.0
+
+
+class RateLimitTimeout(Exception):
+    """在最长等待时间内没有获得调用配额"""
+
+
+class ModelRateLimiter:
+    """
+    模型接口的分布式限流器和并发控制器
+
+    所有API进程和Celery worker共享Redis中的令牌桶和并发信号量，按模型分别配置预算。
+    每个API密钥（服务商账号）各自使用一份预算，因为服务商按账号计算配额：密钥池中增加账号即可提高总吞吐。
+    配额用完时调用会短暂排队；服务商返回的retry-after会反馈到该账号的令牌桶中。
+    """
+
+    KEY_PREFIX = "model_rate_limit:"
+
+    def __init__(self, limits: Dict[str, Dict[str, Any]] = MODEL_RATE_LIMITS, max_wait: float = RATE_LIMIT_MAX_WAIT):
+        self.limits = limits
+        self.max_wait = max_wait
+        # 租约时长需覆盖一次完整的模型调用
+        self.lease_ttl = ZHIPUAI_TIMEOUT + 30
+
+    def _get_limits(self, model: str) -> Optional[Dict[str, Any]]:
+        return self.limits.get(model) or self.limits.get("default")
+
+    def _keys(self, model: str, account: Optional[str] = None):
+        # 没有指定账号时该模型的所有调用共享一份预算
+        prefix = f"{self.KEY_PREFIX}{model}:" + (f"{account}:" if account else "")
+        return prefix + "bucket", prefix + "blocked_until", prefix + "inflight"
+
+    async def _acquire_token(self, model, account, limits, deadline):
+        redis = get_async_redis()
+        bucket_key, blocked_key, _ = self._keys(model, account)
+        rate = limits["rpm"] / 60.0
+        capacity = limits.get("burst", max(1, limits["rpm"] // 6))
+
+        while True:
+            allowed, wait = await redis.eval(_TOKEN_BUCKET_SCRIPT, 2, bucket_key, blocked_key, rate, capacity)
+            if int(allowed):
+                return
+            wait = float(wait)
+            if time.monotonic() + wait > deadline:
+                raise RateLimitTimeout(f"模型 {model} 调用频率已达上限，请稍后重试")
+            await asyncio.sleep(min(max(wait, _MIN_POLL_INTERVAL), _MAX_POLL_INTERVAL))
+
+    async def _acquire_slot(self, model, account, limits, deadline):
+        redis = get_async_redis()
+        _, _, inflight_key = self._keys(model, account)
+        lease_id = str(uuid.uuid4())
+        interval = _MIN_POLL_INTERVAL
+
+        while True:
+            if await redis.eval(_SEMAPHORE_SCRIPT, 1, inflight_key, limits["concurrency"], lease_id, self.lease_ttl):
+                return lease_id
+            if time.monotonic() + interval > deadline:
+                raise RateLimitTimeout(f"模型 {model} 并发调用数已达上限，请稍后重试")
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, _MAX_POLL_INTERVAL)
+
+    @asynccontextmanager
+    async def limit(self, model: str, account: Optional[str] = None):
+        """
+        在限流和并发预算内执行一次模型调用
+
+        Args:
+            model: 模型名称
+            account: 本次调用使用的账号标识（ApiKeyState.account_id），为None时使用该模型共享的预算
+
+        Raises:
+            RateLimitTimeout: 超过最长排队时间仍未获得配额
+        """
+        limits = self._get_limits(model)
+        if not limits:
+            yield
+            return
+
+        deadline = time.monotonic() + self.max_wait
+        lease_id = None
+        try:
+            await self._acquire_token(model, account, limits, deadline)
+            lease_id = await self._acquire_slot(model, account, limits, deadline)
+        except RateLimitTimeout:
+            raise
+        except Exception as e:
+            # Redis不可用时不阻断模型调用
+            logger.warning(f"限流器不可用，跳过限流: {str(e)}")
+
+        try:
+            yield
+        finally:
+            if lease_id is not None:
+                try:
+                    await get_async_redis().zrem(self._keys(model, account)[2], lease_id)
+                except Exception as e:
+                    logger.warning(f"释放并发租约时出错: {str(e)}")
+
+    async def penalize(self, model: str, retry_after: Optional[float] = None, account: Optional[str] = None) -> float:
+        """
+        根据服务商的429响应暂停该账号对该模型的调用
+
+        Args:
+            model: 模型名称
+            retry_after: 服务商建议的等待时间（秒），没有时使用1秒
+            account: 收到429的账号标识，为None时暂停该模型共享的预算
+
+        Returns:
+            实际暂停的秒数
+        """
+        delay = retry_after if retry_after and retry_after > 0 else 1.0
+        bucket_key, blocked_key, _ = self._keys(model, account)
+        try:
+            await get_async_redis().eval(_PENALIZE_SCRIPT, 2, bucket_key, blocked_key, delay)
+        except Exception as e:
+            logger.warning(f"记录429冷却时间时出错: {str(e)}")
+        return delay
+
+    async def stats(self, accounts: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """
+        获取各模型每个账号当前的并发数和冷却状态
+
+        Args:
+            accounts: {账号标识: 显示名称}，为None时只统计各模型共享的预算
+
+        Returns:
+            {模型: {限流配置, "accounts": {显示名称: {"inflight", "blocked_for"}}}}
+        """
+        redis = get_async_redis()
+        now = time.time()
+        result = {}
+        for model, limits in self.limits.items():
+            usage = {}
+            for account, name in (accounts or {None: "shared"}).items():
+                _, blocked_key, inflight_key = self._keys(model, account)
+                blocked_until = float(await redis.get(blocked_key) or 0)
+                usage[name] = {
+                    "inflight": await redis.zcount(inflight_key, now, "+inf"),
+                    "blocked_for": max(0.0, blocked_until - now)
+                }
+            result[model] = {**limits, "accounts": usage}
+        return result
+
+
+# 创建全局限流器实例
+rate_limiter = ModelRateLimiter()
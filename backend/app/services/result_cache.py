@@ -0,0 +1,122 @@
+import base64
+import hashlib
+import json
+import logging
+import time
+from typing import Optional, List, Dict, Any
+
+from app.core.config import ANALYSIS_CACHE_ENABLED, ANALYSIS_CACHE_TTL, ANALYSIS_CACHE_MAX_ENTRIES
+from app.core.redis_client import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisResultCache:
+    """
+    模型分析结果的精确匹配缓存
+
+    键由图像内容SHA-256、提示、任务类型、模型和上下文哈希组成，
+    值保存在Redis中并带有TTL；通过有序集合记录最近访问时间，超过条目上限时淘汰最久未访问的条目。
+    """
+
+    KEY_PREFIX = "analysis_cache:entry:"
+    INDEX_KEY = "analysis_cache:index"
+    STATS_KEY = "analysis_cache:stats"
+
+    def __init__(self, enabled: bool = ANALYSIS_CACHE_ENABLED, ttl: int = ANALYSIS_CACHE_TTL,
+                 max_entries: int = ANALYSIS_CACHE_MAX_ENTRIES):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    @staticmethod
+    def hash_image(image_base64: Optional[str] = None, image_url: Optional[str] = None) -> str:
+        """计算图像内容的SHA-256（URL图像使用URL本身）"""
+        if image_base64:
+            try:
+                data = base64.b64decode(image_base64)
+            except ValueError:
+                data = image_base64.encode("utf-8")
+            return hashlib.sha256(data).hexdigest()
+        return hashlib.sha256((image_url or "").encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def hash_context(context_messages: Optional[List[Dict[str, Any]]]) -> str:
+        """计算对话上下文的哈希"""
+        payload = json.dumps(context_messages or [], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def make_key(image_sha256: str, prompt: str, task_type: Optional[str], model: str, context_hash: str) -> str:
+        """生成缓存键"""
+        raw = "\n".join([image_sha256, prompt or "", task_type or "", model or "", context_hash])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        读取缓存条目并记录命中/未命中
+
+        Returns:
+            缓存的结果字典，未命中或Redis不可用时返回None
+        """
+        try:
+            redis = get_async_redis()
+            raw = await redis.get(self.KEY_PREFIX + key)
+
+            async with redis.pipeline(transaction=False) as pipe:
+                if raw is not None:
+                    pipe.hincrby(self.STATS_KEY, "hits", 1)
+                    pipe.zadd(self.INDEX_KEY, {key: time.time()})
+                else:
+                    pipe.hincrby(self.STATS_KEY, "misses", 1)
+                await pipe.execute()
+
+            return json.loads(raw) if raw is not None else None
+        except Exception as e:
+            logger.warning(f"读取分析结果缓存时出错: {str(e)}")
+            return None
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        """写入缓存条目，并按条目上限淘汰最久未访问的条目"""
+        try:
+            redis = get_async_redis()
+            now = time.time()
+
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.set(self.KEY_PREFIX + key, json.dumps(value, ensure_ascii=False), ex=self.ttl)
+                pipe.zadd(self.INDEX_KEY, {key: now})
+                # 清理索引中已经过期的条目
+                pipe.zremrangebyscore(self.INDEX_KEY, "-inf", now - self.ttl)
+                pipe.zcard(self.INDEX_KEY)
+                size = (await pipe.execute())[-1]
+
+            overflow = size - self.max_entries
+            if overflow > 0:
+                evicted = await redis.zpopmin(self.INDEX_KEY, overflow)
+                if evicted:
+                    await redis.delete(*[self.KEY_PREFIX + member.decode("utf-8") for member, _ in evicted])
+                    await redis.hincrby(self.STATS_KEY, "evictions", len(evicted))
+        except Exception as e:
+            logger.warning(f"写入分析结果缓存时出错: {str(e)}")
+
+    async def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        redis = get_async_redis()
+        raw = await redis.hgetall(self.STATS_KEY)
+        stats = {k.decode("utf-8"): int(v) for k, v in raw.items()}
+        hits = stats.get("hits", 0)
+        misses = stats.get("misses", 0)
+        return {
+            "enabled": self.enabled,
+            "entries": await redis.zcard(self.INDEX_KEY),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": hits,
+            "misses": misses,
+            "evictions": stats.get("evictions", 0),
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0
+        }
+
+
+# 创建全局缓存实例
+result_cache = AnalysisResultCache()
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from redis.exceptions import RedisError
+
+from app.core.config import SINGLE_FLIGHT_LOCK_TTL, SINGLE_FLIGHT_WAIT_TIMEOUT
+from app.core.redis_client import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    跨进程的相同请求合并（single-flight）
+
+    对同一个键，第一个到达的调用者成为leader并真正执行请求，其余调用者（follower）
+    订阅leader的完成通知并直接复用结果。leader没有给出可用结果时，follower重新选举，
+    只有新的leader执行请求，其余follower继续等待；多次选举后仍没有结果或等待超时时，
+    follower自行执行请求。Redis不可用时不合并，直接执行请求。
+    """
+
+    LOCK_PREFIX = "single_flight:lock:"
+    RESULT_PREFIX = "single_flight:result:"
+    CHANNEL_PREFIX = "single_flight:done:"
+    STATS_KEY = "single_flight:stats"
+
+    # leader未产生可共享结果时发布的标记
+    FAILED = "failed"
+
+    # leader没有给出可用结果时最多重新选举的次数
+    MAX_ELECTIONS = 3
+
+    def __init__(self, lock_ttl: int = SINGLE_FLIGHT_LOCK_TTL, wait_timeout: int = SINGLE_FLIGHT_WAIT_TIMEOUT):
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+
+    async def run(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Tuple[Dict[str, Any], bool]]],
+        is_canceled: Optional[Callable[[], bool]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        合并执行请求
+
+        Args:
+            key: 请求键，相同键的并发请求只执行一次
+            fn: 执行请求的协程函数，返回(结果字典, 结果是否可共享)
+            is_canceled: 等待期间检查调用者是否已被取消的函数
+
+        Returns:
+            结果字典；follower在等待期间被取消时返回None
+        """
+        redis = get_async_redis()
+        deadline = time.monotonic() + self.wait_timeout
+
+        for election in range(self.MAX_ELECTIONS + 1):
+            token = str(uuid.uuid4())
+            try:
+                is_leader = await redis.set(self.LOCK_PREFIX + key, token, nx=True, ex=self.lock_ttl)
+            except (RedisError, OSError) as e:
+                logger.warning(f"single-flight不可用，直接执行请求: {str(e)}")
+                result, _ = await fn()
+                return result
+
+            if is_leader:
+                await self._count("reelections" if election else "leaders")
+                return await self._lead(key, token, fn)
+
+            if not election:
+                await self._count("followers")
+            result = await self._follow(key, is_canceled, deadline)
+            if result is not self.FAILED:
+                return result
+            if time.monotonic() >= deadline:
+                break
+            # leader没有给出可用结果（例如被取消或出错），重新选举，避免所有follower同时执行
+            logger.info(f"single-flight leader未返回可用结果，重新选举: {key}")
+
+        # 多次选举后仍没有可用结果，或等待超时，自行执行
+        logger.info(f"single-flight没有可用结果，自行执行请求: {key}")
+        await self._count("fallbacks")
+        result, _ = await fn()
+        return result
+
+    async def _count(self, name):
+        """更新统计信息，Redis出错时忽略"""
+        try:
+            await get_async_redis().hincrby(self.STATS_KEY, name, 1)
+        except (RedisError, OSError) as e:
+            logger.warning(f"更新single-flight统计信息时出错: {str(e)}")
+
+    async def _lead(self, key, token, fn):
+        """作为leader执行请求并发布结果（发布失败时follower在锁消失后重新选举）"""
+        redis = get_async_redis()
+        published = False
+        try:
+            result, shareable = await fn()
+            if shareable:
+                try:
+                    await redis.set(self.RESULT_PREFIX + key, json.dumps(result, ensure_ascii=False), ex=self.lock_ttl)
+                    await redis.publish(self.CHANNEL_PREFIX + key, "done")
+                    published = True
+                except (RedisError, OSError) as e:
+                    logger.warning(f"发布single-flight结果时出错: {str(e)}")
+            return result
+        finally:
+            try:
+                # 只释放自己持有的锁；先释放再通知失败，收到通知的follower可以立即重新选举
+                if await redis.get(self.LOCK_PREFIX + key) == token.encode("utf-8"):
+                    await redis.delete(self.LOCK_PREFIX + key)
+                if not published:
+                    await redis.publish(self.CHANNEL_PREFIX + key, self.FAILED)
+            except (RedisError, OSError) as e:
+                logger.warning(f"释放single-flight锁时出错: {str(e)}")
+
+    async def _follow(self, key, is_canceled, deadline):
+        """作为follower等待leader的结果，leader没有给出可用结果、等待超时或Redis出错时返回FAILED"""
+        redis = get_async_redis()
+        pubsub = redis.pubsub()
+        try:
+            await pubsub.subscribe(self.CHANNEL_PREFIX + key)
+            while time.monotonic() < deadline:
+                # 先订阅再读取结果，避免错过在订阅之前完成的leader
+                raw = await redis.get(self.RESULT_PREFIX + key)
+                if raw is not None:
+                    return json.loads(raw)
+
+                if is_canceled is not None and is_canceled():
+                    return None
+
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is not None and message["data"] == self.FAILED.encode("utf-8"):
+                    return self.FAILED
+
+                # leader已经退出（例如进程崩溃）且没有结果
+                if message is None and not await redis.exists(self.LOCK_PREFIX + key):
+                    raw = await redis.get(self.RESULT_PREFIX + key)
+                    return json.loads(raw) if raw is not None else self.FAILED
+
+            logger.warning(f"等待single-flight leader超时: {key}")
+            return self.FAILED
+        except (RedisError, OSError) as e:
+            logger.warning(f"等待single-flight结果时出错: {str(e)}")
+            return self.FAILED
+        finally:
+            try:
+                await pubsub.unsubscribe()
+                await pubsub.aclose()
+            except (RedisError, OSError):
+                pass
+
+    async def stats(self) -> Dict[str, int]:
+        """获取请求合并统计信息"""
+        raw = await get_async_redis().hgetall(self.STATS_KEY)
+        return {k.decode("utf-8"): int(v) for k, v in raw.items()}
+
+
+# 创建全局实例
+single_flight = SingleFlight()
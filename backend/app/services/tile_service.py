@@ -0,0 +1,221 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from app.core.config import DERIVED_FOLDER, MAP_TILE_FOLDER, MAP_TILE_SIZE, MAP_TILE_MEMORY_CACHE_BYTES, IMAGE_JPEG_QUALITY
+from app.services.image_pipeline import run_in_pool
+from app.utils.raster_utils import build_pyramid, read_pyramid_tile
+
+logger = logging.getLogger(__name__)
+
+# 金字塔和图块的生成方式变化时提升版本，使浏览器缓存的图块（ETag）失效
+PYRAMID_VERSION = "v1"
+
+
+def _stem(image_path: str) -> str:
+    return os.path.splitext(os.path.basename(image_path))[0]
+
+
+def pyramid_path(image_path: str) -> str:
+    """上传图像对应的金字塔影像路径"""
+    return os.path.join(DERIVED_FOLDER, f"{_stem(image_path)}.pyramid.tif")
+
+
+def pyramid_meta_path(image_path: str) -> str:
+    """上传图像对应的金字塔元数据路径"""
+    return os.path.join(DERIVED_FOLDER, f"{_stem(image_path)}.pyramid.json")
+
+
+def build_upload_pyramid(image_path: str, tile_size: int = MAP_TILE_SIZE, quality: int = IMAGE_JPEG_QUALITY) -> Dict[str, Any]:
+    """
+    为上传图像生成金字塔影像和元数据文件（同步执行，在进程池中调用）
+
+    Returns:
+        金字塔元数据，见build_pyramid
+    """
+    meta = build_pyramid(image_path, pyramid_path(image_path), tile_size, quality)
+    meta_path = pyramid_meta_path(image_path)
+    with open(f"{meta_path}.{os.getpid()}.tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(f"{meta_path}.{os.getpid()}.tmp", meta_path)
+    return meta
+
+
+class TileService:
+    """
+    上传图像的地图图块服务
+
+    每个上传图像第一次被浏览时在进程池中生成一次金字塔影像（8位RGB、分块、内建概览），
+    之后按缩放级别读取tile_size像素的图块。图块缓存在磁盘上，进程内另有按字节数淘汰的LRU缓存。
+    上传文件按内容哈希命名，同一地址的图块内容不会变化，可以使用强ETag并长期缓存。
+    """
+
+    def __init__(self, folder: str = MAP_TILE_FOLDER, tile_size: int = MAP_TILE_SIZE,
+                 memory_bytes: int = MAP_TILE_MEMORY_CACHE_BYTES, quality: int = IMAGE_JPEG_QUALITY):
+        self.folder = folder
+        self.tile_size = tile_size
+        self.memory_bytes = memory_bytes
+        self.quality = quality
+        self._memory: "OrderedDict[Tuple[str, int, int, int], bytes]" = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        self._building: Dict[str, asyncio.Future] = {}
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.rendered = 0
+        self.evictions = 0
+        self.pyramids_built = 0
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _tile_path(self, stem: str, z: int, x: int, y: int) -> str:
+        return os.path.join(self.folder, stem, str(z), str(x), f"{y}.jpg")
+
+    def _memory_get(self, key: Tuple[str, int, int, int]) -> Optional[bytes]:
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+            return data
+
+    def _memory_put(self, key: Tuple[str, int, int, int], data: bytes) -> None:
+        if len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = data
+            self._memory_size += len(data)
+            while self._memory_size > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+                self.evictions += 1
+
+    def etag(self, image_path: str, z: int, x: int, y: int) -> str:
+        """图块的强ETag"""
+        return f'"{_stem(image_path)}-{PYRAMID_VERSION}-{z}-{x}-{y}"'
+
+    async def pyramid_info(self, image_path: str) -> Dict[str, Any]:
+        """
+        获取上传图像的金字塔元数据，不存在时生成（同一图像的并发请求只生成一次）
+
+        Args:
+            image_path: 上传图像的本地路径
+
+        Returns:
+            宽高、图块边长和最高缩放级别
+        """
+        try:
+            with open(pyramid_meta_path(image_path), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        stem = _stem(image_path)
+        future = self._building.get(stem)
+        if future is None:
+            logger.info(f"生成金字塔影像: {image_path}")
+            future = asyncio.ensure_future(run_in_pool(build_upload_pyramid, image_path, self.tile_size, self.quality))
+            self._building[stem] = future
+
+            def done(_):
+                self._building.pop(stem, None)
+                if not future.cancelled() and future.exception() is None:
+                    self.pyramids_built += 1
+
+            future.add_done_callback(done)
+        return await asyncio.shield(future)
+
+    async def get_tile(self, image_path: str, z: int, x: int, y: int) -> Optional[bytes]:
+        """
+        获取一个图块
+
+        Args:
+            image_path: 上传图像的本地路径
+            z: 缩放级别，0级用一个图块覆盖整幅场景，最高级为原始分辨率
+            x: 图块列号
+            y: 图块行号
+
+        Returns:
+            JPEG图块数据，超出场景范围时返回None
+        """
+        stem = _stem(image_path)
+        key = (stem, z, x, y)
+        data = self._memory_get(key)
+        if data is not None:
+            return data
+
+        meta = await self.pyramid_info(image_path)
+        tile_path = self._tile_path(stem, z, x, y)
+        try:
+            data = await asyncio.to_thread(_read_file, tile_path)
+            with self._lock:
+                self.disk_hits += 1
+        except FileNotFoundError:
+            data = await asyncio.to_thread(
+                read_pyramid_tile, pyramid_path(image_path), z, x, y, meta["max_zoom"], meta["tile_size"], self.quality
+            )
+            if data is None:
+                return None
+            with self._lock:
+                self.rendered += 1
+            try:
+                await asyncio.to_thread(_write_file, tile_path, data)
+            except OSError as e:
+                logger.warning(f"保存图块缓存时出错: {str(e)}")
+
+        self._memory_put(key, data)
+        return data
+
+    def remove(self, image_path: str) -> None:
+        """删除上传图像的金字塔影像、元数据和图块缓存"""
+        stem = _stem(image_path)
+        for path in (pyramid_path(image_path), pyramid_meta_path(image_path)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        shutil.rmtree(os.path.join(self.folder, stem), ignore_errors=True)
+
+        with self._lock:
+            for key in [key for key in self._memory if key[0] == stem]:
+                self._memory_size -= len(self._memory.pop(key))
+
+    def stats(self) -> Dict[str, Any]:
+        """获取本进程的图块缓存统计"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.rendered
+            return {
+                "tile_size": self.tile_size,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "memory_limit_bytes": self.memory_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "rendered": self.rendered,
+                "evictions": self.evictions,
+                "pyramids_built": self.pyramids_built,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+            }
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _write_file(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+# 创建全局图块服务实例
+tile_service = TileService()
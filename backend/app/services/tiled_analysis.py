@@ -0,0 +1,188 @@
+import asyncio
+import json
+import logging
+from types import SimpleNamespace
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from app.core.config import TILE_SIZE, TILE_OVERLAP, TILE_CONCURRENCY, TILE_MAX_TILES, TILE_MAX_IMAGE_SIZE
+from app.models.analyze import TaskType
+from app.services.prompt_registry import get_prompt_template
+from app.services.zhipuai_service import zhipuai_service
+from app.utils.detection_parser import parse_detections
+from app.utils.detection_postprocess import postprocess_detections, remap_boxes
+from app.utils.raster_utils import Tile, plan_tiles, raster_size, compute_stretch, read_tile_base64
+
+logger = logging.getLogger(__name__)
+
+
+def _remap_bbox(bbox: List[float], tile: Tile, scene_width: int, scene_height: int) -> List[float]:
+    """把图块内的相对坐标换算为整幅场景的相对坐标"""
+    x1, y1, x2, y2 = bbox
+    return [
+        (tile.col_off + x1 * tile.width) / scene_width,
+        (tile.row_off + y1 * tile.height) / scene_height,
+        (tile.col_off + x2 * tile.width) / scene_width,
+        (tile.row_off + y2 * tile.height) / scene_height
+    ]
+
+
+def merge_detections(tiles_detections: List[tuple], scene_width: int, scene_height: int) -> List[Dict[str, Any]]:
+    """
+    合并来自各图块的检测结果：换算到整幅场景的相对坐标，去除退化的检测框，
+    并按标签NMS去除重叠区域中的重复目标（保留面积最大的检测框）
+
+    Args:
+        tiles_detections: [(图块, 该图块内解析出的检测结果)]
+        scene_width: 场景宽度（像素）
+        scene_height: 场景高度（像素）
+
+    Returns:
+        合并后的检测结果，每项包含label、bbox和tile
+    """
+    detections = [
+        {"label": detection["label"], "bbox": detection["bbox"], "tile": tile.index}
+        for tile, items in tiles_detections for detection in items
+    ]
+    if not detections:
+        return []
+
+    counts = [len(items) for _, items in tiles_detections]
+    offsets = np.repeat([[tile.col_off, tile.row_off] for tile, _ in tiles_detections], counts, axis=0)
+    sizes = np.repeat([[tile.width, tile.height] for tile, _ in tiles_detections], counts, axis=0)
+    boxes = np.array([d["bbox"] for d in detections], dtype=np.float64)
+    for detection, bbox in zip(detections, remap_boxes(boxes, offsets, sizes, (scene_width, scene_height)).tolist()):
+        detection["bbox"] = bbox
+    return postprocess_detections(detections, (scene_width, scene_height))
+
+
+def should_tile(image_path: str, min_side: int) -> bool:
+    """
+    场景最长边超过min_side时使用分块分析
+
+    Args:
+        image_path: 栅格文件路径
+        min_side: 自动启用分块分析的最长边（像素）
+    """
+    try:
+        return max(raster_size(image_path)) > min_side
+    except Exception as e:
+        logger.warning(f"读取栅格尺寸时出错，不使用分块分析: {str(e)}")
+        return False
+
+
+async def analyze_tiled(image_path: str, prompt: str, task_type: Optional[str] = None,
+                        context_messages: Optional[List[Dict[str, Any]]] = None, cancel_token=None,
+                        use_cache: bool = True, profile: Optional[str] = None,
+                        tile_size: int = TILE_SIZE, overlap: int = TILE_OVERLAP,
+                        concurrency: int = TILE_CONCURRENCY, on_detection=None):
+    """
+    分块分析大幅遥感场景
+
+    按重叠的窗口逐块读取栅格（不读取整幅影像），在worker事件循环中并发分析各图块，
+    再把结果合并为场景级的输出：检测任务的坐标换算到整幅场景并去除重叠区域的重复目标，
+    其他任务按图块顺序汇总各区域的回答。
+
+    Args:
+        image_path: 栅格文件路径（原始上传文件）
+        prompt: 分析提示
+        task_type: 任务类型
+        context_messages: 对话上下文消息列表
+        cancel_token: 任务的CancelToken
+        use_cache: 是否使用分析结果缓存（按图块缓存）
+        profile: 执行档位名称
+        tile_size: 图块边长（像素）
+        overlap: 相邻图块的重叠宽度（像素）
+        concurrency: 同时分析的图块数
+        on_detection: 每个检测结果在流式输出中闭合时调用的回调，坐标已换算到整幅场景
+            （重叠区域的重复目标在全部图块完成后才去除）
+
+    Returns:
+        与analyze_image返回值兼容的结果，另含tiles、failed_tiles和detections字段
+
+    Raises:
+        ValueError: 图块数超过TILE_MAX_TILES
+    """
+    scene_width, scene_height = await asyncio.to_thread(raster_size, image_path)
+    tiles = plan_tiles(scene_width, scene_height, tile_size, overlap)
+    if len(tiles) > TILE_MAX_TILES:
+        raise ValueError(f"场景过大（{scene_width}x{scene_height}），需要 {len(tiles)} 个图块，超过上限 {TILE_MAX_TILES}")
+    logger.info(f"分块分析 {image_path}: {scene_width}x{scene_height}，{len(tiles)} 个图块")
+
+    stretch = await asyncio.to_thread(compute_stretch, image_path)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def analyze_tile(tile: Tile):
+        async with semaphore:
+            if cancel_token is not None and cancel_token.is_set():
+                return None
+            image_base64 = await asyncio.to_thread(read_tile_base64, image_path, tile, stretch, TILE_MAX_IMAGE_SIZE)
+            
+            on_tile_detection = None
+            if on_detection is not None:
+                def on_tile_detection(detection):
+                    on_detection({
+                        "label": detection["label"],
+                        "bbox": _remap_bbox(detection["bbox"], tile, scene_width, scene_height)
+                    })
+            
+            return await zhipuai_service.analyze_image(
+                image_base64=image_base64,
+                prompt=prompt,
+                task_type=task_type,
+                context_messages=context_messages,
+                cancel_token=cancel_token,
+                use_cache=use_cache,
+                profile=profile,
+                on_detection=on_tile_detection
+            )
+
+    results = await asyncio.gather(*(analyze_tile(tile) for tile in tiles), return_exceptions=True)
+
+    if cancel_token is not None and cancel_token.is_set():
+        return SimpleNamespace(content="[用户已取消生成]", thinking="[用户已取消生成]", cached=False, model=None)
+
+    succeeded = []
+    failed_tiles = []
+    for tile, result in zip(tiles, results):
+        if isinstance(result, BaseException) or not hasattr(result, "content"):
+            error = result.get("error") if isinstance(result, dict) else str(result)
+            logger.warning(f"图块 {tile.index} 分析失败: {error}")
+            failed_tiles.append({**tile.to_dict(), "error": error})
+        else:
+            succeeded.append((tile, result))
+
+    if not succeeded:
+        return {"error": f"所有图块分析失败: {failed_tiles[0]['error'] if failed_tiles else '没有图块'}"}
+
+    summary = f"分块分析：场景 {scene_width}x{scene_height} 像素，共 {len(tiles)} 个图块"
+    if failed_tiles:
+        summary += f"，其中 {len(failed_tiles)} 个失败"
+
+    detections = None
+    if get_prompt_template(task_type).task_type == TaskType.DETECTION:
+        detections = merge_detections(
+            [(tile, parse_detections(result.content or "")) for tile, result in succeeded], scene_width, scene_height
+        )
+        objects = [{"label": d["label"], "bbox": [round(v, 4) for v in d["bbox"]]} for d in detections]
+        content = f"{summary}，检测到 {len(objects)} 个目标。\n```json\n{json.dumps(objects, ensure_ascii=False)}\n```"
+    else:
+        sections = [
+            f"### 区域 {tile.row + 1}-{tile.col + 1}（x {tile.col_off}-{tile.col_off + tile.width}，"
+            f"y {tile.row_off}-{tile.row_off + tile.height}）\n{result.content}"
+            for tile, result in succeeded
+        ]
+        content = f"{summary}。\n\n" + "\n\n".join(sections)
+
+    first = succeeded[0][1]
+    return SimpleNamespace(
+        content=content,
+        thinking=None,
+        cached=all(result.cached for _, result in succeeded),
+        model=first.model,
+        prompt_version=getattr(first, "prompt_version", None),
+        tiles=len(tiles),
+        failed_tiles=failed_tiles,
+        detections=detections
+    )
@@ -1,10 +1,30 @@
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, BinaryIO, Iterator, Tuple
+from sqlalchemy import table, column
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from datetime import datetime
+import hashlib
+import json
+import logging
+import os
 import uuid
 
-from app.db.models import User, Chat, Message
+from app.db.models import User, Chat, Message, Upload, Detection
+from app.core.config import UPLOAD_FOLDER, MAX_CONTENT_LENGTH, UPLOAD_CHUNK_SIZE, DETECTION_EXPORT_CHUNK_SIZE
 from app.core.security import get_password_hash, verify_password
+from app.services.artifact_store import artifact_store
+from app.services.image_pipeline import remove_derived, load_image_meta
+from app.services.tile_service import tile_service
+from app.utils.detection_parser import parse_detections
+from app.utils.detection_postprocess import postprocess_detections
+from app.utils.raster_utils import raster_size, read_georeference
+
+logger = logging.getLogger(__name__)
+
+
+class UploadTooLargeError(ValueError):
+    """上传文件超过MAX_CONTENT_LENGTH"""
+
 
 class UserService:
     @staticmethod
@@ -90,11 +110,20 @@ class ChatService:
     
     @staticmethod
     def delete_chat(db: Session, chat_id: str) -> bool:
-        """删除聊天会话"""
+        """删除聊天会话，并释放其消息引用的上传图像"""
         chat = ChatService.get_chat_by_id(db, chat_id)
         if chat:
+            image_paths = [message.image_path for message in chat.messages if message.image_path]
             db.delete(chat)
-            db.commit()
+            released = UploadService.release_uploads(db, image_paths)
+            try:
+                db.commit()
+            except Exception:
+                db.rollback()
+                UploadService.restore_released(released)
+                raise
+            # 提交成功后再删除文件
+            UploadService.remove_released(released)
             return True
         return False
 
@@ -109,9 +138,11 @@ class MessageService:
         thinking: Optional[str] = None,
         error: bool = False,
         object_coordinates: Optional[str] = None,
-        is_object_mark: bool = False
+        is_object_mark: bool = False,
+        prompt_version: Optional[str] = None,
+        commit: bool = True
     ) -> Message:
-        """创建新消息"""
+        """创建新消息（commit为False时只写入当前事务，由调用方提交）"""
         message = Message(
             id=str(uuid.uuid4()),
             chat_id=chat_id,
@@ -122,15 +153,23 @@ class MessageService:
             error=error,
             object_coordinates=object_coordinates,
             is_object_mark=is_object_mark,
+            prompt_version=prompt_version,
             timestamp=datetime.utcnow()
         )
         db.add(message)
         
+        # 把检测结果写入detections表，便于按标签和区域查询
+        if object_coordinates:
+            DetectionService.index_message(db, message)
+        
         # 更新聊天会话的最后更新时间
         chat = db.query(Chat).filter(Chat.id == chat_id).first()
         if chat:
             chat.last_updated = datetime.utcnow()
         
+        if not commit:
+            db.flush()
+            return message
         db.commit()
         db.refresh(message)
         return message
@@ -149,3 +188,347 @@ class MessageService:
     def get_last_messages(db: Session, chat_id: str, limit: int = 10) -> List[Message]:
         """获取聊天会话的最近消息"""
         return db.query(Message).filter(Message.chat_id == chat_id).order_by(Message.timestamp.desc()).limit(limit).all()
+
+class UploadService:
+    @staticmethod
+    def filename_from_image_path(image_path: str) -> str:
+        """从消息中的图像URL（/api/uploads/xxx）得到上传目录中的文件名"""
+        return os.path.basename(image_path.replace("/api/uploads/", ""))
+    
+    @staticmethod
+    def receive_upload(src: BinaryIO, max_bytes: int = MAX_CONTENT_LENGTH,
+                       chunk_size: int = UPLOAD_CHUNK_SIZE) -> Tuple[str, str, int]:
+        """
+        把上传内容分块写入上传目录中的临时文件，同时计算SHA-256（同步执行，请放到线程池调用）
+        
+        Args:
+            src: 上传文件对象（UploadFile.file）
+            max_bytes: 文件大小上限
+            chunk_size: 每次读取的字节数
+            
+        Returns:
+            (临时文件路径, SHA-256, 文件大小)
+            
+        Raises:
+            UploadTooLargeError: 文件超过大小上限（临时文件已删除）
+        """
+        sha256 = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(UPLOAD_FOLDER, f".{uuid.uuid4().hex}.upload.tmp")
+        try:
+            with open(tmp_path, "wb") as dst:
+                for chunk in iter(lambda: src.read(chunk_size), b""):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise UploadTooLargeError(f"文件大小超过限制（{max_bytes // (1024 * 1024)}MB）")
+                    sha256.update(chunk)
+                    dst.write(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path, sha256.hexdigest(), size
+    
+    @staticmethod
+    def store_upload(db: Session, tmp_path: str, sha256: str, size: int, extension: str,
+                     commit: bool = True) -> Upload:
+        """
+        按内容的SHA-256保存上传文件并增加引用计数，相同内容只保存一份（同步执行，请放到线程池调用）
+        
+        引用计数的更新在移动文件之前执行，SQLite的写锁会一直持有到提交，
+        与release_uploads中移走文件的操作互斥。两个请求同时第一次保存相同内容时，
+        插入失败的一方改为增加引用计数。
+        
+        Args:
+            db: 数据库会话
+            tmp_path: receive_upload写入的临时文件，保存后被移动或删除
+            sha256: 文件内容的SHA-256
+            size: 文件大小（字节）
+            extension: 文件扩展名（如".png"），仅在第一次保存该内容时使用
+            commit: 为False时不提交，由调用方把引用计数和拥有该引用的消息一起提交（失败时整个事务回滚）
+            
+        Returns:
+            上传记录
+        """
+        try:
+            for attempt in range(2):
+                updated = db.query(Upload).filter(Upload.sha256 == sha256).update(
+                    {Upload.ref_count: Upload.ref_count + 1}, synchronize_session=False
+                )
+                if updated:
+                    break
+                try:
+                    db.add(Upload(
+                        sha256=sha256,
+                        filename=f"{sha256}{extension.lower()}",
+                        size=size,
+                        ref_count=1,
+                        created_at=datetime.utcnow()
+                    ))
+                    db.flush()
+                    break
+                except IntegrityError:
+                    # 另一个请求刚刚插入了相同内容的记录，回滚后重新增加引用计数
+                    db.rollback()
+                    if attempt:
+                        raise
+            upload = db.query(Upload).filter(Upload.sha256 == sha256).first()
+            
+            path = os.path.join(UPLOAD_FOLDER, upload.filename)
+            if not os.path.exists(path):
+                os.replace(tmp_path, path)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        
+        if commit:
+            db.commit()
+            db.refresh(upload)
+        return upload
+    
+    @staticmethod
+    def update_georeference(db: Session, upload: Upload) -> Upload:
+        """
+        读取上传图像的尺寸和地理参考（GeoTIFF的仿射变换和坐标参考系）并保存到上传记录中
+        
+        读取文件头的操作是同步的，请放到线程池调用。无法读取时只记录警告。
+        
+        Args:
+            db: 数据库会话
+            upload: 上传记录
+            
+        Returns:
+            上传记录
+        """
+        try:
+            georeference = read_georeference(os.path.join(UPLOAD_FOLDER, upload.filename))
+        except Exception as e:
+            logger.warning(f"读取上传图像 {upload.filename} 的地理参考时出错: {str(e)}")
+            return upload
+        
+        upload.width = georeference["width"]
+        upload.height = georeference["height"]
+        upload.crs = georeference["crs"]
+        upload.transform = json.dumps(georeference["transform"]) if georeference["transform"] else None
+        db.commit()
+        db.refresh(upload)
+        return upload
+    
+    @staticmethod
+    def release_uploads(db: Session, image_paths: List[str]) -> List[Tuple[str, str]]:
+        """
+        减少上传文件的引用计数，计数归零时把文件移到待删除的临时路径（不提交事务）
+        
+        文件在写锁内移走，与store_upload互斥；提交成功后调用remove_released删除文件及其派生文件，
+        提交失败时调用restore_released移回原处，引用计数和文件始终一致。
+        
+        Args:
+            db: 数据库会话
+            image_paths: 被删除消息的图像URL列表
+            
+        Returns:
+            [(原路径, 待删除的临时路径)]
+        """
+        released = []
+        for image_path in image_paths:
+            filename = UploadService.filename_from_image_path(image_path)
+            updated = db.query(Upload).filter(Upload.filename == filename).update(
+                {Upload.ref_count: Upload.ref_count - 1}, synchronize_session=False
+            )
+            if not updated:
+                # 内容寻址存储之前上传的文件，没有引用计数
+                continue
+            
+            deleted = db.query(Upload).filter(Upload.filename == filename, Upload.ref_count <= 0).delete(
+                synchronize_session=False
+            )
+            if deleted:
+                path = os.path.join(UPLOAD_FOLDER, filename)
+                tombstone = os.path.join(UPLOAD_FOLDER, f".{uuid.uuid4().hex}.deleted")
+                try:
+                    os.replace(path, tombstone)
+                    released.append((path, tombstone))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f"移走上传文件 {filename} 时出错: {str(e)}")
+        return released
+    
+    @staticmethod
+    def remove_released(released: List[Tuple[str, str]]) -> None:
+        """提交成功后删除release_uploads移走的文件及其派生文件"""
+        for path, tombstone in released:
+            try:
+                artifact_store.remove(path)
+                tile_service.remove(path)
+                remove_derived(path)
+                os.remove(tombstone)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"删除上传文件 {os.path.basename(path)} 时出错: {str(e)}")
+    
+    @staticmethod
+    def restore_released(released: List[Tuple[str, str]]) -> None:
+        """提交失败时把release_uploads移走的文件移回原处"""
+        for path, tombstone in released:
+            try:
+                os.replace(tombstone, path)
+            except OSError as e:
+                logger.warning(f"恢复上传文件 {os.path.basename(path)} 时出错: {str(e)}")
+
+
+# detections表的R*Tree空间索引（见app/db/models.py中的DETECTIONS_RTREE_DDL）
+_detections_rtree = table(
+    "detections_rtree", column("id"), column("min_x"), column("max_x"), column("min_y"), column("max_y")
+)
+
+class DetectionService:
+    @staticmethod
+    def _chat_image(db: Session, chat_id: str) -> Tuple[Optional[str], Optional[Tuple[int, int]]]:
+        """
+        聊天中最近上传的图像
+        
+        Returns:
+            (上传文件名, 原始尺寸)，找不到图像时为(None, None)，无法读取尺寸时尺寸为None
+        """
+        row = db.query(Message.image_path).filter(
+            Message.chat_id == chat_id,
+            Message.sender == "system",
+            Message.image_path.isnot(None)
+        ).order_by(Message.timestamp.desc()).first()
+        if not row:
+            return None, None
+        
+        filename = UploadService.filename_from_image_path(row[0])
+        upload = db.query(Upload.width, Upload.height).filter(Upload.filename == filename).first()
+        if upload and upload.width:
+            return filename, (upload.width, upload.height)
+        
+        path = os.path.join(UPLOAD_FOLDER, filename)
+        meta = load_image_meta(path)
+        if meta:
+            return filename, (meta["original_width"], meta["original_height"])
+        try:
+            return filename, raster_size(path)
+        except Exception:
+            return filename, None
+    
+    @staticmethod
+    def index_message(db: Session, message: Message) -> List[Detection]:
+        """
+        解析消息的object_coordinates，为每个检测框添加一行Detection（不提交事务）
+        
+        Args:
+            db: 数据库会话
+            message: 带有object_coordinates的AI消息
+            
+        Returns:
+            添加的检测结果
+        """
+        items = parse_detections(message.object_coordinates or "")
+        if not items:
+            return []
+        
+        # 限制到图像范围内，去除退化和重复的检测框，并按图像尺寸换算像素坐标
+        upload_filename, image_size = DetectionService._chat_image(db, message.chat_id)
+        items = postprocess_detections(items, image_size)
+        detections = []
+        for item in items:
+            x1, y1, x2, y2 = item["bbox"]
+            detection = Detection(
+                message_id=message.id, chat_id=message.chat_id, upload_filename=upload_filename,
+                label=item["label"], x1=x1, y1=y1, x2=x2, y2=y2
+            )
+            if "pixel_bbox" in item:
+                detection.pixel_x1, detection.pixel_y1, detection.pixel_x2, detection.pixel_y2 = item["pixel_bbox"]
+            detections.append(detection)
+        db.add_all(detections)
+        return detections
+    
+    @staticmethod
+    def query(
+        db: Session,
+        user_id: str,
+        label: Optional[str] = None,
+        bbox: Optional[Tuple[float, float, float, float]] = None,
+        chat_id: Optional[str] = None,
+        limit: int = 100
+    ) -> List[Detection]:
+        """
+        查询用户的检测结果
+        
+        Args:
+            db: 数据库会话
+            user_id: 用户ID
+            label: 只返回该标签的检测框
+            bbox: 查询区域(x1, y1, x2, y2)，0-1相对坐标，只返回与之相交的检测框（SQLite上使用R*Tree索引）
+            chat_id: 只返回该聊天中的检测框
+            limit: 最多返回的数量
+            
+        Returns:
+            按时间倒序排列的检测结果
+        """
+        query = db.query(Detection).join(Chat, Chat.id == Detection.chat_id).filter(Chat.user_id == user_id)
+        if bbox is not None:
+            x1, y1, x2, y2 = bbox
+            if db.get_bind().dialect.name == "sqlite":
+                # R*Tree虚拟表只在SQLite上创建（见models.DETECTIONS_RTREE_DDL）
+                rtree = _detections_rtree
+                query = query.join(rtree, rtree.c.id == Detection.id).filter(
+                    rtree.c.min_x <= x2, rtree.c.max_x >= x1, rtree.c.min_y <= y2, rtree.c.max_y >= y1
+                )
+            # R*Tree按32位浮点数存储坐标（向外取整），再按原始坐标精确比较；其他数据库只按原始坐标比较
+            query = query.filter(
+                Detection.x1 <= x2, Detection.x2 >= x1, Detection.y1 <= y2, Detection.y2 >= y1
+            )
+        if label is not None:
+            query = query.filter(Detection.label == label)
+        if chat_id is not None:
+            query = query.filter(Detection.chat_id == chat_id)
+        return query.order_by(Detection.id.desc()).limit(limit).all()
+    
+    @staticmethod
+    def iter_chunks(
+        db: Session,
+        user_id: str,
+        chat_id: Optional[str] = None,
+        upload_filename: Optional[str] = None,
+        label: Optional[str] = None,
+        chunk_size: int = DETECTION_EXPORT_CHUNK_SIZE
+    ) -> Iterator[List[Any]]:
+        """
+        按id顺序分批读取用户的检测结果（按id翻页，每批单独查询，不把全部结果读入内存）
+        
+        Args:
+            db: 数据库会话
+            user_id: 用户ID
+            chat_id: 只读取该聊天中的检测框
+            upload_filename: 只读取该上传图像上的检测框
+            label: 只读取该标签的检测框
+            chunk_size: 每批的数量
+            
+        Returns:
+            每批检测结果的迭代器，每行包含Detection的各列
+        """
+        query = db.query(
+            Detection.id, Detection.message_id, Detection.chat_id, Detection.upload_filename, Detection.label,
+            Detection.x1, Detection.y1, Detection.x2, Detection.y2,
+            Detection.pixel_x1, Detection.pixel_y1, Detection.pixel_x2, Detection.pixel_y2
+        ).join(Chat, Chat.id == Detection.chat_id).filter(Chat.user_id == user_id)
+        if chat_id is not None:
+            query = query.filter(Detection.chat_id == chat_id)
+        if upload_filename is not None:
+            query = query.filter(Detection.upload_filename == upload_filename)
+        if label is not None:
+            query = query.filter(Detection.label == label)
+        
+        last_id = 0
+        while True:
+            rows = query.filter(Detection.id > last_id).order_by(Detection.id).limit(chunk_size).all()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1].id
@@ -1,19 +1,55 @@
+import asyncio
+import json
 import logging
-from zai import ZhipuAiClient
-from app.core.config import ZHIPUAI_API_KEY
+import time
+from types import SimpleNamespace
+
+from app.core.config import ZHIPUAI_API_KEYS, MODEL_RATE_LIMIT_RETRIES, MODEL_HEDGING_ENABLED
+from app.models.analyze import TaskType
+from app.services.cancellation import cancellation
+from app.services.execution_profiles import execution_profiles
+from app.services.circuit_breaker import circuit_breakers, RESULT_SUCCESS, RESULT_FAILURE, RESULT_IGNORED
+from app.services.hedging import hedge_policy
+from app.services.key_pool import ApiKeyPool, OUTCOME_OK, OUTCOME_ERROR, OUTCOME_RATE_LIMITED, OUTCOME_CANCELED
+from app.services.model_backend import ZhipuAiAPIError, create_model_backend, is_backend_failure
+from app.services.rate_limiter import RateLimitTimeout, rate_limiter
+from app.services.result_cache import result_cache
+from app.services.prompt_registry import get_prompt_template, build_messages
+from app.services.single_flight import single_flight
+from app.utils.detection_parser import IncrementalDetectionScanner
+from app.utils.text_cleaner import clean_special_tags, StreamingTagCleaner
 
 logger = logging.getLogger(__name__)
 
+
 class ZhipuAiService:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, base_url=None, api_keys=None, backend=None):
         """
         初始化智谱AI服务客户端
         
         Args:
             api_key: API密钥，如果为None则使用配置文件中的密钥
+            base_url: API地址，如果为None则使用配置文件中的地址
+            api_keys: 多个账号的API密钥列表，请求会在这些密钥之间负载均衡
+            backend: 模型后端，如果为None则按MODEL_BACKEND配置创建
         """
-        self.api_key = api_key or ZHIPUAI_API_KEY
-        self.client = ZhipuAiClient(api_key=self.api_key)
+        self.backend = backend or create_model_backend(base_url=base_url)
+        if api_keys is None:
+            api_keys = [api_key] if api_key else ZHIPUAI_API_KEYS
+        if not api_keys and not self.backend.requires_api_key:
+            # 离线后端不校验密钥，使用占位密钥让密钥池正常工作
+            api_keys = ["offline-backend"]
+        self.key_pool = ApiKeyPool(api_keys)
+        self.api_key = api_keys[0] if api_keys else None
+    
+    async def aclose(self):
+        """关闭模型后端，释放连接池"""
+        await self.backend.aclose()
+    
+    @staticmethod
+    def _build_message(content, thinking, model=None):
+        """构建与SDK响应中message对象兼容的结果"""
+        return SimpleNamespace(content=content, thinking=thinking, cached=False, model=model)
         
     def _clean_special_tags(self, text):
         """
@@ -25,33 +61,9 @@ class ZhipuAiService:
         Returns:
             清理后的文本
         """
-        if not text:
-            return text
-            
-        # 移除智谱AI模型输出中的特殊标记
-        tags_to_remove = [
-            "<|begin_of_box|>", "<|end_of_box|>",
-            "<|begin_of_text|>", "<|end_of_text|>",
-            "<|begin_of_list|>", "<|end_of_list|>",
-            "<|begin_of_attribute|>", "<|end_of_attribute|>"
-        ]
-        
-        cleaned_text = text
-        for tag in tags_to_remove:
-            cleaned_text = cleaned_text.replace(tag, "")
-        
-        # 使用正则表达式处理竖线标记
-        import re
-        # 移除开头的单竖线或双竖线
-        cleaned_text = re.sub(r'^\s*\|\|\s*', '', cleaned_text)
-        cleaned_text = re.sub(r'^\s*\|\s*', '', cleaned_text)
-        # 移除结尾的单竖线或双竖线
-        cleaned_text = re.sub(r'\s*\|\|\s*$', '', cleaned_text)
-        cleaned_text = re.sub(r'\s*\|\s*$', '', cleaned_text)
-        
-        return cleaned_text
-        
-    async def analyze_image(self, image_base64=None, image_url=None, prompt=None, task_type=None, model="glm-4.5v", context_messages=None, task_id=None, redis_client=None):
+        return clean_special_tags(text)
+        
+    async def analyze_image(self, image_base64=None, image_url=None, prompt=None, task_type=None, model="glm-4.5v", context_messages=None, task_id=None, redis_client=None, use_cache=True, image_sha256=None, cancel_token=None, hedge=None, profile=None, on_detection=None):
         """
         调用智谱AI GLM-4.5v API分析图像
         
@@ -62,154 +74,394 @@ class ZhipuAiService:
             task_type: 任务类型，用于构建系统提示
             model: 使用的模型，默认为"glm-4.5v"
             context_messages: 对话上下文消息列表
-            task_id: 任务ID，用于检查任务是否被取消
-            redis_client: Redis客户端，用于检查取消标志
+            task_id: 任务ID，用于订阅取消通知（未提供cancel_token时）
+            redis_client: Redis客户端，与task_id同时提供时启用取消功能（兼容旧接口）
+            use_cache: 是否使用分析结果缓存，为False时强制调用模型
+            image_sha256: 图像内容的SHA-256，为None时根据图像数据计算
+            cancel_token: 任务的CancelToken，被设置时立即中止上游调用
+            hedge: 是否启用对冲请求，None表示使用MODEL_HEDGING_ENABLED配置
+            profile: 执行档位名称（fast/balanced/deep），指定时使用档位中的模型、思考模式和最大输出token数
+            on_detection: 检测任务中每个检测结果在流式输出中闭合时调用的回调，参数为{"label", "bbox"}
+                （缓存命中或等待相同请求的结果时不调用）
             
         Returns:
             API响应结果
         """
-        # 根据任务类型构建不同的提示
-        if task_type == "description":
-            system_prompt = "你是一个专业的遥感图像分析AI助手。请详细描述这张遥感图像中的内容，包括地形、建筑、植被等特征。"
-        elif task_type == "detection":
-            system_prompt = """你是一个专业的遥感图像分析AI助手。用户要求你在遥感图像中定位特定的目标物体。
-
-请严格按照以下格式输出检测结果：
-返回物体的坐标边界框，你必须使用以下JSON格式：
-```json
-{"label": "物体名称", "bbox": [x1, y1, x2, y2]}
-```
-或者如果有多个物体:
-```json
-[
-  {"label": "物体1", "bbox": [x1, y1, x2, y2]},
-  {"label": "物体2", "bbox": [x3, y3, x4, y4]}
-]
-```
-
-说明:
-- x1,y1是左上角坐标，x2,y2是右下角坐标
-- 所有坐标值必须是0-1之间的相对位置
-- 例如：{"label": "建筑", "bbox": [0.2, 0.3, 0.5, 0.6]}
-
-重要提示：你的回复中必须包含且只包含有效的JSON格式坐标，不要省略或更改格式。"""
-        elif task_type == "segmentation":
-            system_prompt = "你是一个专业的遥感图像分析AI助手。请对这张遥感图像进行语义分割，识别不同类型的地表覆盖物（如建筑、道路、植被、水体等）。"
-        else:
-            system_prompt = "你是一个专业的遥感图像分析AI助手。请分析这张遥感图像并回答问题。针对用户的问题，请基于历史对话的上下文给出相关的答案。"
-        
-        # 准备消息内容
-        content = []
-        
-        # 添加图像
-        if image_url:
-            content.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": image_url
-                }
-            })
-        elif image_base64:
-            content.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{image_base64}"
-                }
-            })
-        
-        # 添加文本提示
-        content.append({
-            "type": "text",
-            "text": prompt
-        })
-        
-        # 构建完整消息
-        messages = [
-            {
-                "role": "system",
-                "content": system_prompt
-            }
-        ]
-        
-        # 添加上下文消息
-        if context_messages and len(context_messages) > 0:
-            messages.extend(context_messages)
-        
-        # 添加当前用户消息
-        messages.append({
-            "role": "user",
-            "content": content
-        })
+        if hedge is None:
+            hedge = MODEL_HEDGING_ENABLED
         
-        try:
-            logger.info(f"发送请求到智谱AI {model} API")
+        options = None
+        if profile is not None:
+            execution_profile = execution_profiles.get(profile)
+            model = execution_profile.model
+            options = execution_profile.options
+        
+        registered = False
+        if cancel_token is None and task_id is not None and redis_client is not None:
+            cancel_token = await asyncio.to_thread(cancellation.register, task_id)
+            registered = True
+        
+        # 按任务类型选择提示模板，结果中记录模板版本
+        template = get_prompt_template(task_type)
+        
+        # 检测任务边接收边解析检测框，不必等待完整回复
+        on_content = None
+        if on_detection is not None and template.task_type == TaskType.DETECTION:
+            scanner = IncrementalDetectionScanner()
             
-            # 检查是否支持stream模式，用于支持取消功能
-            stream_mode = task_id is not None and redis_client is not None
+            def on_content(chunk):
+                for detection in scanner.feed(chunk):
+                    on_detection(detection)
+        
+        started = time.monotonic()
+        try:
+            result = await self._analyze(
+                image_base64, image_url, prompt, template, model, context_messages, use_cache, image_sha256, cancel_token,
+                hedge, options, on_content
+            )
+            if hasattr(result, "content"):
+                result.prompt_version = template.prompt_version
+            # 按档位记录模型调用耗时（缓存命中和出错的请求不计入）
+            if profile is not None and hasattr(result, "content") and not result.cached:
+                await execution_profiles.record_latency(profile, time.monotonic() - started)
+            return result
+        finally:
+            if registered:
+                cancellation.unregister(task_id)
+    
+    async def _analyze(self, image_base64, image_url, prompt, template, model, context_messages, use_cache, image_sha256, cancel_token, hedge, options=None, on_content=None):
+        """
+        analyze_image的实现，参数含义相同
+        
+        Args:
+            template: 任务类型对应的提示模板
+            options: 传给模型后端的生成参数
+            on_content: 收到已清理的回复分片时调用的回调
+        """
+        # 查询分析结果缓存
+        cache_key = None
+        if use_cache and result_cache.enabled:
+            if image_sha256 is None:
+                image_sha256 = await asyncio.to_thread(result_cache.hash_image, image_base64, image_url)
+            # 不同生成参数的结果分开缓存
+            model_variant = model if not options else f"{model}:{json.dumps(options, sort_keys=True)}"
+            # 键中包含模板版本，模板修改后旧的缓存条目自然失效
+            cache_key = result_cache.make_key(
+                image_sha256, prompt, template.prompt_version, model_variant, result_cache.hash_context(context_messages)
+            )
+            cached = await result_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"分析结果缓存命中: {cache_key}")
+                message = self._build_message(cached["content"], cached.get("thinking"), model)
+                message.cached = True
+                return message
+        
+        # 按固定顺序构建消息：系统提示 -> 图像 -> 历史对话 -> 当前提问
+        messages = build_messages(template, prompt, image_url, image_base64, context_messages)
+        
+        try:
+            if cache_key is None:
+                message, _ = await self._generate(model, messages, cancel_token, hedge, options, on_content)
+                return message
             
-            if stream_mode:
-                # 使用流式响应，以便可以在中间检查取消
-                response = None
-                collected_content = ""
-                collected_thinking = ""
+            async def produce():
+                # 成为leader后再查一次缓存，前一个leader可能刚刚完成
+                cached = await result_cache.get(cache_key)
+                if cached is not None:
+                    return cached, True
                 
-                stream = self.client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    thinking={"type": "enabled"},
-                    stream=True
-                )
+                message, canceled = await self._generate(model, messages, cancel_token, hedge, options, on_content)
+                result = {"content": message.content, "thinking": message.thinking, "model": message.model}
+                # 只缓存和共享完整生成的结果；熔断时备用模型的结果只共享、不缓存
+                if not canceled and message.model == model:
+                    await result_cache.set(cache_key, result)
+                return result, not canceled
+            
+            # 相同的并发请求（可能来自不同worker）只调用一次模型
+            result = await single_flight.run(
+                cache_key,
+                produce,
+                is_canceled=cancel_token.is_set if cancel_token is not None else None
+            )
+            if result is None:
+                logger.info(f"任务 {cancel_token.task_id} 已被用户取消，停止等待相同请求的结果")
+                return self._build_message("[用户已取消生成]", "[用户已取消生成]")
+            
+            return self._build_message(result["content"], result.get("thinking"), result.get("model", model))
+            
+        except Exception as e:
+            logger.error(f"调用智谱AI API时出错: {str(e)}")
+            return {"error": f"API调用错误: {str(e)}"}
+    
+    async def _generate(self, model, messages, cancel_token=None, hedge=False, options=None, on_content=None):
+        """
+        调用模型并收集完整回复，收到取消通知时立即中止
+        
+        模型熔断时改用备用模型，没有可用的备用模型时立即失败。
+        
+        Args:
+            model: 使用的模型
+            messages: 完整的消息列表
+            cancel_token: 任务的CancelToken
+            hedge: 是否启用对冲请求
+            options: 传给模型后端的生成参数（thinking、max_tokens）
+            on_content: 收到已清理的回复分片时调用的回调
+            
+        Returns:
+            (消息对象, 是否被取消)，消息对象的model为实际使用的模型
+        """
+        model, permit = circuit_breakers.acquire(model)
+        started = time.monotonic()
+        result = RESULT_IGNORED
+        
+        collected_content = []
+        collected_thinking = []
+        if hedge:
+            work = asyncio.ensure_future(
+                self._generate_hedged(model, messages, collected_content, collected_thinking, options=options,
+                                      on_content=on_content)
+            )
+        else:
+            work = asyncio.ensure_future(
+                self._generate_with_limits(model, messages, collected_content, collected_thinking, options=options,
+                                           on_content=on_content)
+            )
+        
+        try:
+            if cancel_token is not None:
+                waiter = asyncio.ensure_future(cancel_token.wait())
+                try:
+                    await asyncio.wait({work, waiter}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    waiter.cancel()
                 
-                for chunk in stream:
-                    # 检查是否有取消信号
-                    if redis_client.exists(f"task_cancel:{task_id}"):
-                        logger.info(f"任务 {task_id} 已被用户取消，终止API调用")
-                        # 创建取消响应
-                        from types import SimpleNamespace
-                        response = SimpleNamespace()
-                        response.choices = [SimpleNamespace()]
-                        response.choices[0].message = SimpleNamespace()
-                        response.choices[0].message.content = collected_content + "\n\n[用户已取消生成]"
-                        response.choices[0].message.thinking = collected_thinking + "\n\n[用户已取消生成]"
-                        break
-                    
-                    # 收集内容和思考过程
-                    if hasattr(chunk.choices[0].delta, "content") and chunk.choices[0].delta.content:
-                        collected_content += chunk.choices[0].delta.content
+                if not work.done():
+                    # 取消正在进行的调用（包括排队等待配额），上游连接随之关闭
+                    logger.info(f"任务 {cancel_token.task_id} 已被用户取消，终止API调用")
+                    work.cancel()
+                    try:
+                        await work
+                    except asyncio.CancelledError:
+                        pass
                     
-                    if hasattr(chunk.choices[0].delta, "thinking") and chunk.choices[0].delta.thinking:
-                        collected_thinking += chunk.choices[0].delta.thinking
-                
-                # 如果没有被取消，构建完整响应
-                if response is None:
-                    from types import SimpleNamespace
-                    response = SimpleNamespace()
-                    response.choices = [SimpleNamespace()]
-                    response.choices[0].message = SimpleNamespace()
-                    response.choices[0].message.content = collected_content
-                    response.choices[0].message.thinking = collected_thinking
-            else:
-                # 非流式模式，一次性获取响应
-                response = self.client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    thinking={"type": "enabled"}
-                )
+                    message = self._build_message(
+                        "".join(collected_content) + "\n\n[用户已取消生成]",
+                        "".join(collected_thinking) + "\n\n[用户已取消生成]",
+                        model
+                    )
+                    return message, True
             
+            try:
+                await work
+            except Exception as e:
+                result = RESULT_FAILURE if is_backend_failure(e) else RESULT_IGNORED
+                raise
+            result = RESULT_SUCCESS
             logger.info("成功接收到API响应")
+        finally:
+            work.cancel()
+            circuit_breakers.release(permit, result, time.monotonic() - started)
+            await circuit_breakers.publish()
+        
+        # 回复内容在接收时已经清理过特殊标记
+        message = self._build_message("".join(collected_content), "".join(collected_thinking), model)
+        return message, False
+    
+    async def _generate_hedged(self, model, messages, collected_content, collected_thinking, options=None,
+                               on_content=None):
+        """
+        以对冲方式调用模型：首token在等待时间内未到达时再发起一个相同的请求
+        
+        先开始输出（或先结束）的请求胜出，另一个请求被取消；胜出请求的输出写入收集列表。
+        对冲请求同样经过限流器，并受对冲比例上限约束。
+        
+        Args:
+            model: 使用的模型
+            messages: 完整的消息列表
+            collected_content: 收集回复内容的列表
+            collected_thinking: 收集思考过程的列表
+            options: 传给模型后端的生成参数
+            on_content: 收到已清理的回复分片时调用的回调（只转发胜出请求的分片）
+        """
+        ready = asyncio.Queue()
+        attempts = []
+        
+        def launch(is_hedge):
+            attempt = SimpleNamespace(is_hedge=is_hedge, content=[], thinking=[], pending=[])
             
-            # 获取消息对象
-            message = response.choices[0].message
+            def relay(chunk):
+                # 胜出前的分片先暂存，决出胜者后再转发
+                if winner is attempt:
+                    on_content(chunk)
+                else:
+                    attempt.pending.append(chunk)
             
-            # 如果有content属性，清理特殊标记
-            if hasattr(message, "content"):
-                message.content = self._clean_special_tags(message.content)
+            attempt.task = asyncio.ensure_future(self._generate_with_limits(
+                model, messages, attempt.content, attempt.thinking,
+                on_first_token=lambda: ready.put_nowait(attempt), options=options,
+                on_content=relay if on_content is not None else None
+            ))
+            attempt.task.add_done_callback(lambda _: ready.put_nowait(attempt))
+            attempts.append(attempt)
+        
+        hedge_policy.record_request(model)
+        delay = hedge_policy.delay(model)
+        launch(False)
+        waited = False
+        winner = None
+        
+        try:
+            while winner is None:
+                try:
+                    attempt = await asyncio.wait_for(ready.get(), None if waited else delay)
+                except asyncio.TimeoutError:
+                    waited = True
+                    if hedge_policy.try_hedge(model):
+                        logger.info(f"模型 {model} 首token超过{delay:.2f}秒未到达，发起对冲请求")
+                        launch(True)
+                    continue
                 
-            return message
+                failed = attempt.task.done() and attempt.task.exception() is not None
+                # 一方失败时继续等待另一方，全部失败时抛出最后的错误
+                if failed and any(not other.task.done() for other in attempts):
+                    continue
+                winner = attempt
             
-        except Exception as e:
-            logger.error(f"调用智谱AI API时出错: {str(e)}")
-            return {"error": f"API调用错误: {str(e)}"}
+            if on_content is not None:
+                for chunk in winner.pending:
+                    _notify_content(on_content, chunk)
+                winner.pending.clear()
+            
+            losers = [attempt for attempt in attempts if attempt is not winner]
+            for attempt in losers:
+                attempt.task.cancel()
+            await asyncio.gather(*[attempt.task for attempt in losers], return_exceptions=True)
+            if losers:
+                hedge_policy.record_winner(model, winner.is_hedge)
+            
+            try:
+                await winner.task
+            finally:
+                collected_content.extend(winner.content)
+                collected_thinking.extend(winner.thinking)
+        finally:
+            for attempt in attempts:
+                attempt.task.cancel()
+    
+    async def _generate_with_limits(self, model, messages, collected_content, collected_thinking, on_first_token=None,
+                                    options=None, on_content=None):
+        """
+        在所选账号的限流和并发预算内调用模型，遇到429时更换账号或等待该账号冷却后重试
+        
+        Args:
+            model: 使用的模型
+            messages: 完整的消息列表
+            collected_content: 收集回复内容的列表
+            collected_thinking: 收集思考过程的列表
+            on_first_token: 收到第一个输出分片时调用的回调
+            options: 传给模型后端的生成参数
+            on_content: 收到已清理的回复分片时调用的回调
+        """
+        attempt = 0
+        while True:
+            try:
+                return await self._call_with_key(
+                    model, messages, collected_content, collected_thinking, on_first_token, options, on_content
+                )
+            except ZhipuAiAPIError as e:
+                if e.status_code != 429 or attempt >= MODEL_RATE_LIMIT_RETRIES:
+                    raise
+                attempt += 1
+                # 还有其他可用账号时直接换账号重试，否则在账号的令牌桶中等待冷却结束
+                if self.key_pool.available_count() > 0:
+                    logger.warning(f"模型 {model} 返回429，更换API密钥进行第{attempt}次重试")
+                else:
+                    logger.warning(f"模型 {model} 返回429，所有API密钥都在冷却中，等待后进行第{attempt}次重试")
+    
+    async def _call_with_key(self, model, messages, collected_content, collected_thinking, on_first_token=None,
+                             options=None, on_content=None):
+        """
+        从密钥池中选择API密钥，在该密钥（账号）的限流和并发预算内调用模型，并记录该密钥的延迟和错误
+        """
+        key = self.key_pool.acquire()
+        started = time.monotonic()
+        outcome = OUTCOME_ERROR
+        retry_after = None
+        try:
+            async with rate_limiter.limit(model, key.account_id):
+                # 延迟不包括排队等待配额的时间
+                started = time.monotonic()
+                await self._collect_stream(
+                    model, messages, key.api_key, collected_content, collected_thinking, on_first_token, options, on_content
+                )
+            outcome = OUTCOME_OK
+        except (asyncio.CancelledError, RateLimitTimeout):
+            # 取消和排队超时不反映密钥的健康状况
+            outcome = OUTCOME_CANCELED
+            raise
+        except ZhipuAiAPIError as e:
+            if e.status_code == 429:
+                outcome = OUTCOME_RATE_LIMITED
+                retry_after = await rate_limiter.penalize(model, e.retry_after, key.account_id)
+            raise
+        finally:
+            self.key_pool.release(key, time.monotonic() - started, outcome, retry_after)
+    
+    async def _collect_stream(self, model, messages, api_key, collected_content, collected_thinking, on_first_token=None,
+                              options=None, on_content=None):
+        """
+        流式调用模型，把回复内容（增量清理特殊标记后）和思考过程追加到收集列表中
+        
+        Args:
+            model: 使用的模型
+            messages: 完整的消息列表
+            api_key: 本次调用使用的API密钥
+            collected_content: 收集回复内容的列表
+            collected_thinking: 收集思考过程的列表
+            on_first_token: 收到第一个输出分片时调用的回调
+            options: 传给模型后端的生成参数（thinking、max_tokens）
+            on_content: 收到已清理的回复分片时调用的回调
+        """
+        logger.info(f"发送请求到智谱AI {model} API")
+        
+        started = time.monotonic()
+        first_token = True
+        cleaner = StreamingTagCleaner()
+        stream = self.backend.stream_chat(model, messages, api_key, **(options or {}))
+        try:
+            async for delta in stream:
+                if first_token and (delta.get("content") or delta.get("reasoning_content") or delta.get("thinking")):
+                    first_token = False
+                    hedge_policy.record_ttft(model, time.monotonic() - started)
+                    if on_first_token is not None:
+                        on_first_token()
+                
+                # 收集内容和思考过程（GLM-4.5v的思考过程位于reasoning_content字段）
+                if delta.get("content"):
+                    cleaned = cleaner.feed(delta["content"])
+                    if cleaned:
+                        collected_content.append(cleaned)
+                        if on_content is not None:
+                            _notify_content(on_content, cleaned)
+                
+                thinking_delta = delta.get("reasoning_content") or delta.get("thinking")
+                if thinking_delta:
+                    collected_thinking.append(thinking_delta)
+        finally:
+            # 提前退出（如取消）时也保留已收到的内容，并及时关闭上游连接
+            remaining = cleaner.flush()
+            if remaining:
+                collected_content.append(remaining)
+                if on_content is not None:
+                    _notify_content(on_content, remaining)
+            await stream.aclose()
+
+def _notify_content(on_content, chunk):
+    """调用回复分片回调，回调出错（如提前发布检测结果失败）只记录警告，不中断模型调用"""
+    try:
+        on_content(chunk)
+    except Exception as e:
+        logger.warning(f"处理回复分片的回调出错: {str(e)}")
 
 # 创建全局服务实例，方便直接导入使用
 zhipuai_service = ZhipuAiService()
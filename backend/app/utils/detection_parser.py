@@ -0,0 +1,303 @@
+import json
+import re
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.utils.detection_postprocess import postprocess_detections
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+# 扫描时只需要处理的字符：括号、引号、转义符和换行，其余正文直接跳过
+_STRUCTURAL_RE = re.compile(r'[{}\[\]"\\\n]')
+
+# 整体解析失败时最多向内尝试的层数，保证最坏情况下仍是线性时间
+_MAX_DESCENT = 3
+
+_BBOX_KEYS = ("bbox", "bbox_2d", "box")
+_LABEL_KEYS = ("label", "name", "class")
+
+
+class _Span:
+    """文本中一对匹配的括号"""
+
+    __slots__ = ("start", "end", "parent", "children")
+
+    def __init__(self, start: int, parent: Optional["_Span"]):
+        self.start = start
+        self.end = -1
+        self.parent = parent
+        self.children: List["_Span"] = []
+
+
+def _scan_spans(text: str) -> List[_Span]:
+    """
+    单次扫描文本，找出所有括号匹配的片段（跳过JSON字符串中的括号）
+
+    返回最外层的片段，每个片段记录其直接包含的子片段。未闭合或括号不匹配的片段被丢弃，
+    其中已经完整的子片段提升到最近的完整的外层片段。
+
+    扫描时只记录每个片段的外层片段，扫描结束后按开始位置顺序一次性建立子片段列表，
+    每个片段只移动一次，括号不平衡的输入也是线性时间。
+    """
+    spans: List[_Span] = []
+    stack: List[_Span] = []
+    in_string = False
+    # 被转义的字符位置（转义符之后的一个字符）
+    escaped_index = -1
+
+    for match in _STRUCTURAL_RE.finditer(text):
+        index = match.start()
+        char = match.group()
+        if in_string:
+            if index == escaped_index:
+                continue
+            if char == "\\":
+                escaped_index = index + 1
+            elif char == '"' or char == "\n":
+                # JSON字符串不能跨行，遇到换行视为字符串已结束
+                in_string = False
+            continue
+
+        if char == '"':
+            # 括号外的引号属于正文
+            in_string = bool(stack)
+        elif char in _CLOSERS:
+            span = _Span(index, stack[-1] if stack else None)
+            stack.append(span)
+            spans.append(span)
+        elif char == "}" or char == "]":
+            # 不匹配的片段保持end为-1，即被丢弃
+            while stack and _CLOSERS[text[stack[-1].start]] != char:
+                stack.pop()
+            if stack:
+                stack.pop().end = index + 1
+
+    # 外层片段先于内层片段开始，处理到某个片段时它的外层已经指向最近的完整片段
+    roots: List[_Span] = []
+    for span in spans:
+        parent = span.parent
+        if parent is not None and parent.end < 0:
+            parent = parent.parent
+        span.parent = parent
+        if span.end < 0:
+            continue
+        (parent.children if parent is not None else roots).append(span)
+    return roots
+
+
+def iter_json_values(text: str) -> Iterator[Any]:
+    """
+    按出现顺序取出文本中嵌入的JSON对象和数组（包括```json代码块中的内容）
+
+    先尝试解析最外层的片段，失败时再尝试其中的子片段（最多向内_MAX_DESCENT层）。
+
+    Args:
+        text: 模型回复
+
+    Returns:
+        JSON值的迭代器
+    """
+    if not text:
+        return
+
+    def visit(span: _Span, depth: int) -> Iterator[Any]:
+        try:
+            yield json.loads(text[span.start:span.end])
+            return
+        except (ValueError, RecursionError):
+            # 嵌套过深时json.loads抛出RecursionError
+            pass
+        if depth < _MAX_DESCENT:
+            for child in span.children:
+                yield from visit(child, depth + 1)
+
+    for root in _scan_spans(text):
+        yield from visit(root, 0)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def normalize_bbox(bbox: Any, image_size: Optional[Tuple[int, int]] = None) -> Optional[List[float]]:
+    """
+    把检测框统一为0-1之间的相对坐标[x1, y1, x2, y2]（左上角在前）
+
+    已知图像尺寸且宽或高超过1000像素时，整数坐标按像素坐标换算（这类图像上的像素坐标
+    可能全部不超过1000，无法与0-1000的归一化坐标区分）。
+
+    Args:
+        bbox: 模型输出的检测框，可以是0-1的相对坐标、0-1000的归一化坐标或像素坐标
+        image_size: 图像宽高，用于换算像素坐标
+
+    Returns:
+        相对坐标，无法识别时返回None
+    """
+    if not isinstance(bbox, (list, tuple)) or len(bbox) != 4 or not all(_is_number(v) for v in bbox):
+        return None
+    x1, y1, x2, y2 = (float(v) for v in bbox)
+    largest = max(abs(x1), abs(y1), abs(x2), abs(y2))
+    if largest > 1.0:
+        is_pixel = bool(image_size) and (
+            largest > 1000.0 or (max(image_size) > 1000 and all(float(v).is_integer() for v in bbox))
+        )
+        if is_pixel:
+            width, height = image_size
+            x1, x2, y1, y2 = x1 / width, x2 / width, y1 / height, y2 / height
+        elif largest <= 1000.0:
+            # GLM系列模型常按0-1000输出归一化坐标
+            x1, y1, x2, y2 = x1 / 1000.0, y1 / 1000.0, x2 / 1000.0, y2 / 1000.0
+        else:
+            return None
+    return [min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)]
+
+
+def _detection_from_dict(item: Dict[str, Any], image_size: Optional[Tuple[int, int]]) -> Optional[Dict[str, Any]]:
+    bbox = None
+    for key in _BBOX_KEYS:
+        if key in item:
+            bbox = normalize_bbox(item[key], image_size)
+            break
+    else:
+        if all(_is_number(item.get(key)) for key in ("x", "y", "width", "height")):
+            x, y = item["x"], item["y"]
+            bbox = normalize_bbox([x, y, x + item["width"], y + item["height"]], image_size)
+    if bbox is None:
+        return None
+
+    label = next((item[key] for key in _LABEL_KEYS if item.get(key) is not None), "")
+    return {"label": str(label), "bbox": bbox}
+
+
+def _collect(value: Any, image_size: Optional[Tuple[int, int]], detections: List[Dict[str, Any]], depth: int = 0) -> None:
+    if depth > _MAX_DESCENT:
+        return
+    if isinstance(value, dict):
+        detection = _detection_from_dict(value, image_size)
+        if detection is not None:
+            detections.append(detection)
+            return
+        # 例如{"objects": [...]}
+        for child in value.values():
+            if isinstance(child, (list, dict)):
+                _collect(child, image_size, detections, depth + 1)
+    elif isinstance(value, list):
+        bbox = normalize_bbox(value, image_size)
+        if bbox is not None:
+            detections.append({"label": "", "bbox": bbox})
+            return
+        for child in value:
+            if isinstance(child, (list, dict)):
+                _collect(child, image_size, detections, depth + 1)
+
+
+def parse_detections(text: str, image_size: Optional[Tuple[int, int]] = None) -> List[Dict[str, Any]]:
+    """
+    从模型回复中解析检测结果
+
+    支持{"label", "bbox"}对象、对象数组、{"x", "y", "width", "height"}对象和单独的[x1, y1, x2, y2]数组，
+    无论它们直接出现在正文中还是在```json代码块中。
+
+    Args:
+        text: 模型回复
+        image_size: 图像宽高，用于换算像素坐标
+
+    Returns:
+        [{"label": 标签, "bbox": [x1, y1, x2, y2]}]，坐标为0-1之间的相对位置
+    """
+    detections: List[Dict[str, Any]] = []
+    for value in iter_json_values(text):
+        _collect(value, image_size, detections)
+    return detections
+
+
+def extract_object_coordinates(content: str) -> Optional[str]:
+    """
+    为物体标记消息生成object_coordinates字段
+
+    Args:
+        content: 模型回复
+
+    Returns:
+        检测结果的JSON字符串（已去除退化和重复的检测框），没有解析到检测框时返回None
+    """
+    detections = postprocess_detections(parse_detections(content)) if content else []
+    if not detections:
+        return None
+    return json.dumps(detections, ensure_ascii=False)
+
+
+class IncrementalDetectionScanner:
+    """
+    流式输出的增量检测结果扫描器
+
+    逐个分片调用feed()，每当一个{"label", "bbox"}对象闭合时立即返回它，不必等待完整回复。
+    只缓存最外层括号开始之后的文本，每个字符只扫描一次；超过_MAX_OBJECT_LENGTH的对象不尝试解析
+    （通常是包裹检测结果的外层对象，其中的检测结果在闭合时已经返回）。
+    """
+
+    # 单个检测对象的最大长度（字符）
+    _MAX_OBJECT_LENGTH = 2048
+
+    def __init__(self, image_size: Optional[Tuple[int, int]] = None):
+        self.image_size = image_size
+        self._buffer: List[str] = []
+        self._start = 0
+        self._offset = 0
+        self._stack: List[Tuple[str, int]] = []
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """
+        输入一个分片
+
+        Args:
+            chunk: 已清理特殊标记的回复分片
+
+        Returns:
+            在该分片中闭合的检测结果（可能为空列表），坐标为0-1之间的相对位置
+        """
+        detections = []
+        for char in chunk:
+            if self._stack:
+                self._buffer.append(char)
+            position = self._offset
+            self._offset += 1
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"' or char == "\n":
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = bool(self._stack)
+            elif char in _CLOSERS:
+                if not self._stack:
+                    self._buffer = [char]
+                    self._start = position
+                self._stack.append((char, position))
+            elif char == "}" or char == "]":
+                while self._stack and _CLOSERS[self._stack[-1][0]] != char:
+                    self._stack.pop()
+                if not self._stack:
+                    continue
+                opener, start = self._stack.pop()
+                if opener == "{" and position + 1 - start <= self._MAX_OBJECT_LENGTH:
+                    detection = self._parse_object(start, position + 1)
+                    if detection is not None:
+                        detections.append(detection)
+                if not self._stack:
+                    self._buffer = []
+        return detections
+
+    def _parse_object(self, start: int, end: int) -> Optional[Dict[str, Any]]:
+        text = "".join(self._buffer[start - self._start:end - self._start])
+        try:
+            value = json.loads(text)
+        except (ValueError, RecursionError):
+            return None
+        return _detection_from_dict(value, self.image_size) if isinstance(value, dict) else None
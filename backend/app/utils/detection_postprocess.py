@@ -0,0 +1,221 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 同一标签的两个检测框IoU超过该值时视为同一目标
+NMS_IOU_THRESHOLD = 0.5
+
+# 扫描线每批生成的候选检测框对数，限制内存占用
+_PAIR_BATCH = 1_000_000
+
+
+def to_arrays(detections: Sequence[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    把检测结果列表转换为数组
+
+    Args:
+        detections: [{"label", "bbox"}]
+
+    Returns:
+        (N×4的检测框数组, N个标签的数组)
+    """
+    boxes = np.array([d["bbox"] for d in detections], dtype=np.float64).reshape(-1, 4)
+    labels = np.array([d["label"] for d in detections], dtype=object)
+    return boxes, labels
+
+
+def clip_boxes(boxes: np.ndarray) -> np.ndarray:
+    """把相对坐标限制在[0, 1]之间，并保证左上角在前"""
+    boxes = np.clip(boxes, 0.0, 1.0)
+    return np.concatenate([
+        np.minimum(boxes[:, :2], boxes[:, 2:]),
+        np.maximum(boxes[:, :2], boxes[:, 2:])
+    ], axis=1)
+
+
+def to_pixel(boxes: np.ndarray, image_size: Tuple[int, int]) -> np.ndarray:
+    """相对坐标 -> 像素坐标，image_size为(宽, 高)"""
+    width, height = image_size
+    return boxes * np.array([width, height, width, height], dtype=np.float64)
+
+
+def to_relative(boxes: np.ndarray, image_size: Tuple[int, int]) -> np.ndarray:
+    """像素坐标 -> 相对坐标，image_size为(宽, 高)"""
+    width, height = image_size
+    return boxes / np.array([width, height, width, height], dtype=np.float64)
+
+
+def remap_boxes(boxes: np.ndarray, offsets: np.ndarray, sizes: np.ndarray,
+                scene_size: Tuple[int, int]) -> np.ndarray:
+    """
+    把图块内的相对坐标换算为整幅场景的相对坐标
+
+    Args:
+        boxes: N×4的图块内相对坐标
+        offsets: N×2的图块左上角像素位置(col_off, row_off)
+        sizes: N×2的图块像素尺寸(width, height)
+        scene_size: 场景的(宽, 高)
+
+    Returns:
+        N×4的场景相对坐标
+    """
+    offsets = np.tile(offsets, 2)
+    sizes = np.tile(sizes, 2)
+    return to_relative(offsets + boxes * sizes, scene_size)
+
+
+def project_boxes(pixel_boxes: np.ndarray, transform: Sequence[float]) -> np.ndarray:
+    """
+    用仿射变换把像素坐标的检测框投影为地图坐标的多边形（影像有旋转时不再是矩形）
+
+    Args:
+        pixel_boxes: N×4的像素坐标
+        transform: 仿射变换系数[a, b, c, d, e, f]，x = a·列 + b·行 + c，y = d·列 + e·行 + f
+
+    Returns:
+        N×5×2的闭合多边形顶点（左上、右上、右下、左下、左上）
+    """
+    a, b, c, d, e, f = transform[:6]
+    cols = pixel_boxes[:, [0, 2, 2, 0, 0]]
+    rows = pixel_boxes[:, [1, 1, 3, 3, 1]]
+    return np.stack([a * cols + b * rows + c, d * cols + e * rows + f], axis=-1)
+
+
+def box_areas(boxes: np.ndarray) -> np.ndarray:
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+
+def non_degenerate(boxes: np.ndarray, image_size: Optional[Tuple[int, int]] = None) -> np.ndarray:
+    """
+    面积不为零的检测框；已知图像尺寸时还要求宽高都不小于1像素
+
+    Returns:
+        布尔掩码
+    """
+    if image_size:
+        sizes = to_pixel(boxes, image_size)
+        return (sizes[:, 2] - sizes[:, 0] >= 1.0) & (sizes[:, 3] - sizes[:, 1] >= 1.0)
+    return (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+
+
+def _overlapping_pairs(boxes: np.ndarray, iou_threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    找出IoU超过阈值的检测框对
+
+    按左边界排序后，每个检测框只需要与左边界落在它横向范围内的检测框比较（扫描线），
+    候选对分批生成并向量化计算IoU，不构造N×N矩阵。
+
+    Returns:
+        (第一个检测框的下标, 第二个检测框的下标)
+    """
+    order = np.argsort(boxes[:, 0], kind="stable")
+    sorted_boxes = boxes[order]
+    starts = np.arange(1, len(order))
+    ends = np.searchsorted(sorted_boxes[:, 0], sorted_boxes[:-1, 2], side="left")
+    counts = np.maximum(ends - starts, 0)
+    areas = box_areas(sorted_boxes)
+
+    firsts, seconds = [], []
+    cumulative = np.cumsum(counts)
+    batch_start = 0
+    while batch_start < len(counts):
+        # 每批最多生成约_PAIR_BATCH个候选对
+        base = cumulative[batch_start - 1] if batch_start else 0
+        batch_end = max(batch_start + 1, int(np.searchsorted(cumulative, base + _PAIR_BATCH, side="right")))
+        batch_counts = counts[batch_start:batch_end]
+        i = np.repeat(np.arange(batch_start, batch_end), batch_counts)
+        # 每个检测框的候选从它的下一个开始连续排列
+        within = np.arange(len(i)) - np.repeat(np.cumsum(batch_counts) - batch_counts, batch_counts)
+        j = i + 1 + within
+        batch_start = batch_end
+        if not len(i):
+            continue
+
+        a, b = sorted_boxes[i], sorted_boxes[j]
+        width = np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0])
+        height = np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1])
+        inter = np.clip(width, 0.0, None) * np.clip(height, 0.0, None)
+        union = areas[i] + areas[j] - inter
+        iou = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+        matched = iou > iou_threshold
+        firsts.append(order[i[matched]])
+        seconds.append(order[j[matched]])
+
+    if not firsts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+
+def nms(boxes: np.ndarray, labels: np.ndarray, scores: Optional[np.ndarray] = None,
+        iou_threshold: float = NMS_IOU_THRESHOLD) -> np.ndarray:
+    """
+    按标签的非极大值抑制
+
+    模型不输出置信度，默认以面积作为得分，即重复的检测框中保留最大的一个
+    （与分块分析中保留覆盖目标最完整的检测框一致）。
+
+    Args:
+        boxes: N×4的相对坐标（已限制在[0, 1]之间）
+        labels: N个标签
+        scores: N个得分，None表示使用面积
+        iou_threshold: IoU超过该值的同标签检测框被抑制
+
+    Returns:
+        保留的检测框下标，按得分从高到低排列
+    """
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+    if scores is None:
+        scores = box_areas(boxes)
+
+    # 不同标签的检测框平移到互不重叠的区域，一次完成所有标签的NMS
+    _, label_ids = np.unique(labels.astype(str), return_inverse=True)
+    shifted = boxes + (label_ids.astype(np.float64) * 2.0)[:, None]
+
+    order = np.argsort(-scores, kind="stable")
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+
+    first, second = _overlapping_pairs(shifted, iou_threshold)
+    # 每对中得分高的一方可能抑制另一方；按抑制方的排名处理，处理到某一对时抑制方是否保留已经确定
+    swap = rank[first] > rank[second]
+    suppressor = np.where(swap, second, first)
+    victim = np.where(swap, first, second)
+    edges = np.argsort(rank[suppressor], kind="stable")
+
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    for s, v in zip(suppressor[edges].tolist(), victim[edges].tolist()):
+        if not suppressed[s]:
+            suppressed[v] = True
+    return order[~suppressed[order]]
+
+
+def postprocess_detections(detections: Sequence[Dict[str, Any]], image_size: Optional[Tuple[int, int]] = None,
+                           iou_threshold: float = NMS_IOU_THRESHOLD) -> List[Dict[str, Any]]:
+    """
+    检测结果后处理：限制到[0, 1]、去除退化的检测框、按标签NMS合并重复目标
+
+    Args:
+        detections: [{"label", "bbox"}]，bbox为0-1相对坐标，其他字段原样保留
+        image_size: 图像的(宽, 高)，提供时去除小于1像素的检测框，并在结果中加入pixel_bbox
+        iou_threshold: NMS的IoU阈值
+
+    Returns:
+        处理后的检测结果，保持原来的顺序
+    """
+    if not detections:
+        return []
+    boxes, labels = to_arrays(detections)
+    boxes = clip_boxes(boxes)
+
+    valid = np.flatnonzero(non_degenerate(boxes, image_size))
+    kept = np.sort(valid[nms(boxes[valid], labels[valid], iou_threshold=iou_threshold)])
+
+    pixel_boxes = to_pixel(boxes[kept], image_size).tolist() if image_size else None
+    result = []
+    for position, index in enumerate(kept.tolist()):
+        detection = {**detections[index], "bbox": boxes[index].tolist()}
+        if pixel_boxes is not None:
+            detection["pixel_bbox"] = pixel_boxes[position]
+        result.append(detection)
+    return result
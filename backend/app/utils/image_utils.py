@@ -4,7 +4,7 @@ import logging
 import os
 from PIL import Image
 import numpy as np
-from typing import Union, Tuple, Optional
+from typing import Union, Tuple, Optional, Dict, Any
 
 logger = logging.getLogger(__name__)
 
@@ -46,7 +46,7 @@ def convert_to_rgb(image: Image.Image) -> Image.Image:
     """
     if image.mode in ("RGBA", "LA"):
         background = Image.new("RGB", image.size, (255, 255, 255))
-        background.paste(image, mask=image.split()[3])  # 3 is the alpha channel
+        background.paste(image, mask=image.split()[-1])  # 最后一个通道是alpha通道
         return background
     elif image.mode != "RGB":
         return image.convert("RGB")
@@ -72,6 +72,67 @@ def image_to_base64(image: Union[str, Image.Image]) -> str:
         return base64.b64encode(buffered.getvalue()).decode('utf-8')
 
 
+def normalize_image(image_path: str, output_path: str, max_edge: int = 1024, quality: int = 90) -> Dict[str, Any]:
+    """
+    生成供模型使用的标准化图像（RGB、限制最长边、JPEG编码）
+    
+    Args:
+        image_path: 原始图像文件路径
+        output_path: 标准化图像的保存路径
+        max_edge: 最长边上限（像素）
+        quality: JPEG质量(1-95)
+        
+    Returns:
+        图像元数据，包含原始尺寸、标准化后的尺寸和两者之间的缩放比例
+    """
+    with Image.open(image_path) as image:
+        original_format = image.format
+        original_width, original_height = image.size
+        image = convert_to_rgb(image)
+        image = resize_image(image, (max_edge, max_edge))
+        image.save(output_path, format="JPEG", quality=quality)
+        width, height = image.size
+    
+    return normalized_image_meta(image_path, output_path, original_format, (original_width, original_height),
+                                 (width, height), max_edge, quality)
+
+
+def normalized_image_meta(image_path: str, output_path: str, original_format: Optional[str],
+                          original_size: Tuple[int, int], size: Tuple[int, int],
+                          max_edge: int, quality: int) -> Dict[str, Any]:
+    """
+    标准化图像的元数据
+    
+    Args:
+        image_path: 原始图像文件路径
+        output_path: 标准化图像的保存路径
+        original_format: 原始图像格式
+        original_size: 原始尺寸(宽, 高)
+        size: 标准化后的尺寸(宽, 高)
+        max_edge: 最长边上限（像素）
+        quality: JPEG质量
+        
+    Returns:
+        图像元数据，包含原始尺寸、标准化后的尺寸和两者之间的缩放比例
+    """
+    original_width, original_height = original_size
+    width, height = size
+    return {
+        "original_format": original_format,
+        "original_width": original_width,
+        "original_height": original_height,
+        "original_bytes": os.path.getsize(image_path),
+        "width": width,
+        "height": height,
+        "bytes": os.path.getsize(output_path),
+        # 标准化图像坐标 / 缩放比例 = 原始图像坐标
+        "scale_x": width / original_width,
+        "scale_y": height / original_height,
+        "max_edge": max_edge,
+        "quality": quality
+    }
+
+
 def preprocess_image(image_path: str, max_size: Tuple[int, int] = (1024, 1024)) -> Optional[str]:
     """
     预处理图像（调整大小，转换为RGB，转换为Base64）
@@ -91,3 +152,25 @@ def preprocess_image(image_path: str, max_size: Tuple[int, int] = (1024, 1024))
     except Exception as e:
         logger.error(f"预处理图像时出错: {str(e)}")
         return None
+
+
+def encode_image_file(image_path: str, max_side: Optional[int] = None) -> str:
+    """
+    读取图像文件并转换为Base64编码，可选地限制最长边
+    
+    未指定max_side或图像不超过上限时直接编码原始文件，不重新压缩。
+    
+    Args:
+        image_path: 图像文件路径
+        max_side: 最长边上限（像素），None表示不限制
+        
+    Returns:
+        Base64编码的图像字符串
+    """
+    if max_side:
+        with Image.open(image_path) as image:
+            if max(image.size) > max_side:
+                image = convert_to_rgb(image)
+                image = resize_image(image, (max_side, max_side))
+                return image_to_base64(image)
+    return image_to_base64(image_path)
@@ -0,0 +1,341 @@
+import io
+import math
+import os
+import warnings
+from typing import List, Tuple, Optional, Dict, Any
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.windows import Window
+from PIL import Image
+
+from app.utils.image_utils import image_to_base64, normalized_image_meta
+
+# 普通图片（PNG/JPEG）没有地理参考，读取时不需要警告
+warnings.filterwarnings("ignore", category=NotGeoreferencedWarning)
+
+# 计算拉伸范围时读取的缩略图最长边（像素）
+_STATS_MAX_SIDE = 1024
+
+# 生成金字塔时每次读写的行数
+_PYRAMID_STRIP_ROWS = 512
+
+
+class Tile:
+    """
+    场景中的一个图块（像素窗口）
+    """
+
+    def __init__(self, index: int, row: int, col: int, col_off: int, row_off: int, width: int, height: int):
+        self.index = index
+        self.row = row
+        self.col = col
+        self.col_off = col_off
+        self.row_off = row_off
+        self.width = width
+        self.height = height
+
+    @property
+    def window(self) -> Window:
+        return Window(self.col_off, self.row_off, self.width, self.height)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "index": self.index,
+            "row": self.row,
+            "col": self.col,
+            "col_off": self.col_off,
+            "row_off": self.row_off,
+            "width": self.width,
+            "height": self.height
+        }
+
+
+def _tile_offsets(size: int, tile_size: int, overlap: int) -> List[int]:
+    """沿一个方向的图块起点，最后一块与边缘对齐"""
+    if size <= tile_size:
+        return [0]
+    step = tile_size - overlap
+    offsets = list(range(0, size - tile_size, step))
+    offsets.append(size - tile_size)
+    return offsets
+
+
+def plan_tiles(width: int, height: int, tile_size: int = 1024, overlap: int = 128) -> List[Tile]:
+    """
+    把场景切分为相互重叠的图块
+
+    Args:
+        width: 场景宽度（像素）
+        height: 场景高度（像素）
+        tile_size: 图块边长（像素）
+        overlap: 相邻图块的重叠宽度（像素），必须小于tile_size
+
+    Returns:
+        按行优先排列的图块列表
+    """
+    if overlap >= tile_size:
+        raise ValueError("图块重叠宽度必须小于图块边长")
+
+    tiles = []
+    for row, row_off in enumerate(_tile_offsets(height, tile_size, overlap)):
+        for col, col_off in enumerate(_tile_offsets(width, tile_size, overlap)):
+            tiles.append(Tile(
+                len(tiles), row, col, col_off, row_off,
+                min(tile_size, width - col_off), min(tile_size, height - row_off)
+            ))
+    return tiles
+
+
+def raster_size(image_path: str) -> Tuple[int, int]:
+    """
+    读取栅格的宽高（只读取文件头）
+
+    Returns:
+        (宽度, 高度)
+    """
+    with rasterio.open(image_path) as src:
+        return src.width, src.height
+
+
+def read_georeference(image_path: str) -> Dict[str, Any]:
+    """
+    读取栅格的尺寸和地理参考（只读取文件头）
+
+    Returns:
+        宽高、坐标参考系（WKT，没有时为None）和仿射变换系数[a, b, c, d, e, f]
+        （像素(列, 行) -> 地图坐标，没有地理参考时为None）
+    """
+    with rasterio.open(image_path) as src:
+        crs = src.crs.to_wkt() if src.crs else None
+        transform = list(src.transform)[:6]
+        if crs is None and src.transform.is_identity:
+            # 普通图片没有地理参考，rasterio返回单位变换
+            transform = None
+        return {"width": src.width, "height": src.height, "crs": crs, "transform": transform}
+
+
+def transform_to_wgs84(xs: np.ndarray, ys: np.ndarray, crs: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    把一批地图坐标从crs转换为WGS84经纬度（一次调用GDAL完成全部坐标）
+
+    Args:
+        xs: 横坐标数组
+        ys: 纵坐标数组
+        crs: 源坐标参考系（WKT或EPSG代码）
+
+    Returns:
+        (经度数组, 纬度数组)，形状与输入相同
+    """
+    from rasterio.crs import CRS
+    from rasterio.warp import transform
+
+    src_crs = CRS.from_user_input(crs)
+    if src_crs == CRS.from_epsg(4326):
+        return xs, ys
+    lons, lats = transform(src_crs, "EPSG:4326", xs.ravel().tolist(), ys.ravel().tolist())
+    return np.asarray(lons).reshape(xs.shape), np.asarray(lats).reshape(ys.shape)
+
+
+def _display_bands(src) -> List[int]:
+    """用于显示的波段：三个及以上波段取前三个作为RGB，否则取第一个作为灰度"""
+    return [1, 2, 3] if src.count >= 3 else [1]
+
+
+def compute_stretch(image_path: str) -> Optional[List[Tuple[float, float]]]:
+    """
+    根据整幅场景的缩略图计算每个波段的2%-98%拉伸范围
+
+    所有图块使用同一个拉伸范围，避免相邻图块亮度不一致。8位影像不需要拉伸。
+
+    Args:
+        image_path: 栅格文件路径
+
+    Returns:
+        每个显示波段的(下限, 上限)，8位影像返回None
+    """
+    with rasterio.open(image_path) as src:
+        if src.dtypes[0] == "uint8":
+            return None
+        bands = _display_bands(src)
+        scale = min(1.0, _STATS_MAX_SIDE / max(src.width, src.height))
+        out_shape = (len(bands), max(1, int(src.height * scale)), max(1, int(src.width * scale)))
+        # 缩略读取，GDAL有金字塔时直接读取金字塔
+        data = src.read(bands, out_shape=out_shape, resampling=Resampling.average, masked=True)
+    return _stretch_from(data)
+
+
+def _stretch_from(data: np.ma.MaskedArray) -> List[Tuple[float, float]]:
+    """根据缩略图的有效像元计算每个波段的2%-98%拉伸范围"""
+    stretch = []
+    for band in data:
+        values = band.compressed()
+        if values.size == 0:
+            stretch.append((0.0, 1.0))
+            continue
+        low, high = np.percentile(values, (2, 98))
+        stretch.append((float(low), float(high) if high > low else float(low) + 1.0))
+    return stretch
+
+
+def normalize_raster(image_path: str, output_path: str, max_edge: int = 1024, quality: int = 90) -> Dict[str, Any]:
+    """
+    生成GeoTIFF的标准化图像（与image_utils.normalize_image相同的输出和元数据）
+
+    按目标尺寸降采样读取（GDAL有金字塔时直接读取金字塔），不解码全分辨率栅格，
+    不受PIL解压炸弹像素数上限的限制。非8位影像按缩略图的2%-98%范围拉伸。
+
+    Args:
+        image_path: 栅格文件路径
+        output_path: 标准化图像的保存路径
+        max_edge: 最长边上限（像素）
+        quality: JPEG质量(1-95)
+
+    Returns:
+        图像元数据，见image_utils.normalized_image_meta
+    """
+    with rasterio.open(image_path) as src:
+        bands = _display_bands(src)
+        original_width, original_height = src.width, src.height
+        scale = min(1.0, max_edge / max(original_width, original_height))
+        out_shape = (len(bands), max(1, int(original_height * scale)), max(1, int(original_width * scale)))
+        data = src.read(bands, out_shape=out_shape, resampling=Resampling.average, masked=True)
+        stretch = None if src.dtypes[0] == "uint8" else _stretch_from(data)
+
+    image = _to_image(_to_uint8(data.filled(0), stretch))
+    image.save(output_path, format="JPEG", quality=quality)
+    return normalized_image_meta(image_path, output_path, "TIFF", (original_width, original_height), image.size,
+                                 max_edge, quality)
+
+
+def read_tile_base64(image_path: str, tile: Tile, stretch: Optional[List[Tuple[float, float]]] = None,
+                     max_side: Optional[int] = None) -> str:
+    """
+    按窗口读取一个图块并编码为JPEG的Base64，不读取整幅栅格
+
+    Args:
+        image_path: 栅格文件路径
+        tile: 要读取的图块
+        stretch: compute_stretch返回的拉伸范围
+        max_side: 图块最长边上限（像素），超过时在读取时降采样
+
+    Returns:
+        Base64编码的JPEG图像
+    """
+    scale = min(1.0, max_side / max(tile.width, tile.height)) if max_side else 1.0
+    out_width = max(1, int(round(tile.width * scale)))
+    out_height = max(1, int(round(tile.height * scale)))
+
+    with rasterio.open(image_path) as src:
+        bands = _display_bands(src)
+        data = src.read(bands, window=tile.window, out_shape=(len(bands), out_height, out_width),
+                        resampling=Resampling.average)
+
+    return image_to_base64(_to_image(_to_uint8(data, stretch)))
+
+
+def _to_uint8(data: np.ndarray, stretch: Optional[List[Tuple[float, float]]]) -> np.ndarray:
+    """按拉伸范围把(波段, 行, 列)数组转换为8位"""
+    if stretch:
+        low = np.array([s[0] for s in stretch], dtype=np.float32)[:, None, None]
+        high = np.array([s[1] for s in stretch], dtype=np.float32)[:, None, None]
+        data = np.clip((data.astype(np.float32) - low) / (high - low) * 255.0, 0, 255)
+    return data.astype(np.uint8)
+
+
+def _to_image(data: np.ndarray) -> Image.Image:
+    """把8位的(波段, 行, 列)数组转换为RGB图像"""
+    if data.shape[0] == 1:
+        return Image.fromarray(data[0]).convert("RGB")
+    return Image.fromarray(np.ascontiguousarray(np.moveaxis(data, 0, -1)))
+
+
+def pyramid_max_zoom(width: int, height: int, tile_size: int = 256) -> int:
+    """最高缩放级别：该级别为原始分辨率，每降低一级分辨率减半，第0级用一个图块覆盖整幅场景"""
+    return max(0, math.ceil(math.log2(max(width, height) / tile_size)))
+
+
+def build_pyramid(image_path: str, output_path: str, tile_size: int = 256, quality: int = 90) -> Dict[str, Any]:
+    """
+    生成用于地图浏览的金字塔影像：8位RGB、按tile_size分块、JPEG压缩，并内建各级概览
+
+    按条带读写，不把整幅栅格读入内存。
+
+    Args:
+        image_path: 原始栅格文件路径
+        output_path: 金字塔GeoTIFF的保存路径
+        tile_size: 图块边长（像素）
+        quality: JPEG质量
+
+    Returns:
+        金字塔元数据：宽高、图块边长和最高缩放级别
+    """
+    stretch = compute_stretch(image_path)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        with rasterio.open(image_path) as src:
+            bands = _display_bands(src)
+            width, height = src.width, src.height
+            profile = {
+                "driver": "GTiff", "width": width, "height": height, "count": 3, "dtype": "uint8",
+                "tiled": True, "blockxsize": tile_size, "blockysize": tile_size,
+                "compress": "jpeg", "photometric": "ycbcr", "jpeg_quality": quality,
+                "crs": src.crs, "transform": src.transform
+            }
+            with rasterio.open(tmp_path, "w", **profile) as dst:
+                for row_off in range(0, height, _PYRAMID_STRIP_ROWS):
+                    window = Window(0, row_off, width, min(_PYRAMID_STRIP_ROWS, height - row_off))
+                    data = _to_uint8(src.read(bands, window=window), stretch)
+                    if data.shape[0] == 1:
+                        data = np.repeat(data, 3, axis=0)
+                    dst.write(data, window=window)
+
+                max_zoom = pyramid_max_zoom(width, height, tile_size)
+                factors = [2 ** level for level in range(1, max_zoom + 1)]
+                if factors:
+                    dst.build_overviews(factors, Resampling.average)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return {"width": width, "height": height, "tile_size": tile_size, "max_zoom": max_zoom}
+
+
+def read_pyramid_tile(pyramid_path: str, z: int, x: int, y: int, max_zoom: int, tile_size: int = 256,
+                      quality: int = 90) -> Optional[bytes]:
+    """
+    从金字塔影像读取一个图块（GDAL自动选择对应的概览层）
+
+    Args:
+        pyramid_path: build_pyramid生成的文件
+        z: 缩放级别（0到max_zoom）
+        x: 图块列号
+        y: 图块行号
+        max_zoom: 最高缩放级别
+        tile_size: 图块边长（像素），场景右侧和下侧边缘的图块可能更小
+        quality: JPEG质量
+
+    Returns:
+        JPEG图块数据，图块超出场景范围时返回None
+    """
+    if not 0 <= z <= max_zoom or x < 0 or y < 0:
+        return None
+    factor = 2 ** (max_zoom - z)
+    span = tile_size * factor
+
+    with rasterio.open(pyramid_path) as src:
+        col_off, row_off = x * span, y * span
+        if col_off >= src.width or row_off >= src.height:
+            return None
+        width = min(span, src.width - col_off)
+        height = min(span, src.height - row_off)
+        out_shape = (3, max(1, math.ceil(height / factor)), max(1, math.ceil(width / factor)))
+        data = src.read([1, 2, 3], window=Window(col_off, row_off, width, height), out_shape=out_shape,
+                        resampling=Resampling.average)
+
+    buffered = io.BytesIO()
+    _to_image(data).save(buffered, format="JPEG", quality=quality)
+    return buffered.getvalue()
@@ -0,0 +1,133 @@
+import re
+from typing import Optional
+
+# 智谱AI模型输出中的特殊标记，一次匹配全部移除
+_SPECIAL_TAGS = [
+    "<|begin_of_box|>", "<|end_of_box|>",
+    "<|begin_of_text|>", "<|end_of_text|>",
+    "<|begin_of_list|>", "<|end_of_list|>",
+    "<|begin_of_attribute|>", "<|end_of_attribute|>"
+]
+_TAG_RE = re.compile("|".join(re.escape(tag) for tag in _SPECIAL_TAGS))
+_MAX_TAG_LENGTH = max(len(tag) for tag in _SPECIAL_TAGS)
+
+# 开头和结尾的单竖线或双竖线
+_LEADING_DOUBLE_BAR_RE = re.compile(r'^\s*\|\|\s*')
+_LEADING_BAR_RE = re.compile(r'^\s*\|\s*')
+_TRAILING_DOUBLE_BAR_RE = re.compile(r'\s*\|\|\s*$')
+_TRAILING_BAR_RE = re.compile(r'\s*\|\s*$')
+
+# 第一个不是空白或竖线的字符；结尾由空白和竖线组成的部分
+_CONTENT_CHAR_RE = re.compile(r'[^\s|]')
+_TRAILING_RUN_RE = re.compile(r'[\s|]*\Z')
+
+
+def _strip_leading_bars(text: str) -> str:
+    text = _LEADING_DOUBLE_BAR_RE.sub('', text, count=1)
+    return _LEADING_BAR_RE.sub('', text, count=1)
+
+
+def _strip_trailing_bars(text: str) -> str:
+    text = _TRAILING_DOUBLE_BAR_RE.sub('', text, count=1)
+    return _TRAILING_BAR_RE.sub('', text, count=1)
+
+
+def clean_special_tags(text: Optional[str]) -> Optional[str]:
+    """
+    清理文本中的特殊标记
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        清理后的文本
+    """
+    if not text:
+        return text
+    return _strip_trailing_bars(_strip_leading_bars(_TAG_RE.sub('', text)))
+
+
+def _partial_tag_start(text: str) -> int:
+    """
+    返回结尾处可能是某个特殊标记前半部分的起始位置，没有时返回len(text)
+    """
+    start = text.rfind("<", max(0, len(text) - _MAX_TAG_LENGTH + 1))
+    while start != -1:
+        tail = text[start:]
+        if any(tag.startswith(tail) for tag in _SPECIAL_TAGS):
+            return start
+        start = text.rfind("<", max(0, len(text) - _MAX_TAG_LENGTH + 1), start)
+    return len(text)
+
+
+class StreamingTagCleaner:
+    """
+    流式输出的增量清理器
+
+    逐个分片调用feed()，返回可以立即输出的已清理文本；结束时调用flush()取出剩余部分。
+    被分片边界截断的特殊标记会暂存到下一个分片；开头的竖线在出现第一个正文字符前暂存，
+    结尾的空白和竖线在确认后续还有正文后才输出。所有分片拼接后与clean_special_tags(全文)的结果一致。
+    """
+
+    def __init__(self):
+        self._pending = ""
+        self._head = ""
+        self._in_head = True
+        self._tail = ""
+
+    def feed(self, chunk: str) -> str:
+        """
+        输入一个分片
+
+        Args:
+            chunk: 模型输出的文本分片
+
+        Returns:
+            可以立即输出的已清理文本（可能为空字符串）
+        """
+        if not chunk:
+            return ""
+        text = self._pending + chunk
+        if "<" not in text:
+            # 大多数分片不含特殊标记，跳过标记匹配
+            self._pending = ""
+            return self._emit(text)
+        cut = _partial_tag_start(text)
+        self._pending = text[cut:]
+        return self._emit(_TAG_RE.sub('', text[:cut]))
+
+    def flush(self) -> str:
+        """
+        结束输入，返回剩余的已清理文本
+        """
+        text = _TAG_RE.sub('', self._pending)
+        self._pending = ""
+
+        if self._in_head:
+            # 全文都是空白和竖线
+            head, self._head = self._head + text, ""
+            return _strip_trailing_bars(_strip_leading_bars(head))
+
+        tail, self._tail = self._tail + text, ""
+        return _strip_trailing_bars(tail)
+
+    def _emit(self, text: str) -> str:
+        if not text:
+            return ""
+
+        if self._in_head:
+            self._head += text
+            if not _CONTENT_CHAR_RE.search(self._head):
+                return ""
+            text, self._head = _strip_leading_bars(self._head), ""
+            self._in_head = False
+
+        text = self._tail + text
+        last = text[-1]
+        if last != "|" and not last.isspace():
+            # 以正文字符结尾，没有需要暂存的部分
+            self._tail = ""
+            return text
+        split = _TRAILING_RUN_RE.search(text).start()
+        self._tail = text[split:]
+        return text[:split]
@@ -1,5 +1,6 @@
 from celery import Celery
-from app.core.config import REDIS_URL
+from celery.signals import worker_process_init, worker_process_shutdown, worker_shutdown
+from app.core.config import REDIS_URL, CELERY_WORKER_POOL, CELERY_WORKER_CONCURRENCY
 
 celery_app = Celery(
     "worker",
@@ -15,4 +16,21 @@ celery_app.conf.update(
     result_serializer="json",
     timezone="Asia/Shanghai",
     enable_utc=False,
+    worker_pool=CELERY_WORKER_POOL,
+    worker_concurrency=CELERY_WORKER_CONCURRENCY,
 )
+
+
+@worker_process_init.connect
+def start_worker_loop(**kwargs):
+    """prefork子进程启动后创建常驻事件循环"""
+    from app.worker.event_loop import get_worker_loop
+    get_worker_loop()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def stop_worker_loop(**kwargs):
+    """worker退出时关闭常驻事件循环和连接池"""
+    from app.worker.event_loop import shutdown_worker_loop
+    shutdown_worker_loop()
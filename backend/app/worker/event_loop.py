@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import os
+import threading
+
+from app.core.config import WORKER_MODEL_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# 每个worker进程持有一个常驻事件循环，运行在后台线程中
+_loop = None
+_thread = None
+_semaphore = None
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    """fork出的子进程不会继承父进程的线程，需要重新创建事件循环"""
+    global _loop, _thread, _semaphore, _lock
+    _loop = None
+    _thread = None
+    _semaphore = None
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_worker_loop():
+    """
+    获取当前进程的常驻事件循环，不存在时启动
+
+    同一进程内的所有任务共享这个循环，因此也共享模型客户端的HTTP连接池。
+
+    Returns:
+        正在后台线程中运行的事件循环
+    """
+    global _loop, _thread, _semaphore
+
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="worker-event-loop", daemon=True)
+            thread.start()
+
+            _loop = loop
+            _thread = thread
+            _semaphore = asyncio.Semaphore(WORKER_MODEL_CONCURRENCY)
+            logger.info(f"已启动worker常驻事件循环，最大并发模型调用数: {WORKER_MODEL_CONCURRENCY}")
+
+    return _loop
+
+
+async def _run_limited(coro):
+    """在并发上限内执行协程"""
+    async with _semaphore:
+        return await coro
+
+
+def run_async(coro, timeout=None):
+    """
+    在常驻事件循环中执行协程并阻塞等待结果
+
+    供同步的Celery任务调用；多个任务线程可同时提交，最多WORKER_MODEL_CONCURRENCY个协程并发执行。
+
+    Args:
+        coro: 要执行的协程
+        timeout: 等待结果的超时时间（秒），None表示一直等待
+
+    Returns:
+        协程的返回值
+    """
+    loop = get_worker_loop()
+    future = asyncio.run_coroutine_threadsafe(_run_limited(coro), loop)
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+
+def shutdown_worker_loop():
+    """停止常驻事件循环（worker进程退出时调用）"""
+    global _loop, _thread
+
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            return
+
+        # 先关闭模型客户端的连接池，再停止事件循环
+        from app.services.zhipuai_service import zhipuai_service
+        try:
+            asyncio.run_coroutine_threadsafe(zhipuai_service.aclose(), _loop).result(5)
+        except Exception as e:
+            logger.warning(f"关闭模型客户端时出错: {str(e)}")
+
+        _loop.call_soon_threadsafe(_loop.stop)
+        if _thread is not None:
+            _thread.join(timeout=5)
+        _loop.close()
+        _loop = None
+        _thread = None
+        logger.info("已关闭worker常驻事件循环")
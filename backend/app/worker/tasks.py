@@ -4,17 +4,22 @@ import json
 import os
 import logging
 from PIL import Image
-import asyncio
 from sqlalchemy.orm import Session
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
 from app.worker.celery_app import celery_app
-from app.core.config import ZHIPUAI_API_KEY, UPLOAD_FOLDER, DATABASE_URL
+from app.worker.event_loop import run_async
+from app.core.config import ZHIPUAI_API_KEY, UPLOAD_FOLDER, DATABASE_URL, CONTEXT_MAX_MESSAGES, TILED_ANALYSIS_MIN_SIDE
 from app.services.zhipuai_service import zhipuai_service
 from app.services.user_service import MessageService, ChatService
+from app.services.context_builder import build_context_messages
+from app.services.cancellation import cancellation, cancel_flag_key
+from app.services.execution_profiles import execution_profiles
 from app.db.models import Message, Chat
-from app.utils.image_utils import preprocess_image
+from app.services.artifact_store import artifact_store
+from app.services.tiled_analysis import analyze_tiled, should_tile
+from app.utils.detection_parser import extract_object_coordinates
 
 logger = logging.getLogger(__name__)
 
@@ -29,8 +34,46 @@ def get_db():
     finally:
         db.close()
 
+def task_progress_key(task_id):
+    """任务进度（流式解析出的检测结果）在Redis中的键"""
+    return f"task_progress:{task_id}"
+
+def _detection_publisher(task_id, redis_client):
+    """
+    创建把流式解析出的检测结果追加到任务进度中的回调，任务处理中时由/tasks/{task_id}返回
+    
+    Args:
+        task_id: 任务ID
+        redis_client: Redis客户端
+    """
+    key = task_progress_key(task_id)
+    
+    def publish(detection):
+        try:
+            pipe = redis_client.pipeline()
+            pipe.rpush(key, json.dumps(detection, ensure_ascii=False))
+            pipe.expire(key, 3600)
+            pipe.execute()
+        except Exception as e:
+            # 发布进度失败不影响分析本身
+            logger.warning(f"发布任务 {task_id} 的检测进度时出错: {str(e)}")
+    
+    return publish
+
+def _canceled_result(task_id, chat_id, redis_client):
+    """构建任务被取消时的结果，并删除取消标记"""
+    logger.info(f"任务 {task_id} 已被用户取消，终止处理")
+    redis_client.delete(cancel_flag_key(task_id), task_progress_key(task_id))
+    return {
+        "task_id": task_id,
+        "chat_id": chat_id,
+        "status": "canceled",
+        "result": "用户已取消任务",
+        "completed_at": time.time()
+    }
+
 @celery_app.task(name="process_image_task")
-def process_image_task(task_id, image_path, prompt, task_type, chat_id=None):
+def process_image_task(task_id, image_path, prompt, task_type, chat_id=None, use_cache=True, profile=None, tiled=None):
     """
     处理图像分析任务的Celery任务
     
@@ -40,6 +83,9 @@ def process_image_task(task_id, image_path, prompt, task_type, chat_id=None):
         prompt: 分析提示
         task_type: 任务类型 (例如: "description", "detection", "segmentation")
         chat_id: 聊天会话ID
+        use_cache: 是否使用分析结果缓存
+        profile: 执行档位名称，None表示不使用档位（兼容旧任务）
+        tiled: 是否分块分析，None表示场景最长边超过TILED_ANALYSIS_MIN_SIDE时自动分块
         
     Returns:
         任务结果字典
@@ -56,64 +102,70 @@ def process_image_task(task_id, image_path, prompt, task_type, chat_id=None):
     # 标记任务正在处理
     redis_client.setex(f"task_processing:{task_id}", 3600, "1")
     
+    # 订阅取消通知，之后的各个阶段只检查进程内标志
+    cancel_token = cancellation.register(task_id)
+    
     try:
-        # 图像预处理
-        with open(image_path, "rb") as image_file:
-            # 将图像转换为Base64
-            image_base64 = base64.b64encode(image_file.read()).decode('utf-8')
+        # 大幅场景按窗口分块读取原始栅格，不需要整幅图像的载荷
+        if tiled is None:
+            tiled = should_tile(image_path, TILED_ANALYSIS_MIN_SIDE)
+        
+        # 图像预处理：获取标准化图像的Base64载荷（按执行档位限制分辨率），同时为后续追问生成载荷
+        max_image_size = execution_profiles.get(profile).max_image_size if profile else None
+        if not tiled:
+            image_base64, image_sha256 = artifact_store.get(image_path, max_image_size)
+        
+        if cancel_token.is_set():
+            return _canceled_result(task_id, chat_id, redis_client)
         
         # 如果有chat_id，从数据库中获取对话历史
         context_messages = []
+        context_tokens = 0
         if chat_id:
             db = get_db()
-            # 获取前10条消息作为上下文
-            messages = db.query(Message).filter(Message.chat_id == chat_id).order_by(Message.timestamp.desc()).limit(10).all()
+            # 获取最近的消息，按token预算打包上下文
+            messages = MessageService.get_last_messages(db, chat_id, CONTEXT_MAX_MESSAGES)
             
             # 将消息按时间顺序排序
             messages = sorted(messages, key=lambda x: x.timestamp)
-            
-            # 构建上下文
-            for msg in messages:
-                if msg.sender == "user":
-                    context_messages.append({
-                        "role": "user", 
-                        "content": msg.text
-                    })
-                elif msg.sender == "ai":
-                    context_messages.append({
-                        "role": "assistant", 
-                        "content": msg.text
-                    })
+            context_messages, context_tokens = build_context_messages(messages, current_prompt=prompt)
+            logger.info(f"任务 {task_id} 上下文: {len(context_messages)} 条消息, 约 {context_tokens} tokens")
             
             db.close()
         
         # 检查任务是否已被取消
-        if redis_client.exists(f"task_cancel:{task_id}"):
-            logger.info(f"任务 {task_id} 已被用户取消，终止处理")
-            # 删除取消标记
-            redis_client.delete(f"task_cancel:{task_id}")
-            return {
-                "task_id": task_id,
-                "chat_id": chat_id,
-                "status": "canceled",
-                "result": "用户已取消任务",
-                "completed_at": time.time()
-            }
-        
-        # 创建事件循环调用异步方法
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        result = loop.run_until_complete(
-            zhipuai_service.analyze_image(
-                image_base64=image_base64, 
-                prompt=prompt, 
-                task_type=task_type, 
-                context_messages=context_messages if context_messages else None,
-                task_id=task_id,  # 传递task_id用于检查取消
-                redis_client=redis_client  # 传递Redis客户端
+        if cancel_token.is_set():
+            return _canceled_result(task_id, chat_id, redis_client)
+        
+        # 在worker进程的常驻事件循环中调用异步方法
+        if tiled:
+            # 各图块在同一个事件循环中并发分析，结果合并为整幅场景的输出
+            result = run_async(
+                analyze_tiled(
+                    image_path,
+                    prompt,
+                    task_type=task_type,
+                    context_messages=context_messages if context_messages else None,
+                    cancel_token=cancel_token,
+                    use_cache=use_cache,
+                    profile=profile,
+                    on_detection=_detection_publisher(task_id, redis_client)
+                )
+            )
+        else:
+            result = run_async(
+                zhipuai_service.analyze_image(
+                    image_base64=image_base64, 
+                    prompt=prompt, 
+                    task_type=task_type, 
+                    context_messages=context_messages if context_messages else None,
+                    cancel_token=cancel_token,  # 收到取消通知时立即中止调用
+                    use_cache=use_cache,
+                    image_sha256=image_sha256,
+                    profile=profile,
+                    on_detection=_detection_publisher(task_id, redis_client)
+                )
             )
-        )
-        loop.close()
         
         # 处理和格式化结果
         if hasattr(result, "content"):
@@ -128,82 +180,17 @@ def process_image_task(task_id, image_path, prompt, task_type, chat_id=None):
         object_coordinates = None
         is_object_mark = task_type == "detection"
         
-        if is_object_mark:
-            try:
-                # 尝试从结果中提取坐标信息
-                import re
-                
-                # 首先尝试提取整个回复作为JSON
-                try:
-                    full_json = json.loads(content)
-                    # 检查是否是有效的坐标格式
-                    if isinstance(full_json, dict) and ('bbox' in full_json or 
-                            ('x' in full_json and 'y' in full_json and 'width' in full_json and 'height' in full_json)):
-                        object_coordinates = content
-                    elif isinstance(full_json, list) and len(full_json) > 0:
-                        # 如果是列表，检查第一个元素是否有效
-                        if isinstance(full_json[0], dict) and ('bbox' in full_json[0] or 
-                                ('x' in full_json[0] and 'y' in full_json[0] and 'width' in full_json[0] and 'height' in full_json[0])):
-                            object_coordinates = content
-                        # 检查是否是坐标数组 [x1,y1,x2,y2]
-                        elif len(full_json) >= 4 and all(isinstance(item, (int, float)) for item in full_json[:4]):
-                            object_coordinates = content
-                except:
-                    # 不是有效JSON，尝试提取JSON部分
-                    
-                    # 提取JSON格式的坐标信息，优先查找包含bbox或坐标的JSON
-                    bbox_json_pattern = r'\{"label":[^}]+,"bbox":\[[^\]]+\]\}'
-                    bbox_matches = re.findall(bbox_json_pattern, content)
-                    
-                    if bbox_matches:
-                        # 找到了bbox格式的JSON
-                        object_coordinates = bbox_matches[0]
-                    else:
-                        # 尝试查找一般的JSON对象
-                        json_pattern = r'\{(?:[^{}]|(?:\{[^{}]*\}))*\}'
-                        json_matches = re.findall(json_pattern, content)
-                        
-                        # 也尝试寻找方括号格式的数组
-                        array_pattern = r'\[(?:[^\[\]]|\[[^\[\]]*\])*\]'
-                        array_matches = re.findall(array_pattern, content)
-                        
-                        if json_matches:
-                            for match in json_matches:
-                                try:
-                                    obj = json.loads(match)
-                                    if isinstance(obj, dict) and ('bbox' in obj or 
-                                        ('x' in obj and 'y' in obj and 'width' in obj and 'height' in obj) or
-                                        'label' in obj):
-                                        object_coordinates = match
-                                        break
-                                except:
-                                    pass
-                                    
-                        if not object_coordinates and array_matches:
-                            for match in array_matches:
-                                try:
-                                    arr = json.loads(match)
-                                    if isinstance(arr, list):
-                                        if len(arr) >= 4 and all(isinstance(item, (int, float)) for item in arr[:4]):
-                                            # 可能是坐标数组 [x1,y1,x2,y2]
-                                            object_coordinates = match
-                                            break
-                                        elif len(arr) > 0 and isinstance(arr[0], dict):
-                                            # 检查是否是对象列表
-                                            if ('bbox' in arr[0] or 
-                                                ('x' in arr[0] and 'y' in arr[0] and 'width' in arr[0] and 'height' in arr[0])):
-                                                object_coordinates = match
-                                                break
-                                except:
-                                    pass
-                
-                # 如果还是没找到，但是知道这是标记物体任务，使用内容作为坐标
-                if not object_coordinates and is_object_mark:
-                    logger.warning(f"无法从内容中提取坐标信息: {content}")
-                    # 使用整个内容作为坐标
-                    object_coordinates = content
-            except Exception as e:
-                logger.error(f"提取坐标信息时出错: {e}")
+        if is_object_mark and getattr(result, "detections", None) is not None:
+            # 分块分析已经解析并合并了各图块的检测结果
+            object_coordinates = json.dumps(
+                [{"label": d["label"], "bbox": d["bbox"]} for d in result.detections], ensure_ascii=False
+            )
+        elif is_object_mark:
+            object_coordinates = extract_object_coordinates(content)
+            if not object_coordinates:
+                # 没有解析到坐标，使用整个内容作为坐标，由前端处理
+                logger.warning(f"无法从内容中提取坐标信息: {content}")
+                object_coordinates = content
         
         formatted_result = {
             "task_id": task_id,
@@ -212,9 +199,18 @@ def process_image_task(task_id, image_path, prompt, task_type, chat_id=None):
             "result": content,
             "completed_at": time.time(),
             "is_object_mark": is_object_mark,
-            "object_coordinates": object_coordinates
+            "object_coordinates": object_coordinates,
+            "cached": getattr(result, "cached", False),
+            "context_tokens": context_tokens,
+            "profile": profile,
+            "tiled": bool(tiled)
         }
         
+        # 分块分析的图块数和失败的图块
+        if getattr(result, "tiles", None):
+            formatted_result["tiles"] = result.tiles
+            formatted_result["failed_tiles"] = result.failed_tiles
+        
         # 如果有thinking内容，也返回
         if hasattr(result, "thinking"):
             formatted_result["thinking"] = result.thinking
@@ -240,7 +236,8 @@ def process_image_task(task_id, image_path, prompt, task_type, chat_id=None):
                     sender="ai",
                     thinking=formatted_result.get("thinking"),
                     is_object_mark=formatted_result.get("is_object_mark", False),
-                    object_coordinates=formatted_result.get("object_coordinates")
+                    object_coordinates=formatted_result.get("object_coordinates"),
+                    prompt_version=getattr(result, "prompt_version", None)
                 )
                 
                 db.commit()
@@ -260,6 +257,7 @@ def process_image_task(task_id, image_path, prompt, task_type, chat_id=None):
         # 删除处理中标记和取消标记（如果有）
         redis_client.delete(f"task_processing:{task_id}")
         redis_client.delete(f"task_cancel:{task_id}")
+        redis_client.delete(task_progress_key(task_id))
         
         logger.info(f"任务 {task_id} 完成并保存到Redis和数据库")
         return formatted_result
@@ -312,13 +310,16 @@ def process_image_task(task_id, image_path, prompt, task_type, chat_id=None):
         # 删除处理中标记和取消标记（如果有）
         redis_client.delete(f"task_processing:{task_id}")
         redis_client.delete(f"task_cancel:{task_id}")
+        redis_client.delete(task_progress_key(task_id))
         
         logger.error(f"处理任务 {task_id} 时出错: {str(e)}")
         return error_result
+    finally:
+        cancellation.unregister(task_id)
 
 
 @celery_app.task(name="process_text_task")
-def process_text_task(task_id, prompt, chat_id, task_type="description"):
+def process_text_task(task_id, prompt, chat_id, task_type="description", use_cache=True, profile=None):
     """
     处理文本消息的Celery任务（基于已有图像上下文）
     
@@ -327,6 +328,8 @@ def process_text_task(task_id, prompt, chat_id, task_type="description"):
         prompt: 用户提问
         chat_id: 聊天会话ID
         task_type: 任务类型 (例如: "description", "mark_object")
+        use_cache: 是否使用分析结果缓存
+        profile: 执行档位名称，None表示不使用档位（兼容旧任务）
         
     Returns:
         任务结果字典
@@ -342,6 +345,9 @@ def process_text_task(task_id, prompt, chat_id, task_type="description"):
     # 标记任务开始处理
     redis_client.setex(f"task_processing:{task_id}", 3600, "1")
     
+    # 订阅取消通知，之后的各个阶段只检查进程内标志
+    cancel_token = cancellation.register(task_id)
+    
     try:
         db = get_db()
         
@@ -350,11 +356,10 @@ def process_text_task(task_id, prompt, chat_id, task_type="description"):
         if not chat:
             raise Exception("聊天会话不存在")
         
-        # 构建上下文，获取最近20条消息
-        messages = db.query(Message).filter(Message.chat_id == chat_id).order_by(Message.timestamp.desc()).limit(20).all()
+        # 获取最近的消息，按token预算打包上下文
+        messages = MessageService.get_last_messages(db, chat_id, CONTEXT_MAX_MESSAGES)
         messages = sorted(messages, key=lambda x: x.timestamp)
         
-        context_messages = []
         # 查找是否有图片消息
         has_image = False
         image_path = None
@@ -363,17 +368,9 @@ def process_text_task(task_id, prompt, chat_id, task_type="description"):
             if msg.sender == "system" and msg.image_path:
                 has_image = True
                 image_path = msg.image_path
-            
-            if msg.sender == "user":
-                context_messages.append({
-                    "role": "user", 
-                    "content": msg.text
-                })
-            elif msg.sender == "ai":
-                context_messages.append({
-                    "role": "assistant", 
-                    "content": msg.text
-                })
+        
+        context_messages, context_tokens = build_context_messages(messages, current_prompt=prompt)
+        logger.info(f"文本任务 {task_id} 上下文: {len(context_messages)} 条消息, 约 {context_tokens} tokens")
         
         if not has_image:
             raise Exception("聊天中没有上传的图像")
@@ -386,41 +383,35 @@ def process_text_task(task_id, prompt, chat_id, task_type="description"):
             raise Exception("历史图像文件已不可访问，请重新上传图像")
         
         # 检查任务是否已被取消
-        if redis_client.exists(f"task_cancel:{task_id}"):
-            logger.info(f"文本任务 {task_id} 已被用户取消，终止处理")
-            # 删除取消标记
-            redis_client.delete(f"task_cancel:{task_id}")
-            return {
-                "task_id": task_id,
-                "chat_id": chat_id,
-                "status": "canceled",
-                "result": "用户已取消任务",
-                "completed_at": time.time()
-            }
-        
-        # 读取图像并转换为base64
-        with open(local_image_path, "rb") as image_file:
-            image_base64 = base64.b64encode(image_file.read()).decode('utf-8')
+        if cancel_token.is_set():
+            return _canceled_result(task_id, chat_id, redis_client)
+        
+        # 复用已生成的图像载荷，不再重新读取和编码图像（按执行档位限制分辨率）
+        max_image_size = execution_profiles.get(profile).max_image_size if profile else None
+        image_base64, image_sha256 = artifact_store.get(local_image_path, max_image_size)
+        
+        if cancel_token.is_set():
+            return _canceled_result(task_id, chat_id, redis_client)
         
         # 根据task_type设置API任务类型
         api_task_type = task_type
         if task_type == "mark_object":
             api_task_type = "detection"
         
-        # 创建事件循环调用异步方法
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        result = loop.run_until_complete(
+        # 在worker进程的常驻事件循环中调用异步方法
+        result = run_async(
             zhipuai_service.analyze_image(
                 image_base64=image_base64, 
                 prompt=prompt, 
                 task_type=api_task_type, 
                 context_messages=context_messages if context_messages else None,
-                task_id=task_id,  # 传递task_id用于检查取消
-                redis_client=redis_client  # 传递Redis客户端
+                cancel_token=cancel_token,  # 收到取消通知时立即中止调用
+                use_cache=use_cache,
+                image_sha256=image_sha256,
+                profile=profile,
+                on_detection=_detection_publisher(task_id, redis_client)
             )
         )
-        loop.close()
         
         # 处理和格式化结果
         if hasattr(result, "content"):
@@ -433,65 +424,7 @@ def process_text_task(task_id, prompt, chat_id, task_type="description"):
         # 提取对象坐标（如果是标记物体任务）
         object_coordinates = None
         if task_type == "mark_object":
-            try:
-                import re
-                # 注意：不重新导入json，使用全局的json模块
-                
-                # 尝试从结果中提取坐标信息
-                try:
-                    full_json = json.loads(content)
-                    if isinstance(full_json, dict) and ('bbox' in full_json or 
-                            ('x' in full_json and 'y' in full_json and 'width' in full_json and 'height' in full_json)):
-                        object_coordinates = content
-                    elif isinstance(full_json, list) and len(full_json) > 0:
-                        if isinstance(full_json[0], dict) and ('bbox' in full_json[0] or 
-                                ('x' in full_json[0] and 'y' in full_json[0] and 'width' in full_json[0] and 'height' in full_json[0])):
-                            object_coordinates = content
-                        elif len(full_json) >= 4 and all(isinstance(item, (int, float)) for item in full_json[:4]):
-                            object_coordinates = content
-                except:
-                    # 提取JSON格式的坐标信息
-                    bbox_json_pattern = r'\{"label":[^}]+,"bbox":\[[^\]]+\]\}'
-                    bbox_matches = re.findall(bbox_json_pattern, content)
-                    
-                    if bbox_matches:
-                        object_coordinates = bbox_matches[0]
-                    else:
-                        json_pattern = r'\{(?:[^{}]|(?:\{[^{}]*\}))*\}'
-                        json_matches = re.findall(json_pattern, content)
-                        
-                        array_pattern = r'\[(?:[^\[\]]|\[[^\[\]]*\])*\]'
-                        array_matches = re.findall(array_pattern, content)
-                        
-                        if json_matches:
-                            for match in json_matches:
-                                try:
-                                    obj = json.loads(match)
-                                    if isinstance(obj, dict) and ('bbox' in obj or 
-                                        ('x' in obj and 'y' in obj and 'width' in obj and 'height' in obj) or
-                                        'label' in obj):
-                                        object_coordinates = match
-                                        break
-                                except:
-                                    pass
-                                    
-                        if not object_coordinates and array_matches:
-                            for match in array_matches:
-                                try:
-                                    arr = json.loads(match)
-                                    if isinstance(arr, list):
-                                        if len(arr) >= 4 and all(isinstance(item, (int, float)) for item in arr[:4]):
-                                            object_coordinates = match
-                                            break
-                                        elif len(arr) > 0 and isinstance(arr[0], dict):
-                                            if ('bbox' in arr[0] or 
-                                                ('x' in arr[0] and 'y' in arr[0] and 'width' in arr[0] and 'height' in arr[0])):
-                                                object_coordinates = match
-                                                break
-                                except:
-                                    pass
-            except Exception as e:
-                logger.warning(f"提取坐标信息时出错: {e}")
+            object_coordinates = extract_object_coordinates(content)
         
         # 保存到数据库
         try:
@@ -503,7 +436,8 @@ def process_text_task(task_id, prompt, chat_id, task_type="description"):
                 sender="ai",
                 thinking=thinking,
                 object_coordinates=object_coordinates,
-                is_object_mark=(task_type == "mark_object")
+                is_object_mark=(task_type == "mark_object"),
+                prompt_version=getattr(result, "prompt_version", None)
             )
             
             db.commit()
@@ -522,6 +456,9 @@ def process_text_task(task_id, prompt, chat_id, task_type="description"):
             "thinking": thinking,
             "object_coordinates": object_coordinates,
             "is_object_mark": (task_type == "mark_object"),
+            "cached": getattr(result, "cached", False),
+            "context_tokens": context_tokens,
+            "profile": profile,
             "completed_at": time.time()
         }
         
@@ -534,6 +471,7 @@ def process_text_task(task_id, prompt, chat_id, task_type="description"):
         # 删除处理中标记和取消标记（如果有）
         redis_client.delete(f"task_processing:{task_id}")
         redis_client.delete(f"task_cancel:{task_id}")
+        redis_client.delete(task_progress_key(task_id))
         
         logger.info(f"文本任务 {task_id} 处理完成")
         return success_result
@@ -588,6 +526,9 @@ def process_text_task(task_id, prompt, chat_id, task_type="description"):
         # 删除处理中标记和取消标记（如果有）
         redis_client.delete(f"task_processing:{task_id}")
         redis_client.delete(f"task_cancel:{task_id}")
+        redis_client.delete(task_progress_key(task_id))
         
         logger.error(f"处理文本任务 {task_id} 时出错: {str(e)}")
         return error_result
+    finally:
+        cancellation.unregister(task_id)
@@ -0,0 +1,126 @@
+"""
+/chat/text并发负载测试
+
+使用离线模拟模型后端（固定的首token延迟），在一个API进程内并发发送N个/chat/text请求，
+同时不断请求健康检查接口。模型调用不阻塞事件循环时，N个请求的总耗时接近单个请求的耗时
+（而不是N倍），健康检查的延迟保持在毫秒级。
+
+数据库和上传目录使用临时目录，不影响本地数据。模型调用的全局限流（MODEL_RATE_LIMITS）被关闭，
+测得的是API进程本身的并发能力，也不会占用共享Redis中的调用配额。
+
+用法（在backend目录下运行）:
+    python -m benchmarks.chat_load --requests 50 --latency 1.0
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+
+def _configure(args, workdir):
+    """在导入应用之前设置环境变量"""
+    os.environ.update({
+        "MODEL_BACKEND": "fake",
+        "FAKE_MODEL_LATENCY": f"fixed:{args.latency}",
+        "FAKE_MODEL_TOKENS": str(args.tokens),
+        "FAKE_MODEL_THINKING_TOKENS": "0",
+        "FAKE_MODEL_TOKEN_RATE": "0",
+        "MODEL_RATE_LIMITS": "{}",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "UPLOAD_FOLDER": os.path.join(workdir, "uploads"),
+        "DERIVED_FOLDER": os.path.join(workdir, "derived"),
+    })
+
+
+def _prepare(count):
+    """创建用户和count个带有上传图像的聊天，返回(应用, 聊天ID列表)"""
+    from PIL import Image
+
+    import main
+    from app.api.api_v1.endpoints.users import get_current_user
+    from app.core.config import UPLOAD_FOLDER
+    from app.db.database import Base, SessionLocal, engine
+    from app.db.models import Chat, User
+    from app.services.user_service import MessageService
+
+    Base.metadata.create_all(bind=engine)
+    Image.new("RGB", (512, 512), (40, 90, 40)).save(os.path.join(UPLOAD_FOLDER, "bench.png"))
+
+    db = SessionLocal()
+    user = User(id="bench-user", username="bench")
+    db.add(user)
+    chat_ids = []
+    for index in range(count):
+        chat = Chat(id=f"bench-chat-{index}", user_id=user.id, title="负载测试")
+        db.add(chat)
+        db.commit()
+        MessageService.create_message(db, chat.id, "已上传图像", "system", image_path="/api/uploads/bench.png")
+        chat_ids.append(chat.id)
+    db.refresh(user)
+    db.expunge(user)
+    db.close()
+
+    main.app.dependency_overrides[get_current_user] = lambda: user
+    return main.app, chat_ids
+
+
+async def _run(app, chat_ids, probe_interval):
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def chat(chat_id):
+            started = time.perf_counter()
+            response = await client.post("/api/chat/text", json={
+                "prompt": f"描述图像（{chat_id}）", "chat_id": chat_id, "use_cache": False
+            })
+            response.raise_for_status()
+            assert response.json()["status"] == "success", response.json()
+            return time.perf_counter() - started
+
+        # 单个请求的耗时作为基准
+        single = await chat(chat_ids[0])
+
+        probes = []
+        done = asyncio.Event()
+
+        async def probe():
+            while not done.is_set():
+                started = time.perf_counter()
+                await client.get("/api/health/")
+                probes.append(time.perf_counter() - started)
+                await asyncio.sleep(probe_interval)
+
+        prober = asyncio.create_task(probe())
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*[chat(chat_id) for chat_id in chat_ids])
+        total = time.perf_counter() - started
+        done.set()
+        await prober
+    return single, total, latencies, probes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50, help="并发请求数")
+    parser.add_argument("--latency", type=float, default=1.0, help="模拟模型的首token延迟（秒）")
+    parser.add_argument("--tokens", type=int, default=200, help="模拟模型每次回复的token数")
+    parser.add_argument("--probe-interval", type=float, default=0.05, help="健康检查的请求间隔（秒）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        _configure(args, workdir)
+        app, chat_ids = _prepare(args.requests)
+        single, total, latencies, probes = asyncio.run(_run(app, chat_ids, args.probe_interval))
+
+    print(f"单个请求耗时:       {single:.2f} s")
+    print(f"{args.requests}个并发请求总耗时: {total:.2f} s（串行执行约需 {single * args.requests:.1f} s）")
+    print(f"并发请求延迟:       p50 {statistics.median(latencies):.2f} s, 最大 {max(latencies):.2f} s")
+    print(f"健康检查延迟:       {len(probes)}次, p50 {statistics.median(probes) * 1000:.1f} ms, "
+          f"最大 {max(probes) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+检测结果解析的基准测试
+
+比较两种从模型回复中提取检测框的方式：
+- 原实现：先用json.loads解析全文，失败时依次用三个正则（bbox对象、嵌套对象、嵌套数组）re.findall，
+  只取第一个符合条件的匹配；
+- detection_parser.extract_object_coordinates：单次扫描括号，解析所有检测结果并去重。
+
+语料包括数据库中已有的物体标记回复，以及由正文段落和多种格式的检测结果（裸数组、```json代码块、
+正文中的单个对象、{"objects": [...]}、被截断的结尾）拼接成的数千token长回复。
+分别报告两种方式的耗时和取到的检测框数。
+
+用法（在backend目录下运行）:
+    python -m benchmarks.detection_parser --tokens 1000 5000 20000 --db yaogan_chat.db
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sqlite3
+import time
+
+from app.utils.detection_parser import extract_object_coordinates
+
+_LABELS = ["飞机", "船", "车辆", "建筑", "储油罐", "湖泊"]
+_PROSE = [
+    "图像中可以看到一个机场，跑道呈东西走向，停机坪上停放着多架飞机。",
+    "港口区域有若干船只停靠，码头附近堆放着集装箱。",
+    "道路网络较为规则，主干道两侧分布着居民区和商业建筑。",
+    "The scene shows farmland in the north and a river crossing from west to east.",
+    "以下是检测到的目标（坐标为0-1之间的相对位置）：",
+    "注意：部分目标被云层遮挡，检测结果可能不完整。",
+]
+
+
+def _has_box(obj):
+    return isinstance(obj, dict) and ("bbox" in obj or all(key in obj for key in ("x", "y", "width", "height")))
+
+
+def _legacy_extract(content):
+    """原chat.py和worker/tasks.py中提取object_coordinates的实现（去掉日志）"""
+    object_coordinates = None
+    try:
+        full_json = json.loads(content)
+        if _has_box(full_json):
+            object_coordinates = content
+        elif isinstance(full_json, list) and len(full_json) > 0:
+            if _has_box(full_json[0]):
+                object_coordinates = content
+            elif len(full_json) >= 4 and all(isinstance(item, (int, float)) for item in full_json[:4]):
+                object_coordinates = content
+    except Exception:
+        bbox_matches = re.findall(r'\{"label":[^}]+,"bbox":\[[^\]]+\]\}', content)
+        if bbox_matches:
+            object_coordinates = bbox_matches[0]
+        else:
+            json_matches = re.findall(r'\{(?:[^{}]|(?:\{[^{}]*\}))*\}', content)
+            array_matches = re.findall(r'\[(?:[^\[\]]|\[[^\[\]]*\])*\]', content)
+            for match in json_matches:
+                try:
+                    obj = json.loads(match)
+                    if _has_box(obj) or (isinstance(obj, dict) and "label" in obj):
+                        object_coordinates = match
+                        break
+                except Exception:
+                    pass
+            if not object_coordinates:
+                for match in array_matches:
+                    try:
+                        arr = json.loads(match)
+                        if isinstance(arr, list) and (
+                            (len(arr) >= 4 and all(isinstance(item, (int, float)) for item in arr[:4]))
+                            or (len(arr) > 0 and _has_box(arr[0]))
+                        ):
+                            object_coordinates = match
+                            break
+                    except Exception:
+                        pass
+    return object_coordinates
+
+
+def _count_boxes(coordinates):
+    """object_coordinates中的检测框数"""
+    if not coordinates:
+        return 0
+    try:
+        value = json.loads(coordinates)
+    except ValueError:
+        return 0
+    if isinstance(value, list):
+        return sum(1 for item in value if _has_box(item)) or (1 if len(value) >= 4 else 0)
+    return 1 if _has_box(value) else 0
+
+
+def _detection(rnd):
+    x, y = round(rnd.random() * 0.9, 3), round(rnd.random() * 0.9, 3)
+    x2, y2 = round(x + rnd.uniform(0.01, 0.1), 3), round(y + rnd.uniform(0.01, 0.1), 3)
+    return {"label": rnd.choice(_LABELS), "bbox": [x, y, x2, y2]}
+
+
+def _detection_block(rnd):
+    """一段检测结果，格式随机"""
+    detections = [_detection(rnd) for _ in range(rnd.randint(1, 8))]
+    style = rnd.randrange(4)
+    if style == 0:
+        return json.dumps(detections, ensure_ascii=False, indent=2)
+    if style == 1:
+        return "```json\n" + json.dumps(detections, ensure_ascii=False) + "\n```"
+    if style == 2:
+        return "，".join(f"{d['label']}位于{json.dumps(d, ensure_ascii=False)}" for d in detections)
+    return json.dumps({"objects": detections}, ensure_ascii=False)
+
+
+def _make_answer(tokens, rnd):
+    """生成一个约tokens个token（按每个token约2个字符估算）的长回复，结尾的检测结果被截断"""
+    parts = []
+    length = 0
+    while length < tokens * 2:
+        part = _detection_block(rnd) if rnd.random() < 0.3 else rnd.choice(_PROSE)
+        parts.append(part)
+        length += len(part)
+    parts.append(json.dumps([_detection(rnd) for _ in range(3)], ensure_ascii=False)[:-30])
+    return "\n".join(parts)
+
+
+def _load_answers(db_path):
+    """数据库中已有的物体标记回复"""
+    if not db_path or not os.path.exists(db_path):
+        return []
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT text FROM messages WHERE sender = 'ai' AND is_object_mark = 1 AND text IS NOT NULL")
+        return [text for (text,) in rows]
+    except sqlite3.Error:
+        return []
+    finally:
+        conn.close()
+
+
+def _best_of(fn, answers, repeat):
+    """返回重复repeat次中最快的总耗时（秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for answer in answers:
+            fn(answer)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, nargs="+", default=[1000, 5000, 20000], help="生成的长回复的token数")
+    parser.add_argument("--answers", type=int, default=5, help="每个长度生成的回复数")
+    parser.add_argument("--db", default="yaogan_chat.db", help="读取已有物体标记回复的数据库，不存在时跳过")
+    parser.add_argument("--repeat", type=int, default=5, help="每种方式的重复次数（取最快一次）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    corpora = []
+    stored = _load_answers(args.db)
+    if stored:
+        corpora.append((f"数据库({len(stored)}条)", stored))
+    for tokens in args.tokens:
+        corpora.append((f"{tokens} token x {args.answers}", [_make_answer(tokens, rnd) for _ in range(args.answers)]))
+
+    print("耗时单位为毫秒（每组回复的总耗时）；检测框数为每组回复中取到的检测框总数")
+    print(f"{'语料':>20} {'字符数':>9} {'原实现耗时':>10} {'新实现耗时':>10} {'原实现框数':>10} {'新实现框数':>10}")
+    for name, answers in corpora:
+        legacy_boxes = sum(_count_boxes(_legacy_extract(answer)) for answer in answers)
+        new_boxes = sum(_count_boxes(extract_object_coordinates(answer)) for answer in answers)
+        legacy = _best_of(_legacy_extract, answers, args.repeat)
+        new = _best_of(extract_object_coordinates, answers, args.repeat)
+        print(f"{name:>20} {sum(map(len, answers)):>12} {legacy * 1000:>15.2f} {new * 1000:>15.2f} "
+              f"{legacy_boxes:>15} {new_boxes:>15}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+检测结果后处理（限制坐标、去除退化框、按标签NMS）的微基准测试
+
+随机生成场景：小目标均匀分布，约30%的目标带有一个相邻图块或重复提问产生的重复检测框（IoU约0.9）。
+对每个规模分别测量postprocess_detections（整个后处理）和nms（只有抑制）的耗时，
+并与逐个检测框比较的纯Python贪心NMS对比（只在较小的规模上运行，结果必须一致）。
+
+用法（在backend目录下运行）:
+    python -m benchmarks.detection_postprocess --boxes 100 1000 3000 10000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from app.utils.detection_postprocess import NMS_IOU_THRESHOLD, clip_boxes, nms, postprocess_detections, to_arrays
+
+_LABELS = ["船", "车", "建筑", "树"]
+
+
+def _make_scene(count, duplicate_rate, rnd):
+    """生成约count个目标的检测结果（包括重复的检测框）"""
+    detections = []
+    for _ in range(count):
+        x, y = rnd.random() * 0.98, rnd.random() * 0.98
+        width, height = rnd.uniform(0.002, 0.01), rnd.uniform(0.002, 0.01)
+        label = rnd.choice(_LABELS)
+        detections.append({"label": label, "bbox": [x, y, x + width, y + height]})
+        if rnd.random() < duplicate_rate:
+            detections.append({"label": label, "bbox": [x + width * 0.05, y, x + width * 1.02, y + height]})
+    return detections
+
+
+def _greedy_nms(boxes, labels, iou_threshold=NMS_IOU_THRESHOLD):
+    """逐个检测框比较的贪心NMS（面积大的优先），作为对照"""
+    boxes = boxes.tolist()
+    labels = labels.tolist()
+    areas = [(x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in boxes]
+    keep = []
+    for i in sorted(range(len(boxes)), key=lambda index: -areas[index]):
+        x1, y1, x2, y2 = boxes[i]
+        for k in keep:
+            if labels[k] != labels[i]:
+                continue
+            kx1, ky1, kx2, ky2 = boxes[k]
+            inter = max(min(x2, kx2) - max(x1, kx1), 0.0) * max(min(y2, ky2) - max(y1, ky1), 0.0)
+            union = areas[i] + areas[k] - inter
+            if union > 0 and inter / union > iou_threshold:
+                break
+        else:
+            keep.append(i)
+    return keep
+
+
+def _median_ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--boxes", type=int, nargs="+", default=[100, 1000, 3000, 10000], help="每个场景的目标数")
+    parser.add_argument("--duplicates", type=float, default=0.3, help="带有重复检测框的目标比例")
+    parser.add_argument("--repeat", type=int, default=20, help="每个规模的重复次数（取中位数）")
+    parser.add_argument("--reference-max", type=int, default=3000, help="纯Python对照只在不超过该检测框数时运行")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    image_size = (20000, 20000)
+    print("耗时单位为毫秒（中位数）")
+    print(f"{'检测框数':>8} {'保留数':>8} {'后处理':>10} {'NMS':>10} {'纯Python NMS':>14}")
+    for count in args.boxes:
+        detections = _make_scene(count, args.duplicates, rnd)
+        boxes, labels = to_arrays(detections)
+        boxes = clip_boxes(boxes)
+
+        kept = nms(boxes, labels)
+        total = _median_ms(lambda: postprocess_detections(detections, image_size), args.repeat)
+        suppression = _median_ms(lambda: nms(boxes, labels), args.repeat)
+
+        reference = "-"
+        if len(detections) <= args.reference_max:
+            assert kept.tolist() == _greedy_nms(boxes, labels), "NMS结果与纯Python贪心NMS不一致"
+            reference = f"{_median_ms(lambda: _greedy_nms(boxes, labels), max(1, args.repeat // 10)):.1f}"
+
+        print(f"{len(detections):>8} {len(kept):>8} {total:>10.2f} {suppression:>10.2f} {reference:>14}")
+
+
+if __name__ == "__main__":
+    main()
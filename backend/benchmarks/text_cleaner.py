@@ -0,0 +1,119 @@
+"""
+流式特殊标记清理的基准测试
+
+比较两种处理长回复的方式：
+- 原实现：逐个分片拼接字符串（collected_content += delta），结束后用8次str.replace和4次正则清理全文，
+  /chat/text中再清理一次；
+- StreamingTagCleaner：每个分片到达时清理并追加到列表，结束时拼接一次。
+
+回复由中文、英文、标点、竖线和特殊标记（部分被分片边界截断）随机组成，每个分片约为一个token。
+两种方式的输出必须完全一致。分别报告总耗时，以及最后一个分片到达后到得到完整结果的耗时
+（原实现的清理全部集中在这一段，流式清理只剩拼接）。
+
+用法（在backend目录下运行）:
+    python -m benchmarks.text_cleaner --tokens 2000 5000 20000
+"""
+import argparse
+import random
+import re
+import time
+
+from app.utils.text_cleaner import StreamingTagCleaner
+
+_TAGS = ["<|begin_of_box|>", "<|end_of_box|>", "<|begin_of_text|>", "<|end_of_text|>"]
+_WORDS = ["遥感", "图像", "中", "有", "一栋", "建筑", "道路", "，", "。", "building", " road", " the", "\n", "|", " ", "1", "0.25"]
+
+
+def _legacy_clean(text):
+    """原ZhipuAiService._clean_special_tags的实现"""
+    if not text:
+        return text
+    tags_to_remove = [
+        "<|begin_of_box|>", "<|end_of_box|>",
+        "<|begin_of_text|>", "<|end_of_text|>",
+        "<|begin_of_list|>", "<|end_of_list|>",
+        "<|begin_of_attribute|>", "<|end_of_attribute|>"
+    ]
+    cleaned_text = text
+    for tag in tags_to_remove:
+        cleaned_text = cleaned_text.replace(tag, "")
+    cleaned_text = re.sub(r'^\s*\|\|\s*', '', cleaned_text)
+    cleaned_text = re.sub(r'^\s*\|\s*', '', cleaned_text)
+    cleaned_text = re.sub(r'\s*\|\|\s*$', '', cleaned_text)
+    cleaned_text = re.sub(r'\s*\|\s*$', '', cleaned_text)
+    return cleaned_text
+
+
+def _make_chunks(tokens, rnd):
+    """生成一个约tokens个分片的回复，特殊标记有一半被拆到两个分片中"""
+    chunks = ["||"]
+    while len(chunks) < tokens:
+        if rnd.random() < 0.02:
+            tag = rnd.choice(_TAGS)
+            if rnd.random() < 0.5:
+                cut = rnd.randint(1, len(tag) - 1)
+                chunks.extend([tag[:cut], tag[cut:]])
+            else:
+                chunks.append(tag)
+        else:
+            chunks.append(rnd.choice(_WORDS))
+    chunks.append(" |")
+    return chunks
+
+
+def _legacy(chunks):
+    """返回(清理后的文本, 最后一个分片到达后的耗时)"""
+    collected_content = ""
+    for chunk in chunks:
+        collected_content += chunk
+    started = time.perf_counter()
+    content = _legacy_clean(_legacy_clean(collected_content))
+    return content, time.perf_counter() - started
+
+
+def _streaming(chunks):
+    """返回(清理后的文本, 最后一个分片到达后的耗时)"""
+    cleaner = StreamingTagCleaner()
+    collected_content = []
+    for chunk in chunks:
+        collected_content.append(cleaner.feed(chunk))
+    started = time.perf_counter()
+    collected_content.append(cleaner.flush())
+    content = "".join(collected_content)
+    return content, time.perf_counter() - started
+
+
+def _best_of(fn, chunks, repeat):
+    """返回重复repeat次中最快的(总耗时, 最后一个分片到达后的耗时)"""
+    best_total = best_finish = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        _, finish = fn(chunks)
+        best_total = min(best_total, time.perf_counter() - started)
+        best_finish = min(best_finish, finish)
+    return best_total, best_finish
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, nargs="+", default=[2000, 5000, 20000], help="回复的分片数")
+    parser.add_argument("--repeat", type=int, default=20, help="每种方式的重复次数（取最快一次）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    print("耗时单位为毫秒；结束耗时为最后一个分片到达后到得到完整结果的时间")
+    print(f"{'分片数':>8} {'字符数':>8} {'原实现总耗时':>12} {'原实现结束耗时':>14} {'流式总耗时':>10} {'流式结束耗时':>12}")
+    for tokens in args.tokens:
+        chunks = _make_chunks(tokens, rnd)
+        expected, _ = _legacy(chunks)
+        assert _streaming(chunks)[0] == expected, "流式清理结果与原实现不一致"
+
+        legacy_total, legacy_finish = _best_of(_legacy, chunks, args.repeat)
+        streaming_total, streaming_finish = _best_of(_streaming, chunks, args.repeat)
+        print(f"{len(chunks):>8} {len(expected):>8} {legacy_total * 1000:>18.2f} {legacy_finish * 1000:>20.3f} "
+              f"{streaming_total * 1000:>15.2f} {streaming_finish * 1000:>18.3f}")
+
+
+if __name__ == "__main__":
+    main()
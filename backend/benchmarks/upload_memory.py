@@ -0,0 +1,177 @@
+"""
+并发上传大幅GeoTIFF时API进程内存的基准测试
+
+生成一个约100MB的GeoTIFF，通过/api/analyze/image并发上传N次，请求体从文件分块流式发送。
+上传过程中在后台线程中每10毫秒读取一次本进程的常驻内存（/proc/self/status中的VmRSS），
+报告上传前的内存和上传过程中的峰值。上传分块写入磁盘时，峰值增长与并发数和文件大小无关。
+
+加上--legacy时改为测量原实现的读取方式（await file.read()把整个文件读入内存后再写入磁盘）作为对比。
+
+只测量上传处理：不提交Celery分析任务，标准化图像仍在进程池中生成（不计入API进程内存）。
+数据库、上传目录和派生文件目录使用临时目录，需要Linux（/proc）。
+
+用法（在backend目录下运行）:
+    python -m benchmarks.upload_memory --uploads 8 --size-mb 100
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+
+
+def _rss_mb():
+    """本进程当前的常驻内存（MB）"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError("无法读取VmRSS")
+
+
+class _RssSampler(threading.Thread):
+    """后台线程定期采样常驻内存，记录峰值"""
+
+    def __init__(self, interval=0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = _rss_mb()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self.peak = max(self.peak, _rss_mb())
+            time.sleep(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self.peak = max(self.peak, _rss_mb())
+
+
+def _configure(args, workdir):
+    """在导入应用之前设置环境变量"""
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "UPLOAD_FOLDER": os.path.join(workdir, "uploads"),
+        "DERIVED_FOLDER": os.path.join(workdir, "derived"),
+        "MAX_CONTENT_LENGTH": str((args.size_mb + 16) * 1024 * 1024),
+    })
+
+
+def _write_geotiff(path, size_mb):
+    """按行窗口写入一个约size_mb MB的三波段GeoTIFF（不压缩），不在内存中生成整幅图像"""
+    import numpy as np
+    import rasterio
+    from rasterio.transform import from_origin
+    from rasterio.windows import Window
+
+    side = int((size_mb * 1024 * 1024 / 3) ** 0.5)
+    profile = {
+        "driver": "GTiff", "width": side, "height": side, "count": 3, "dtype": "uint8",
+        "crs": "EPSG:4326", "transform": from_origin(117.0, 36.2, 1e-5, 1e-5), "tiled": True,
+    }
+    rng = np.random.default_rng(0)
+    with rasterio.open(path, "w", **profile) as dst:
+        for row in range(0, side, 256):
+            height = min(256, side - row)
+            dst.write(rng.integers(0, 256, (3, height, side), dtype=np.uint8), window=Window(0, row, side, height))
+    return os.path.getsize(path)
+
+
+def _prepare(legacy):
+    """返回(应用, 上传接口路径)"""
+    from fastapi import File, UploadFile
+
+    import main
+    from app.api.api_v1.endpoints import analyze
+    from app.api.api_v1.endpoints.users import get_current_user
+    from app.core.config import UPLOAD_FOLDER
+    from app.db.database import Base, SessionLocal, engine
+    from app.db.models import User
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user = User(id="bench-user", username="bench")
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    db.expunge(user)
+    db.close()
+    main.app.dependency_overrides[get_current_user] = lambda: user
+
+    # 只测量上传处理，不提交Celery任务
+    class _NoTask:
+        @staticmethod
+        def delay(*args, **kwargs):
+            return None
+
+    analyze.process_image_task = _NoTask
+
+    if not legacy:
+        return main.app, "/api/analyze/image"
+
+    @main.app.post("/bench/legacy-upload")
+    async def legacy_upload(file: UploadFile = File(...)):
+        # 原实现：把整个文件读入内存，再计算哈希并写入磁盘
+        contents = await file.read()
+        sha256 = hashlib.sha256(contents).hexdigest()
+        with open(os.path.join(UPLOAD_FOLDER, f"{sha256}.tif"), "wb") as f:
+            f.write(contents)
+        return {"sha256": sha256}
+
+    return main.app, "/bench/legacy-upload"
+
+
+async def _upload_all(app, path, tif_path, count):
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def upload(index):
+            with open(tif_path, "rb") as f:
+                response = await client.post(
+                    path,
+                    data={"prompt": f"分析这幅遥感图像（{index}）"},
+                    files={"file": ("scene.tif", f, "image/tiff")},
+                )
+            response.raise_for_status()
+
+        await asyncio.gather(*[upload(index) for index in range(count)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=8, help="并发上传数")
+    parser.add_argument("--size-mb", type=int, default=100, help="GeoTIFF大小（MB）")
+    parser.add_argument("--legacy", action="store_true", help="测量原实现的读取方式作为对比")
+    args = parser.parse_args()
+
+    if not os.path.exists("/proc/self/status"):
+        sys.exit("需要Linux（/proc/self/status）")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        _configure(args, workdir)
+        tif_path = os.path.join(workdir, "scene.tif")
+        size = _write_geotiff(tif_path, args.size_mb)
+        app, path = _prepare(args.legacy)
+
+        baseline = _rss_mb()
+        sampler = _RssSampler()
+        sampler.start()
+        started = time.perf_counter()
+        asyncio.run(_upload_all(app, path, tif_path, args.uploads))
+        elapsed = time.perf_counter() - started
+        sampler.stop()
+
+    mode = "原实现（整个文件读入内存）" if args.legacy else "/api/analyze/image"
+    print(f"上传方式:     {mode}")
+    print(f"并发上传:     {args.uploads} x {size / 1024 / 1024:.1f} MB，耗时 {elapsed:.1f} s")
+    print(f"常驻内存:     上传前 {baseline:.0f} MB，峰值 {sampler.peak:.0f} MB，增长 {sampler.peak - baseline:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import os
 
-from app.core.config import API_PREFIX, CORS_ORIGINS, UPLOAD_FOLDER
+from app.core.config import API_PREFIX, CORS_ORIGINS, UPLOAD_FOLDER, MAX_CONTENT_LENGTH
 from app.api.api_v1.api import api_router
+from app.services.image_pipeline import shutdown_pool
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -33,8 +34,8 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response
-from starlette.types import ASGIApp
+from starlette.responses import Response, JSONResponse
+from starlette.types import ASGIApp, Scope, Receive, Send
 
 # 自定义中间件，为静态文件添加CORS头
 class CORSStaticFilesMiddleware(BaseHTTPMiddleware):
@@ -50,12 +51,76 @@ class CORSStaticFilesMiddleware(BaseHTTPMiddleware):
             
         return response
 
+# 请求体大小上限：上传文件上限加上表单其他字段的余量
+MAX_REQUEST_BODY_SIZE = MAX_CONTENT_LENGTH + 1024 * 1024
+
+class _RequestBodyTooLarge(Exception):
+    """分块传输的请求体超过大小上限"""
+
+# 自定义中间件，在读取请求体之前拒绝超过大小上限的请求
+class RequestSizeLimitMiddleware:
+    def __init__(self, app: ASGIApp, max_body_size: int = MAX_REQUEST_BODY_SIZE):
+        self.app = app
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"请求体大小超过限制（{MAX_CONTENT_LENGTH // (1024 * 1024)}MB）"
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_body_size:
+            response = JSONResponse({"detail": detail}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        # 没有Content-Length（分块传输）时边接收边计数。超过上限时由中间件直接返回413：
+        # receive中抛出的异常经过BaseHTTPMiddleware后会被表单解析转换为400，所以之后应用发送的响应都被丢弃
+        received = 0
+        response_started = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    if not response_started and not rejected:
+                        rejected = True
+                        await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+                    raise _RequestBodyTooLarge()
+            return message
+
+        async def tracked_send(message):
+            nonlocal response_started
+            if rejected:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except _RequestBodyTooLarge:
+            if not rejected:
+                raise
+
 # 挂载静态文件服务，用于访问上传的图像
 app.mount(f"{API_PREFIX}/uploads", StaticFiles(directory=UPLOAD_FOLDER), name="uploads")
 
 # 添加静态文件CORS中间件
 app.add_middleware(CORSStaticFilesMiddleware)
 
+# 添加请求体大小限制中间件
+app.add_middleware(RequestSizeLimitMiddleware)
+
+@app.on_event("shutdown")
+def shutdown_image_pool():
+    # 关闭图像处理进程池
+    shutdown_pool()
+
 @app.get("/")
 async def root():
     return {"message": "欢迎使用遥感图像分析API"}
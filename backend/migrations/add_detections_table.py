@@ -0,0 +1,134 @@
+"""
+数据库迁移脚本 - 添加检测结果表和R*Tree空间索引，并从已有消息的object_coordinates中导入检测框
+"""
+import json
+import os
+import sqlite3
+import sys
+
+from PIL import Image
+
+# 使用与应用相同的解析器（在backend目录下运行）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.utils.detection_parser import parse_detections
+
+# 与app/core/config.py中的UPLOAD_FOLDER和DERIVED_FOLDER一致
+UPLOAD_FOLDER = os.path.join("app", os.getenv("UPLOAD_FOLDER", "uploads"))
+DERIVED_FOLDER = os.path.join("app", os.getenv("DERIVED_FOLDER", "derived"))
+
+def image_size(image_path):
+    """上传图像的原始尺寸，优先读取标准化时保存的元数据"""
+    filename = os.path.basename(image_path.replace("/api/uploads/", ""))
+    meta_path = os.path.join(DERIVED_FOLDER, f"{os.path.splitext(filename)[0]}.meta.json")
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return meta["original_width"], meta["original_height"]
+    except (OSError, ValueError, KeyError):
+        pass
+    try:
+        with Image.open(os.path.join(UPLOAD_FOLDER, filename)) as image:
+            return image.size
+    except Exception:
+        return None
+
+def run_migration():
+    print("开始运行迁移脚本...")
+
+    # 连接到SQLite数据库
+    conn = sqlite3.connect('yaogan_chat.db')
+    cursor = conn.cursor()
+
+    try:
+        # 创建detections表
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS detections (
+                id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+                message_id VARCHAR REFERENCES messages (id),
+                chat_id VARCHAR REFERENCES chats (id),
+                label VARCHAR,
+                x1 FLOAT,
+                y1 FLOAT,
+                x2 FLOAT,
+                y2 FLOAT,
+                pixel_x1 FLOAT,
+                pixel_y1 FLOAT,
+                pixel_x2 FLOAT,
+                pixel_y2 FLOAT
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_detections_message_id ON detections (message_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_detections_chat_id ON detections (chat_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_detections_label ON detections (label)")
+
+        # 创建R*Tree空间索引和同步触发器（与app/db/models.py中的DETECTIONS_RTREE_DDL一致）
+        print("创建R*Tree空间索引...")
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS detections_rtree USING rtree(id, min_x, max_x, min_y, max_y)")
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS detections_rtree_insert AFTER INSERT ON detections BEGIN
+                INSERT INTO detections_rtree VALUES (new.id, new.x1, new.x2, new.y1, new.y2);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS detections_rtree_update AFTER UPDATE OF x1, y1, x2, y2 ON detections BEGIN
+                UPDATE detections_rtree SET min_x = new.x1, max_x = new.x2, min_y = new.y1, max_y = new.y2 WHERE id = new.id;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS detections_rtree_delete AFTER DELETE ON detections BEGIN
+                DELETE FROM detections_rtree WHERE id = old.id;
+            END
+        """)
+
+        # 导入尚未导入的消息中的检测框（可重复执行）
+        print("导入已有消息中的检测框...")
+        cursor.execute("""
+            SELECT id, chat_id, object_coordinates, timestamp FROM messages
+            WHERE object_coordinates IS NOT NULL AND object_coordinates != ''
+              AND id NOT IN (SELECT DISTINCT message_id FROM detections)
+        """)
+        imported = 0
+        for message_id, chat_id, object_coordinates, timestamp in cursor.fetchall():
+            detections = parse_detections(object_coordinates)
+            if not detections:
+                continue
+
+            # 检测框对应该消息之前最近上传的图像
+            cursor.execute("""
+                SELECT image_path FROM messages
+                WHERE chat_id = ? AND sender = 'system' AND image_path IS NOT NULL AND timestamp <= ?
+                ORDER BY timestamp DESC LIMIT 1
+            """, (chat_id, timestamp))
+            row = cursor.fetchone()
+            size = image_size(row[0]) if row else None
+
+            for detection in detections:
+                x1, y1, x2, y2 = detection["bbox"]
+                pixel = [x1 * size[0], y1 * size[1], x2 * size[0], y2 * size[1]] if size else [None] * 4
+                cursor.execute(
+                    "INSERT INTO detections (message_id, chat_id, label, x1, y1, x2, y2, "
+                    "pixel_x1, pixel_y1, pixel_x2, pixel_y2) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (message_id, chat_id, detection["label"], x1, y1, x2, y2, *pixel)
+                )
+                imported += 1
+        print(f"导入了 {imported} 个检测框")
+
+        # 提交更改
+        conn.commit()
+        print("迁移完成!")
+        return True
+
+    except Exception as e:
+        # 回滚更改
+        conn.rollback()
+        print(f"迁移失败: {e}")
+        return False
+
+    finally:
+        # 关闭连接
+        cursor.close()
+        conn.close()
+
+if __name__ == "__main__":
+    # 失败时以非零状态退出，start.sh据此停止启动
+    sys.exit(0 if run_migration() else 1)
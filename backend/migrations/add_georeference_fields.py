@@ -0,0 +1,113 @@
+"""
+数据库迁移脚本 - 为上传文件添加尺寸和地理参考字段，为检测结果添加所属上传图像字段
+"""
+import json
+import os
+import sqlite3
+import sys
+
+# 使用与应用相同的栅格读取函数（在backend目录下运行）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.utils.raster_utils import read_georeference
+
+# 依赖的迁移脚本（与本脚本在同一目录）
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import add_detections_table
+import add_uploads_table
+
+# 与app/core/config.py中的UPLOAD_FOLDER一致
+UPLOAD_FOLDER = os.path.join("app", os.getenv("UPLOAD_FOLDER", "uploads"))
+
+def table_exists(name):
+    conn = sqlite3.connect('yaogan_chat.db')
+    try:
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+    finally:
+        conn.close()
+
+def run_migration():
+    # 先创建依赖的uploads表和detections表，不依赖脚本的执行顺序
+    if not table_exists("uploads"):
+        print("uploads表不存在，先运行add_uploads_table.py")
+        if not add_uploads_table.run_migration():
+            return False
+    if not table_exists("detections"):
+        print("detections表不存在，先运行add_detections_table.py")
+        if not add_detections_table.run_migration():
+            return False
+
+    print("开始运行迁移脚本...")
+
+    # 连接到SQLite数据库
+    conn = sqlite3.connect('yaogan_chat.db')
+    cursor = conn.cursor()
+
+    try:
+        # 检查uploads表中已有的列
+        cursor.execute("PRAGMA table_info(uploads)")
+        columns = [column[1] for column in cursor.fetchall()]
+
+        for name, column_type in (("width", "INTEGER"), ("height", "INTEGER"), ("crs", "TEXT"), ("transform", "VARCHAR")):
+            if name not in columns:
+                print(f"添加uploads.{name}列...")
+                cursor.execute(f"ALTER TABLE uploads ADD COLUMN {name} {column_type}")
+
+        # 读取已有上传图像的尺寸和地理参考
+        print("读取已有上传图像的地理参考...")
+        cursor.execute("SELECT sha256, filename FROM uploads WHERE width IS NULL")
+        for sha256, filename in cursor.fetchall():
+            try:
+                georeference = read_georeference(os.path.join(UPLOAD_FOLDER, filename))
+            except Exception as e:
+                print(f"跳过 {filename}: {e}")
+                continue
+            transform = json.dumps(georeference["transform"]) if georeference["transform"] else None
+            cursor.execute(
+                "UPDATE uploads SET width = ?, height = ?, crs = ?, transform = ? WHERE sha256 = ?",
+                (georeference["width"], georeference["height"], georeference["crs"], transform, sha256)
+            )
+            if transform:
+                print(f"{filename}: 已读取地理参考")
+
+        cursor.execute("PRAGMA table_info(detections)")
+        columns = [column[1] for column in cursor.fetchall()]
+        if 'upload_filename' not in columns:
+            print("添加detections.upload_filename列...")
+            cursor.execute("ALTER TABLE detections ADD COLUMN upload_filename VARCHAR")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_detections_upload_filename ON detections (upload_filename)")
+
+        # 检测框对应该消息之前最近上传的图像（可重复执行）
+        print("更新检测结果所属的上传图像...")
+        cursor.execute("""
+            UPDATE detections SET upload_filename = (
+                SELECT replace(images.image_path, '/api/uploads/', '')
+                FROM messages AS images, messages AS answers
+                WHERE answers.id = detections.message_id
+                  AND images.chat_id = answers.chat_id
+                  AND images.sender = 'system'
+                  AND images.image_path IS NOT NULL
+                  AND images.timestamp <= answers.timestamp
+                ORDER BY images.timestamp DESC LIMIT 1
+            )
+            WHERE upload_filename IS NULL
+        """)
+
+        # 提交更改
+        conn.commit()
+        print("迁移完成!")
+        return True
+
+    except Exception as e:
+        # 回滚更改
+        conn.rollback()
+        print(f"迁移失败: {e}")
+        return False
+
+    finally:
+        # 关闭连接
+        cursor.close()
+        conn.close()
+
+if __name__ == "__main__":
+    # 失败时以非零状态退出，start.sh据此停止启动
+    sys.exit(0 if run_migration() else 1)
@@ -2,6 +2,7 @@
 数据库迁移脚本 - 添加物体标记相关字段
 """
 import sqlite3
+import sys
 
 def run_migration():
     print("开始运行迁移脚本...")
@@ -26,11 +27,13 @@ def run_migration():
         # 提交更改
         conn.commit()
         print("迁移完成!")
+        return True
         
     except Exception as e:
         # 回滚更改
         conn.rollback()
         print(f"迁移失败: {e}")
+        return False
         
     finally:
         # 关闭连接
@@ -38,4 +41,5 @@ def run_migration():
         conn.close()
 
 if __name__ == "__main__":
-    run_migration()
+    # 失败时以非零状态退出，start.sh据此停止启动
+    sys.exit(0 if run_migration() else 1)
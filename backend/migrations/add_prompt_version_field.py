@@ -0,0 +1,41 @@
+"""
+数据库迁移脚本 - 添加提示模板版本字段
+"""
+import sqlite3
+import sys
+
+def run_migration():
+    print("开始运行迁移脚本...")
+    
+    # 连接到SQLite数据库
+    conn = sqlite3.connect('yaogan_chat.db')
+    cursor = conn.cursor()
+    
+    try:
+        # 检查是否已存在prompt_version列
+        cursor.execute("PRAGMA table_info(messages)")
+        columns = [column[1] for column in cursor.fetchall()]
+        
+        if 'prompt_version' not in columns:
+            print("添加prompt_version列...")
+            cursor.execute("ALTER TABLE messages ADD COLUMN prompt_version TEXT")
+        
+        # 提交更改
+        conn.commit()
+        print("迁移完成!")
+        return True
+        
+    except Exception as e:
+        # 回滚更改
+        conn.rollback()
+        print(f"迁移失败: {e}")
+        return False
+        
+    finally:
+        # 关闭连接
+        cursor.close()
+        conn.close()
+
+if __name__ == "__main__":
+    # 失败时以非零状态退出，start.sh据此停止启动
+    sys.exit(0 if run_migration() else 1)
@@ -0,0 +1,104 @@
+"""
+数据库迁移脚本 - 添加上传文件表，把已有上传文件改为按内容哈希保存
+"""
+import hashlib
+import os
+import sqlite3
+import sys
+
+# 与app/core/config.py中的UPLOAD_FOLDER一致
+UPLOAD_FOLDER = os.path.join("app", os.getenv("UPLOAD_FOLDER", "uploads"))
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def run_migration():
+    print("开始运行迁移脚本...")
+
+    # 连接到SQLite数据库
+    conn = sqlite3.connect('yaogan_chat.db')
+    cursor = conn.cursor()
+    renamed = []
+    duplicates = []
+
+    try:
+        # 创建uploads表
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS uploads (
+                sha256 VARCHAR NOT NULL PRIMARY KEY,
+                filename VARCHAR UNIQUE,
+                size INTEGER,
+                ref_count INTEGER,
+                created_at DATETIME
+            )
+        """)
+
+        # 把消息引用的旧文件（{task_id}{ext}）重命名为{sha256}{ext}，相同内容只保留一份
+        cursor.execute("SELECT DISTINCT image_path FROM messages WHERE image_path LIKE '/api/uploads/%'")
+        for (image_path,) in cursor.fetchall():
+            filename = os.path.basename(image_path.replace("/api/uploads/", ""))
+            path = os.path.join(UPLOAD_FOLDER, filename)
+            cursor.execute("SELECT 1 FROM uploads WHERE filename = ?", (filename,))
+            if cursor.fetchone() or not os.path.isfile(path):
+                continue
+
+            sha256 = file_sha256(path)
+            cursor.execute("SELECT filename FROM uploads WHERE sha256 = ?", (sha256,))
+            row = cursor.fetchone()
+            if row:
+                new_filename = row[0]
+            else:
+                new_filename = f"{sha256}{os.path.splitext(filename)[1].lower()}"
+                cursor.execute(
+                    "INSERT INTO uploads (sha256, filename, size, ref_count, created_at) VALUES (?, ?, ?, 0, datetime('now'))",
+                    (sha256, new_filename, os.path.getsize(path))
+                )
+
+            new_path = os.path.join(UPLOAD_FOLDER, new_filename)
+            if os.path.exists(new_path):
+                # 重复的文件在提交后再删除
+                duplicates.append(path)
+            else:
+                os.rename(path, new_path)
+                renamed.append((path, new_path))
+            cursor.execute(
+                "UPDATE messages SET image_path = ? WHERE image_path = ?",
+                (f"/api/uploads/{new_filename}", image_path)
+            )
+            print(f"{filename} -> {new_filename}")
+
+        # 按消息重新计算引用计数（可重复执行）
+        print("更新引用计数...")
+        cursor.execute("""
+            UPDATE uploads SET ref_count = (
+                SELECT COUNT(*) FROM messages WHERE messages.image_path = '/api/uploads/' || uploads.filename
+            )
+        """)
+
+        # 提交更改
+        conn.commit()
+        for path in duplicates:
+            os.remove(path)
+        print("迁移完成!")
+        return True
+
+    except Exception as e:
+        # 回滚更改
+        conn.rollback()
+        for path, new_path in reversed(renamed):
+            os.rename(new_path, path)
+        print(f"迁移失败: {e}")
+        return False
+
+    finally:
+        # 关闭连接
+        cursor.close()
+        conn.close()
+
+if __name__ == "__main__":
+    # 失败时以非零状态退出，start.sh据此停止启动
+    sys.exit(0 if run_migration() else 1)
@@ -0,0 +1,39 @@
+"""
+迁移脚本 - 把派生文件目录从公开的上传目录（uploads/derived）移到app/derived
+"""
+import os
+import shutil
+import sys
+
+# 与app/core/config.py中的UPLOAD_FOLDER和DERIVED_FOLDER一致
+UPLOAD_FOLDER = os.path.join("app", os.getenv("UPLOAD_FOLDER", "uploads"))
+DERIVED_FOLDER = os.path.join("app", os.getenv("DERIVED_FOLDER", "derived"))
+OLD_DERIVED_FOLDER = os.path.join(UPLOAD_FOLDER, "derived")
+
+def run_migration():
+    print("开始运行迁移脚本...")
+
+    try:
+        if not os.path.isdir(OLD_DERIVED_FOLDER):
+            print("上传目录中没有派生文件目录，跳过")
+        elif not os.path.exists(DERIVED_FOLDER) or not os.listdir(DERIVED_FOLDER):
+            # 新目录不存在或为空（服务启动时会创建空目录），整体移动
+            print(f"移动 {OLD_DERIVED_FOLDER} -> {DERIVED_FOLDER}...")
+            if os.path.isdir(DERIVED_FOLDER):
+                os.rmdir(DERIVED_FOLDER)
+            shutil.move(OLD_DERIVED_FOLDER, DERIVED_FOLDER)
+        else:
+            # 新目录中已有文件，派生文件都可以重新生成，直接删除公开目录中的旧文件
+            print(f"删除 {OLD_DERIVED_FOLDER}...")
+            shutil.rmtree(OLD_DERIVED_FOLDER)
+
+        print("迁移完成!")
+        return True
+
+    except Exception as e:
+        print(f"迁移失败: {e}")
+        return False
+
+if __name__ == "__main__":
+    # 失败时以非零状态退出，start.sh据此停止启动
+    sys.exit(0 if run_migration() else 1)
@@ -21,6 +21,22 @@ sleep 2
 if [ ! -f yaogan_chat.db ]; then
     echo "初始化数据库..."
     python init_db.py
+else
+    # 已有数据库时补充新增的字段（迁移脚本可重复执行，按依赖顺序列出，新脚本加在末尾）
+    echo "运行数据库迁移..."
+    for migration in \
+        add_object_mark_fields \
+        add_prompt_version_field \
+        add_uploads_table \
+        move_derived_folder \
+        add_detections_table \
+        add_georeference_fields; do
+        python "migrations/$migration.py"
+        if [ $? -ne 0 ]; then
+            echo "数据库迁移 $migration 失败，请检查错误信息"
+            exit 1
+        fi
+    done
 fi
 
 # 启动FastAPI服务器
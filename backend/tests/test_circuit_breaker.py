@@ -0,0 +1,149 @@
+import pytest
+
+from app.services import circuit_breaker as circuit_breaker_module
+from app.services.circuit_breaker import (
+    RESULT_FAILURE, RESULT_IGNORED, RESULT_SUCCESS, STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN,
+    CircuitBreakerRegistry, CircuitOpenError, ModelCircuitBreaker
+)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(circuit_breaker_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def _breaker(model="m", **kwargs):
+    options = {"window": 10, "min_samples": 4, "error_threshold": 0.5, "slow_seconds": 1.0,
+               "slow_threshold": 0.5, "open_seconds": 30.0, "half_open_probes": 1}
+    options.update(kwargs)
+    return ModelCircuitBreaker(model, **options)
+
+
+def _call(breaker, result=RESULT_SUCCESS, latency=0.1):
+    allowed, probe = breaker.try_acquire()
+    assert allowed
+    breaker.record(result, latency, probe)
+
+
+def _open(breaker):
+    for _ in range(breaker.min_samples):
+        _call(breaker, RESULT_FAILURE)
+    assert breaker.state == STATE_OPEN
+
+
+def test_opens_on_error_rate(clock):
+    breaker = _breaker()
+    # 样本数不足时不判断
+    for _ in range(3):
+        _call(breaker, RESULT_FAILURE)
+    assert breaker.state == STATE_CLOSED
+    _call(breaker, RESULT_SUCCESS)
+    # 3/4失败，超过阈值
+    assert breaker.state == STATE_OPEN
+    assert breaker.try_acquire() == (False, False)
+
+
+def test_stays_closed_at_error_threshold(clock):
+    breaker = _breaker()
+    for result in (RESULT_FAILURE, RESULT_SUCCESS, RESULT_FAILURE, RESULT_SUCCESS, RESULT_IGNORED):
+        _call(breaker, result)
+    assert breaker.state == STATE_CLOSED
+
+
+def test_opens_on_slow_rate(clock):
+    breaker = _breaker()
+    for latency in (2.0, 0.1, 2.0, 2.0):
+        _call(breaker, RESULT_SUCCESS, latency)
+    assert breaker.state == STATE_OPEN
+    assert breaker.stats()["opens"] == 1
+
+
+def test_half_open_after_open_seconds(clock):
+    breaker = _breaker()
+    _open(breaker)
+    clock[0] += 29.0
+    assert breaker.try_acquire() == (False, False)
+    clock[0] += 1.0
+    assert breaker.try_acquire() == (True, True)
+    assert breaker.state == STATE_HALF_OPEN
+
+
+def test_half_open_probe_limit(clock):
+    breaker = _breaker(half_open_probes=2)
+    _open(breaker)
+    clock[0] += 30.0
+    assert breaker.try_acquire() == (True, True)
+    assert breaker.try_acquire() == (True, True)
+    assert breaker.try_acquire() == (False, False)
+    # 被忽略的探测（例如用户取消）归还名额，状态不变
+    breaker.record(RESULT_IGNORED, 0.1, True)
+    assert breaker.state == STATE_HALF_OPEN
+    assert breaker.try_acquire() == (True, True)
+
+
+def test_successful_probe_closes(clock):
+    breaker = _breaker()
+    _open(breaker)
+    clock[0] += 30.0
+    allowed, probe = breaker.try_acquire()
+    breaker.record(RESULT_SUCCESS, 0.1, probe)
+    assert breaker.state == STATE_CLOSED
+    assert breaker.try_acquire() == (True, False)
+
+
+@pytest.mark.parametrize("result, latency", [(RESULT_FAILURE, 0.1), (RESULT_SUCCESS, 2.0)])
+def test_failed_or_slow_probe_reopens(clock, result, latency):
+    breaker = _breaker()
+    _open(breaker)
+    clock[0] += 30.0
+    allowed, probe = breaker.try_acquire()
+    breaker.record(result, latency, probe)
+    assert breaker.state == STATE_OPEN
+    assert breaker.opens == 2
+    assert breaker.try_acquire() == (False, False)
+    clock[0] += 30.0
+    assert breaker.try_acquire() == (True, True)
+
+
+def _registry(fallbacks):
+    registry = CircuitBreakerRegistry(enabled=True, fallbacks=fallbacks)
+    for model in ("primary", "backup"):
+        registry._breakers[model] = _breaker(model)
+    return registry
+
+
+def test_registry_routes_to_fallback(clock):
+    registry = _registry({"primary": "backup"})
+    _open(registry._breakers["primary"])
+
+    model, permit = registry.acquire("primary")
+    assert model == "backup"
+    assert permit == (registry._breakers["backup"], False)
+    registry.release(permit, RESULT_SUCCESS, 0.1)
+    assert registry._breakers["primary"].stats()["fallbacks"] == 1
+    assert registry._breakers["primary"].stats()["rejected"] == 1
+
+    # 熔断结束后的探测请求回到原模型
+    clock[0] += 30.0
+    model, permit = registry.acquire("primary")
+    assert (model, permit[1]) == ("primary", True)
+
+
+def test_registry_raises_without_available_fallback(clock):
+    registry = _registry({"primary": "backup"})
+    _open(registry._breakers["primary"])
+    _open(registry._breakers["backup"])
+    with pytest.raises(CircuitOpenError):
+        registry.acquire("primary")
+
+    registry = _registry({})
+    _open(registry._breakers["primary"])
+    with pytest.raises(CircuitOpenError):
+        registry.acquire("primary")
+
+
+def test_registry_disabled():
+    registry = CircuitBreakerRegistry(enabled=False, fallbacks={})
+    assert registry.acquire("primary") == ("primary", None)
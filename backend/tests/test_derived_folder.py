@@ -0,0 +1,39 @@
+import os
+
+from fastapi.testclient import TestClient
+
+import main
+from app.core.config import ARTIFACT_FOLDER, DERIVED_FOLDER, MAP_TILE_FOLDER, UPLOAD_FOLDER
+
+
+def _assert_not_public(folder):
+    # main.py用StaticFiles公开挂载UPLOAD_FOLDER，其中的文件不需要登录就能下载
+    upload_folder = os.path.realpath(UPLOAD_FOLDER)
+    assert os.path.commonpath([upload_folder, os.path.realpath(folder)]) != upload_folder
+
+
+def test_derived_folder_is_not_publicly_mounted():
+    _assert_not_public(DERIVED_FOLDER)
+
+
+def test_payload_refs_are_not_publicly_mounted():
+    # 引用文件在DERIVED_FOLDER中，载荷在ARTIFACT_FOLDER中
+    _assert_not_public(ARTIFACT_FOLDER)
+
+
+def test_pyramids_and_tiles_are_not_publicly_mounted():
+    # 金字塔影像在DERIVED_FOLDER中，只能通过/api/tiles（带ETag）读取
+    _assert_not_public(MAP_TILE_FOLDER)
+
+
+def test_derived_files_are_not_served():
+    name = "test-derived-folder.meta.json"
+    path = os.path.join(DERIVED_FOLDER, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{}")
+    try:
+        client = TestClient(main.app)
+        assert client.get(f"/api/uploads/derived/{name}").status_code == 404
+        assert client.get(f"/api/uploads/../derived/{name}").status_code == 404
+    finally:
+        os.remove(path)
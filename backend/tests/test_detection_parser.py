@@ -0,0 +1,121 @@
+import gc
+import json
+import random
+import time
+
+import pytest
+
+from app.utils.detection_parser import (
+    IncrementalDetectionScanner,
+    iter_json_values,
+    normalize_bbox,
+    parse_detections,
+)
+
+# 随机输入使用的字符：括号、引号、转义符和JSON中的常见字符
+_ALPHABET = '{}[]"\\ ,:.-01a\n'
+
+
+def test_parse_objects_in_text_and_code_block():
+    text = (
+        '图中有两艘船：{"label": "船", "bbox": [0.1, 0.2, 0.3, 0.4]}\n'
+        '```json\n[{"label": "车", "bbox": [100, 200, 300, 400]}]\n```'
+    )
+    assert parse_detections(text) == [
+        {"label": "船", "bbox": [0.1, 0.2, 0.3, 0.4]},
+        {"label": "车", "bbox": [0.1, 0.2, 0.3, 0.4]},
+    ]
+
+
+def test_complete_objects_inside_unbalanced_text():
+    text = '{"objects": [{"label": "船", "bbox": [0.1, 0.1, 0.2, 0.2]}, {"label": "车", "bbox": [0.3'
+    assert parse_detections(text) == [{"label": "船", "bbox": [0.1, 0.1, 0.2, 0.2]}]
+
+
+def test_normalize_bbox_conventions():
+    # 0-1相对坐标、0-1000归一化坐标，左上角在前
+    assert normalize_bbox([0.3, 0.4, 0.1, 0.2]) == [0.1, 0.2, 0.3, 0.4]
+    assert normalize_bbox([100, 200, 300, 400]) == [0.1, 0.2, 0.3, 0.4]
+    assert normalize_bbox([100, 200, 300, 400], (800, 600)) == [0.1, 0.2, 0.3, 0.4]
+    # 超过1000像素的图像上，整数坐标即使都不超过1000也按像素坐标换算
+    assert normalize_bbox([400, 300, 800, 600], (4000, 3000)) == [0.1, 0.1, 0.2, 0.2]
+    assert normalize_bbox([2000, 1500, 4000, 3000], (4000, 3000)) == [0.5, 0.5, 1.0, 1.0]
+    assert normalize_bbox([2000, 1500, 4000, 3000]) is None
+    assert normalize_bbox([0.1, 0.2, 0.3]) is None
+    assert normalize_bbox([True, 0, 1, 1]) is None
+
+
+@pytest.mark.parametrize("text", [
+    "[" * 1500 + "]" * 1500,
+    "{" * 5000,
+    '{"a":' + "[" * 1000 + "]" * 1000 + "}",
+    '{"label": "船", "bbox": ' + "[" * 2000 + "]" * 2000 + "}",
+])
+def test_deep_nesting_does_not_raise(text):
+    assert parse_detections(text) == []
+    assert IncrementalDetectionScanner().feed(text) == []
+
+
+def test_random_input_never_raises():
+    rng = random.Random(0)
+    for _ in range(3000):
+        text = "".join(rng.choice(_ALPHABET) for _ in range(rng.randint(0, 200)))
+        for value in iter_json_values(text):
+            # 取出的都是能完整解析的JSON值
+            json.dumps(value)
+        parse_detections(text, image_size=(rng.randint(1, 5000), rng.randint(1, 5000)))
+
+        scanner = IncrementalDetectionScanner()
+        position = 0
+        while position < len(text):
+            size = rng.randint(1, 16)
+            scanner.feed(text[position:position + size])
+            position += size
+
+
+def test_random_detections_survive_noise():
+    rng = random.Random(1)
+    for _ in range(200):
+        expected = []
+        parts = []
+        for index in range(rng.randint(1, 5)):
+            x1, y1 = rng.randint(0, 500) / 1000, rng.randint(0, 500) / 1000
+            detection = {"label": f"物体{index}", "bbox": [x1, y1, x1 + 0.25, y1 + 0.25]}
+            expected.append(detection)
+            noise = "".join(rng.choice("{[ab ,\n") for _ in range(rng.randint(0, 10)))
+            parts.append(noise + json.dumps(detection, ensure_ascii=False))
+        text = "\n".join(parts)
+
+        assert parse_detections(text) == expected
+
+        scanner = IncrementalDetectionScanner()
+        streamed = []
+        for position in range(0, len(text), 7):
+            streamed.extend(scanner.feed(text[position:position + 7]))
+        assert streamed == expected
+
+
+def _parse_seconds(text, repeat=5):
+    """多次解析中最快一次的耗时，关闭垃圾回收以减少计时抖动"""
+    best = float("inf")
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parse_detections(text)
+            best = min(best, time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return best
+
+
+def test_unbalanced_input_is_linear():
+    # 每个未闭合的片段包含已闭合的子片段，逐层提升子片段时是平方时间
+    def build(count):
+        return "{ " + " ".join("{bad {x} [1,2" for _ in range(count)) + "}"
+
+    small = _parse_seconds(build(10000))
+    large = _parse_seconds(build(40000))
+    # 输入长度4倍，线性时间约4倍，平方时间约16倍
+    assert large < small * 10
+    assert large < 2.0
@@ -0,0 +1,65 @@
+import random
+
+import numpy as np
+
+from app.utils.detection_postprocess import NMS_IOU_THRESHOLD, box_areas, clip_boxes, nms, postprocess_detections, to_arrays
+
+
+def _iou(a, b):
+    inter = max(min(a[2], b[2]) - max(a[0], b[0]), 0.0) * max(min(a[3], b[3]) - max(a[1], b[1]), 0.0)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def test_clip_and_remove_degenerate_boxes():
+    detections = [
+        {"label": "船", "bbox": [-0.1, 0.5, 0.2, 1.3]},
+        {"label": "船", "bbox": [0.3, 0.3, 0.3, 0.4]},
+        {"label": "车", "bbox": [0.2, 1.0, 0.0, 0.5]},
+    ]
+    assert postprocess_detections(detections) == [
+        {"label": "船", "bbox": [0.0, 0.5, 0.2, 1.0]},
+        {"label": "车", "bbox": [0.0, 0.5, 0.2, 1.0]},
+    ]
+
+
+def test_merge_duplicates_per_label_and_keep_order():
+    detections = [
+        {"label": "船", "bbox": [0.1, 0.1, 0.2, 0.2], "tile": 0},
+        {"label": "车", "bbox": [0.5, 0.5, 0.6, 0.6]},
+        {"label": "船", "bbox": [0.1, 0.1, 0.21, 0.2], "tile": 1},
+    ]
+    result = postprocess_detections(detections, image_size=(1000, 500))
+    assert [(d["label"], d.get("tile")) for d in result] == [("车", None), ("船", 1)]
+    assert np.allclose(result[1]["pixel_bbox"], [100.0, 50.0, 210.0, 100.0])
+
+
+def test_remove_boxes_smaller_than_one_pixel():
+    detections = [{"label": "船", "bbox": [0.1, 0.1, 0.1001, 0.2]}]
+    assert postprocess_detections(detections) == [{"label": "船", "bbox": [0.1, 0.1, 0.1001, 0.2]}]
+    assert postprocess_detections(detections, image_size=(1000, 1000)) == []
+
+
+def test_nms_random_scenes():
+    rnd = random.Random(0)
+    for _ in range(50):
+        detections = []
+        for _ in range(rnd.randint(1, 150)):
+            x, y = rnd.random() * 0.7, rnd.random() * 0.7
+            detections.append({"label": rnd.choice("ab"), "bbox": [x, y, x + rnd.uniform(0.01, 0.3), y + rnd.uniform(0.01, 0.3)]})
+        boxes, labels = to_arrays(detections)
+        boxes = clip_boxes(boxes)
+        areas = box_areas(boxes)
+        kept = nms(boxes, labels).tolist()
+        kept_set = set(kept)
+
+        # 保留的同标签检测框之间IoU都不超过阈值
+        for position, i in enumerate(kept):
+            for k in kept[position + 1:]:
+                assert labels[i] != labels[k] or _iou(boxes[i], boxes[k]) <= NMS_IOU_THRESHOLD
+        # 每个被抑制的检测框都与一个面积不小于它的同标签保留框重叠超过阈值
+        for v in set(range(len(boxes))) - kept_set:
+            assert any(
+                labels[k] == labels[v] and areas[k] >= areas[v] and _iou(boxes[k], boxes[v]) > NMS_IOU_THRESHOLD
+                for k in kept
+            )
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.db.database import Base
+from app.db.models import Chat, User
+from app.services.user_service import DetectionService, MessageService
+
+_DETECTIONS = [
+    {"label": "船", "bbox": [0.1, 0.1, 0.2, 0.2]},
+    {"label": "船", "bbox": [0.6, 0.6, 0.7, 0.7]},
+    {"label": "车", "bbox": [0.15, 0.15, 0.3, 0.3]},
+]
+
+
+def _session(rtree):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    if not rtree:
+        # 模拟没有R*Tree虚拟表的数据库（如PostgreSQL），查询只能按坐标列过滤
+        with engine.begin() as conn:
+            for name in ("detections_rtree_insert", "detections_rtree_update", "detections_rtree_delete"):
+                conn.exec_driver_sql(f"DROP TRIGGER {name}")
+            conn.exec_driver_sql("DROP TABLE detections_rtree")
+        engine.dialect.name = "postgresql"
+    db = sessionmaker(bind=engine)()
+    db.add(User(id="user", username="user"))
+    db.add(Chat(id="chat", user_id="user", title="测试"))
+    db.commit()
+    coordinates = json.dumps(_DETECTIONS, ensure_ascii=False)
+    MessageService.create_message(db, "chat", coordinates, "ai", object_coordinates=coordinates)
+    return db
+
+
+@pytest.mark.parametrize("rtree", [True, False])
+def test_query_by_region_and_label(rtree):
+    db = _session(rtree)
+    found = DetectionService.query(db, "user", bbox=(0.0, 0.0, 0.25, 0.25))
+    assert sorted(d.label for d in found) == ["船", "车"]
+
+    found = DetectionService.query(db, "user", label="船", bbox=(0.5, 0.5, 1.0, 1.0))
+    assert [(d.x1, d.y1, d.x2, d.y2) for d in found] == [(0.6, 0.6, 0.7, 0.7)]
+
+    assert DetectionService.query(db, "other", bbox=(0.0, 0.0, 1.0, 1.0)) == []
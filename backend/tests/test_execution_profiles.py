@@ -0,0 +1,55 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from app.services import execution_profiles as execution_profiles_module
+from app.services.execution_profiles import ExecutionProfileRegistry
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    clients = {}
+
+    def get_async_redis():
+        # 与get_async_redis一样按事件循环创建客户端，共享同一个模拟服务器
+        loop = asyncio.get_running_loop()
+        if loop not in clients:
+            clients[loop] = fakeredis.FakeAsyncRedis(server=server)
+        return clients[loop]
+
+    monkeypatch.setattr(execution_profiles_module, "get_async_redis", get_async_redis)
+    return fakeredis.FakeRedis(server=server)
+
+
+def _registry():
+    return ExecutionProfileRegistry(default="deep", downgrade_depths=[2, 4], queue_name="q")
+
+
+def test_resolve_downgrades_by_queue_depth(fake_redis):
+    fake_redis.rpush("q", *range(4))
+
+    async def run():
+        registry = _registry()
+        profile, downgraded = await registry.resolve()
+        assert (profile.name, downgraded) == ("fast", True)
+        profile, downgraded = await registry.resolve("fast")
+        assert (profile.name, downgraded) == ("fast", False)
+        assert (await registry.stats())["profiles"]["fast"]["downgraded"] == 1
+
+    asyncio.run(run())
+
+
+def test_resolve_keeps_profile_when_redis_fails(monkeypatch):
+    def get_async_redis():
+        raise ConnectionError("redis down")
+
+    monkeypatch.setattr(execution_profiles_module, "get_async_redis", get_async_redis)
+    profile, downgraded = asyncio.run(_registry().resolve("balanced"))
+    assert (profile.name, downgraded) == ("balanced", False)
+
+
+def test_resolve_unknown_profile():
+    with pytest.raises(ValueError):
+        asyncio.run(_registry().resolve("turbo"))
@@ -0,0 +1,64 @@
+import json
+import os
+
+import numpy as np
+import pytest
+import rasterio
+from PIL import Image
+
+from app.services import image_pipeline
+from app.services.image_pipeline import derived_image_path, image_meta_path, normalize_upload
+
+
+@pytest.fixture
+def derived_folder(tmp_path, monkeypatch):
+    folder = tmp_path / "derived"
+    folder.mkdir()
+    monkeypatch.setattr(image_pipeline, "DERIVED_FOLDER", str(folder))
+    return folder
+
+
+def _write_geotiff(path, width, height, dtype="uint8"):
+    data = (np.arange(3 * width * height) % 251).astype(dtype).reshape(3, height, width)
+    with rasterio.open(path, "w", driver="GTiff", width=width, height=height, count=3, dtype=dtype) as dst:
+        dst.write(data)
+
+
+def test_normalize_geotiff_without_full_decode(tmp_path, derived_folder, monkeypatch):
+    # 把PIL的解压炸弹上限调小，模拟超过上限的大幅场景
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 10000)
+    path = str(tmp_path / "scene.tif")
+    _write_geotiff(path, 400, 200)
+    with pytest.raises(Image.DecompressionBombError):
+        Image.open(path)
+
+    meta = normalize_upload(path, max_edge=100, quality=90)
+    assert (meta["original_width"], meta["original_height"]) == (400, 200)
+    assert (meta["width"], meta["height"]) == (100, 50)
+    assert meta["scale_x"] == 0.25
+    with Image.open(derived_image_path(path)) as image:
+        assert image.size == (100, 50)
+    with open(image_meta_path(path), encoding="utf-8") as f:
+        assert json.load(f) == meta
+    # 没有留下临时文件
+    assert sorted(os.listdir(derived_folder)) == ["scene.jpg", "scene.meta.json"]
+
+
+def test_normalize_16bit_geotiff(tmp_path, derived_folder):
+    # PIL无法读取多波段16位影像，按拉伸范围转换为8位
+    path = str(tmp_path / "scene16.tif")
+    _write_geotiff(path, 64, 32, dtype="uint16")
+
+    meta = normalize_upload(path, max_edge=100, quality=90)
+    assert (meta["width"], meta["height"]) == (64, 32)
+    with Image.open(derived_image_path(path)) as image:
+        assert image.mode == "RGB"
+
+
+def test_normalize_plain_image(tmp_path, derived_folder):
+    path = str(tmp_path / "photo.png")
+    Image.new("RGBA", (300, 150), (10, 20, 30, 255)).save(path)
+
+    meta = normalize_upload(path, max_edge=100, quality=90)
+    assert (meta["original_format"], meta["width"], meta["height"]) == ("PNG", 100, 50)
+    assert sorted(os.listdir(derived_folder)) == ["photo.jpg", "photo.meta.json"]
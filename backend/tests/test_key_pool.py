@@ -0,0 +1,87 @@
+import pytest
+
+from app.services import key_pool as key_pool_module
+from app.services.key_pool import OUTCOME_CANCELED, OUTCOME_ERROR, OUTCOME_OK, OUTCOME_RATE_LIMITED, ApiKeyPool
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(key_pool_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def _pool(count=2, **kwargs):
+    options = {"window": 10, "min_samples": 4, "error_threshold": 0.5, "eject_seconds": 30.0}
+    options.update(kwargs)
+    return ApiKeyPool([f"key-{index}-secret" for index in range(count)], **options)
+
+
+def test_least_outstanding_selection(clock):
+    pool = _pool(3)
+    first, second, third = pool.acquire(), pool.acquire(), pool.acquire()
+    assert len({first.api_key, second.api_key, third.api_key}) == 3
+    # 所有密钥各有一个未完成请求时，下一个请求仍然均匀分配
+    pool.release(second, 0.1)
+    assert pool.acquire() is second
+    assert [key.outstanding for key in pool.keys] == [1, 1, 1]
+
+
+def test_latency_breaks_ties(clock):
+    pool = _pool(2)
+    slow, fast = pool.keys
+    for key, latency in ((slow, 2.0), (fast, 0.5)):
+        key.outstanding = 1
+        pool.release(key, latency)
+    assert pool.acquire() is fast
+
+
+def test_ejection_after_errors(clock):
+    pool = _pool(2)
+    bad, good = pool.keys
+    for outcome in (OUTCOME_ERROR, OUTCOME_OK, OUTCOME_ERROR, OUTCOME_ERROR):
+        bad.outstanding += 1
+        pool.release(bad, 0.1, outcome)
+    assert not bad.is_available(clock[0])
+    assert pool.available_count() == 1
+    assert bad.ejections == 1
+    # 被剔除的密钥即使没有未完成请求也不再分配
+    good.outstanding = 5
+    assert pool.acquire() is good
+
+    clock[0] += 30.0
+    assert pool.available_count() == 2
+    assert pool.acquire() is bad
+
+
+def test_canceled_calls_do_not_count(clock):
+    pool = _pool(1)
+    key = pool.keys[0]
+    for _ in range(10):
+        key.outstanding += 1
+        pool.release(key, 0.1, OUTCOME_CANCELED)
+    assert key.requests == 0
+    assert key.outstanding == 0
+    assert pool.available_count() == 1
+
+
+def test_rate_limited_key_ejected_for_retry_after(clock):
+    pool = _pool(2)
+    limited, other = pool.acquire(), pool.acquire()
+    pool.release(other, 0.1)
+    pool.release(limited, 0.1, OUTCOME_RATE_LIMITED, retry_after=12.0)
+    # 样本数不足，只按retry_after暂停
+    assert limited.ejections == 0
+    assert pool.stats()[pool.keys.index(limited)]["ejected_for"] == pytest.approx(12.0)
+    assert pool.acquire() is other
+
+    clock[0] += 12.0
+    assert limited.is_available(clock[0])
+
+
+def test_all_ejected_returns_earliest_recovery(clock):
+    pool = _pool(2)
+    first, second = pool.keys
+    first.ejected_until = clock[0] + 20.0
+    second.ejected_until = clock[0] + 5.0
+    assert pool.acquire() is second
@@ -0,0 +1,97 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from app.models.analyze import TaskType
+from app.services import rate_limiter as rate_limiter_module
+from app.services.model_backend import FakeModelBackend
+from app.services.rate_limiter import ModelRateLimiter, RateLimitTimeout, rate_limiter
+from app.services.zhipuai_service import ZhipuAiService
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    clients = {}
+
+    def get_async_redis():
+        # 与get_async_redis一样按事件循环创建客户端，共享同一个模拟服务器
+        loop = asyncio.get_running_loop()
+        if loop not in clients:
+            clients[loop] = fakeredis.FakeAsyncRedis(server=server)
+        return clients[loop]
+
+    monkeypatch.setattr(rate_limiter_module, "get_async_redis", get_async_redis)
+    return server
+
+
+def _limiter(rpm=6000, burst=100, concurrency=10):
+    return ModelRateLimiter({"m": {"rpm": rpm, "burst": burst, "concurrency": concurrency}}, max_wait=0.1)
+
+
+async def _acquire(limiter, account):
+    async with limiter.limit("m", account):
+        return True
+
+
+def test_token_bucket_per_account(fake_redis):
+    limiter = _limiter(rpm=1, burst=1)
+
+    async def run():
+        assert await _acquire(limiter, "a")
+        with pytest.raises(RateLimitTimeout):
+            await _acquire(limiter, "a")
+        # 其他账号的令牌桶不受影响
+        assert await _acquire(limiter, "b")
+
+    asyncio.run(run())
+
+
+def test_concurrency_per_account(fake_redis):
+    limiter = _limiter(concurrency=1)
+
+    async def run():
+        async with limiter.limit("m", "a"):
+            with pytest.raises(RateLimitTimeout):
+                await _acquire(limiter, "a")
+            assert await _acquire(limiter, "b")
+        # 租约释放后可以再次获得
+        assert await _acquire(limiter, "a")
+
+    asyncio.run(run())
+
+
+def test_penalize_blocks_only_that_account(fake_redis):
+    limiter = _limiter()
+
+    async def run():
+        assert await limiter.penalize("m", 5, "a") == 5
+        with pytest.raises(RateLimitTimeout):
+            await _acquire(limiter, "a")
+        assert await _acquire(limiter, "b")
+        stats = await limiter.stats({"a": "key-a", "b": "key-b"})
+        assert stats["m"]["accounts"]["key-a"]["blocked_for"] > 4
+        assert stats["m"]["accounts"]["key-b"]["blocked_for"] == 0
+
+    asyncio.run(run())
+
+
+def test_more_keys_raise_throughput(fake_redis, monkeypatch):
+    # 每个账号只允许1个并发调用：两个密钥时两次并发调用都能在排队超时前开始
+    monkeypatch.setattr(rate_limiter, "limits", {"default": {"rpm": 6000, "burst": 100, "concurrency": 1}})
+    monkeypatch.setattr(rate_limiter, "max_wait", 0.1)
+    backend = FakeModelBackend(thinking_tokens=0, token_rate=0, latency="fixed:0.3", error_rate=0,
+                               rate_limit_rate=0, seed=0)
+    service = ZhipuAiService(api_keys=["key-aaaaaaaaaaaa", "key-bbbbbbbbbbbb"], backend=backend)
+
+    async def run():
+        return await asyncio.gather(*[
+            service.analyze_image(image_base64="aGVsbG8=", prompt=f"问题{index}", task_type=TaskType.DESCRIPTION,
+                                  use_cache=False)
+            for index in range(2)
+        ])
+
+    results = asyncio.run(run())
+    assert all(result.content for result in results)
+    assert [key["requests"] for key in service.key_pool.stats()] == [1, 1]
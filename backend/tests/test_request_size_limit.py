@@ -0,0 +1,51 @@
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+
+from main import CORSStaticFilesMiddleware, RequestSizeLimitMiddleware
+
+_LIMIT = 64 * 1024
+_BOUNDARY = "size-limit-test"
+
+
+def _client():
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    # 与main.app相同的中间件顺序：BaseHTTPMiddleware会把receive中的异常变成表单解析错误
+    app.add_middleware(CORSStaticFilesMiddleware)
+    app.add_middleware(RequestSizeLimitMiddleware, max_body_size=_LIMIT)
+    return TestClient(app)
+
+
+def _multipart_chunks(size):
+    yield (f'--{_BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="a.png"\r\n'
+           f'Content-Type: image/png\r\n\r\n').encode()
+    for _ in range(0, size, 8192):
+        yield b"x" * 8192
+    yield f"\r\n--{_BOUNDARY}--\r\n".encode()
+
+
+def _post_chunked(client, size):
+    # 生成器请求体没有Content-Length，按分块传输发送
+    return client.post("/upload", content=_multipart_chunks(size),
+                       headers={"content-type": f"multipart/form-data; boundary={_BOUNDARY}"})
+
+
+def test_reject_by_content_length():
+    response = _client().post("/upload", files={"file": ("a.png", b"x" * (_LIMIT + 1), "image/png")})
+    assert response.status_code == 413
+
+
+def test_reject_chunked_body_over_limit():
+    response = _post_chunked(_client(), _LIMIT * 2)
+    assert response.status_code == 413
+    assert "请求体大小超过限制" in response.json()["detail"]
+
+
+def test_accept_chunked_body_under_limit():
+    response = _post_chunked(_client(), _LIMIT // 2)
+    assert response.status_code == 200
+    assert response.json() == {"size": _LIMIT // 2}
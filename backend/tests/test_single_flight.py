@@ -0,0 +1,64 @@
+import asyncio
+
+import fakeredis
+import pytest
+from redis import asyncio as aioredis
+
+from app.services import single_flight as single_flight_module
+from app.services.single_flight import SingleFlight
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    clients = {}
+
+    def get_async_redis():
+        # 与get_async_redis一样按事件循环创建客户端，共享同一个模拟服务器
+        loop = asyncio.get_running_loop()
+        if loop not in clients:
+            clients[loop] = fakeredis.FakeAsyncRedis(server=server)
+        return clients[loop]
+
+    monkeypatch.setattr(single_flight_module, "get_async_redis", get_async_redis)
+    return server
+
+
+def _producer(results, delay=0.2):
+    """依次返回results中的(结果, 是否可共享)，记录调用次数"""
+    calls = []
+
+    async def fn():
+        calls.append(len(calls))
+        await asyncio.sleep(delay)
+        return results[min(len(calls) - 1, len(results) - 1)]
+
+    return fn, calls
+
+
+async def _run_concurrently(flight, fn, count):
+    return await asyncio.gather(*[flight.run("key", fn) for _ in range(count)])
+
+
+def test_concurrent_requests_run_once(fake_redis):
+    fn, calls = _producer([({"content": "结果"}, True)])
+    results = asyncio.run(_run_concurrently(SingleFlight(wait_timeout=10), fn, 5))
+    assert len(calls) == 1
+    assert results == [{"content": "结果"}] * 5
+
+
+def test_followers_reelect_instead_of_stampeding(fake_redis):
+    # 第一个leader的结果不可共享（例如被取消），只由一个新leader重新执行
+    fn, calls = _producer([({"content": "已取消"}, False), ({"content": "结果"}, True)])
+    results = asyncio.run(_run_concurrently(SingleFlight(wait_timeout=10), fn, 5))
+    assert len(calls) == 2
+    assert results.count({"content": "结果"}) == 4
+
+
+def test_redis_unavailable_runs_directly(monkeypatch):
+    # 没有服务监听的端口，连接立即失败
+    monkeypatch.setattr(single_flight_module, "get_async_redis", lambda: aioredis.Redis(host="127.0.0.1", port=1))
+    fn, calls = _producer([({"content": "结果"}, True)], delay=0)
+    result = asyncio.run(SingleFlight().run("key", fn))
+    assert result == {"content": "结果"}
+    assert len(calls) == 1
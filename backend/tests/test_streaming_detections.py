@@ -0,0 +1,38 @@
+import asyncio
+
+from app.models.analyze import TaskType
+from app.services.model_backend import FakeModelBackend
+from app.services.zhipuai_service import ZhipuAiService
+
+
+def _service():
+    backend = FakeModelBackend(thinking_tokens=0, token_rate=0, latency="fixed:0", error_rate=0,
+                               rate_limit_rate=0, detections=5, seed=0)
+    return ZhipuAiService(backend=backend)
+
+
+def _analyze(service, on_detection):
+    return asyncio.run(service.analyze_image(
+        image_base64="aGVsbG8=", task_type=TaskType.DETECTION, use_cache=False, on_detection=on_detection
+    ))
+
+
+def test_detections_published_while_streaming():
+    published = []
+    result = _analyze(_service(), published.append)
+    assert hasattr(result, "content")
+    assert len(published) == 5
+
+
+def test_failing_publisher_does_not_abort_the_model_call():
+    calls = []
+
+    def on_detection(detection):
+        calls.append(detection)
+        raise RuntimeError("Redis不可用")
+
+    result = _analyze(_service(), on_detection)
+    # 回调出错时模型调用照常完成，返回完整回复
+    assert hasattr(result, "content")
+    assert result.content.count('"bbox"') == 5
+    assert calls
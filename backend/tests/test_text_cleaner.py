@@ -0,0 +1,38 @@
+import random
+
+from app.utils.text_cleaner import StreamingTagCleaner, clean_special_tags
+
+# 随机输入使用的片段：正文、空白、竖线、完整和不完整的特殊标记
+_PIECES = ["a", "中", " ", "\n", "　", "|", "||", "<", "<|", "x|>", "<|begin_of_box|>", "<|end_of_box|>"]
+
+
+def _stream(text, rnd):
+    cleaner = StreamingTagCleaner()
+    output = []
+    index = 0
+    while index < len(text):
+        size = rnd.randint(1, 6)
+        output.append(cleaner.feed(text[index:index + size]))
+        index += size
+    output.append(cleaner.flush())
+    return "".join(output)
+
+
+def test_clean_special_tags():
+    assert clean_special_tags("|| <|begin_of_box|>港口<|end_of_box|> |") == "港口"
+    assert clean_special_tags("") == ""
+    assert clean_special_tags(None) is None
+
+
+def test_tag_split_across_chunks():
+    cleaner = StreamingTagCleaner()
+    output = [cleaner.feed(chunk) for chunk in ["图中<|begin", "_of_bo", "x|>有船", " |"]]
+    output.append(cleaner.flush())
+    assert "".join(output) == "图中有船"
+
+
+def test_stream_matches_full_text():
+    rnd = random.Random(0)
+    for _ in range(5000):
+        text = "".join(rnd.choice(_PIECES) for _ in range(rnd.randint(0, 20)))
+        assert _stream(text, rnd) == clean_special_tags(text), text
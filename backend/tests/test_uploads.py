@@ -0,0 +1,125 @@
+import hashlib
+import io
+import os
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Query, sessionmaker
+
+from app.db.database import Base
+from app.api.api_v1.endpoints.analyze import _discard_upload_messages, _store_upload_with_messages
+from app.db.models import Message, Upload
+from app.services import user_service
+from app.services.user_service import UploadService
+
+
+@pytest.fixture
+def upload_env(tmp_path, monkeypatch):
+    folder = tmp_path / "uploads"
+    folder.mkdir()
+    monkeypatch.setattr(user_service, "UPLOAD_FOLDER", str(folder))
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(engine)
+    return folder, sessionmaker(bind=engine)
+
+
+def _receive(content):
+    return UploadService.receive_upload(io.BytesIO(content))
+
+
+def test_same_content_is_stored_once(upload_env):
+    folder, Session = upload_env
+    db = Session()
+    for _ in range(2):
+        tmp_path, sha256, size = _receive(b"image")
+        upload = UploadService.store_upload(db, tmp_path, sha256, size, ".PNG")
+    assert upload.ref_count == 2
+    assert upload.filename == f"{hashlib.sha256(b'image').hexdigest()}.png"
+    assert os.listdir(folder) == [upload.filename]
+
+
+def test_concurrent_first_upload_becomes_increment(upload_env, monkeypatch):
+    folder, Session = upload_env
+    db = Session()
+    tmp_path, sha256, size = _receive(b"image")
+    # 另一个请求已经提交了相同内容的记录，但本请求增加引用计数时还看不到它（非SQLite数据库上的竞争）
+    db.add(Upload(sha256=sha256, filename=f"{sha256}.png", size=size, ref_count=1))
+    db.commit()
+
+    update = Query.update
+    calls = []
+
+    def racing_update(self, *args, **kwargs):
+        calls.append(1)
+        return 0 if len(calls) == 1 else update(self, *args, **kwargs)
+
+    monkeypatch.setattr(Query, "update", racing_update)
+    upload = UploadService.store_upload(db, tmp_path, sha256, size, ".png")
+    assert upload.ref_count == 2
+    assert not os.path.exists(tmp_path)
+
+
+def test_release_removes_file_only_after_commit(upload_env):
+    folder, Session = upload_env
+    db = Session()
+    tmp_path, sha256, size = _receive(b"image")
+    upload = UploadService.store_upload(db, tmp_path, sha256, size, ".png")
+    path = os.path.join(folder, upload.filename)
+
+    # 提交失败：文件移回原处，记录和文件保持一致
+    released = UploadService.release_uploads(db, [f"/api/uploads/{upload.filename}"])
+    assert not os.path.exists(path)
+    db.rollback()
+    UploadService.restore_released(released)
+    assert os.path.exists(path)
+    assert db.query(Upload).count() == 1
+
+    # 提交成功后删除
+    released = UploadService.release_uploads(db, [f"/api/uploads/{upload.filename}"])
+    db.commit()
+    UploadService.remove_released(released)
+    assert os.listdir(folder) == []
+    assert db.query(Upload).count() == 0
+
+
+def test_upload_reference_is_committed_with_its_message(upload_env, monkeypatch):
+    folder, Session = upload_env
+    db = Session()
+    tmp_path, sha256, size = _receive(b"image")
+
+    # 移动文件失败：消息和引用计数一起回滚，临时文件被删除
+    def failing_replace(src, dst):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(user_service.os, "replace", failing_replace)
+        with pytest.raises(OSError):
+            _store_upload_with_messages(db, tmp_path, sha256, size, ".png", "chat", "问题")
+    assert db.query(Message).count() == 0
+    assert db.query(Upload).count() == 0
+    assert os.listdir(folder) == []
+
+    tmp_path, sha256, size = _receive(b"image")
+    upload, messages = _store_upload_with_messages(db, tmp_path, sha256, size, ".png", "chat", "问题")
+    assert upload.ref_count == 1
+    assert [message.image_path for message in messages] == [None, f"/api/uploads/{upload.filename}"]
+
+
+def test_discard_releases_upload_after_later_failure(upload_env):
+    folder, Session = upload_env
+    db = Session()
+    tmp_path, sha256, size = _receive(b"image")
+    upload, messages = _store_upload_with_messages(db, tmp_path, sha256, size, ".png", "chat", "问题")
+    tmp_path, sha256, size = _receive(b"image")
+    _, other_messages = _store_upload_with_messages(db, tmp_path, sha256, size, ".png", "chat", "问题")
+
+    # 标准化或启动任务失败：删除本次请求的消息，另一条消息仍然拥有该文件
+    _discard_upload_messages(db, other_messages)
+    assert db.query(Message).count() == 2
+    assert db.query(Upload).one().ref_count == 1
+    assert os.listdir(folder) == [upload.filename]
+
+    _discard_upload_messages(db, messages)
+    assert db.query(Message).count() == 0
+    assert db.query(Upload).count() == 0
+    assert os.listdir(folder) == []
@@ -103,6 +103,83 @@ const BoundingBox = ({ box, color = 'red', label }) => {
   );
 };
 
+// 上传图像的金字塔信息（按图像URL缓存，画布尺寸变化时不重复请求）
+const tileInfoCache = new Map();
+
+// 从上传图像URL（.../api/uploads/文件名）得到图块接口地址，不是上传图像时返回null
+const getTileBaseUrl = (imageUrl) => {
+  const match = imageUrl.match(/^(.*)\/api\/uploads\/([^/?#]+)$/);
+  return match ? { origin: match[1], filename: match[2] } : null;
+};
+
+const fetchTileInfo = (imageUrl) => {
+  if (!tileInfoCache.has(imageUrl)) {
+    const { origin, filename } = getTileBaseUrl(imageUrl);
+    const request = fetch(`${origin}/api/tiles/${filename}/info`).then((response) => {
+      if (!response.ok) {
+        throw new Error(`获取金字塔信息失败: ${response.status}`);
+      }
+      return response.json();
+    });
+    // 失败时不缓存，下次重新请求
+    request.catch(() => tileInfoCache.delete(imageUrl));
+    tileInfoCache.set(imageUrl, request);
+  }
+  return tileInfoCache.get(imageUrl);
+};
+
+const loadTile = (url) => new Promise((resolve, reject) => {
+  const tile = new window.Image();
+  // 图块需要跨域加载，画布才能导出
+  tile.crossOrigin = 'anonymous';
+  tile.onload = () => resolve(tile);
+  tile.onerror = () => reject(new Error(`图块加载失败: ${url}`));
+  tile.src = url;
+});
+
+// 用图块拼出一张不小于显示尺寸的图像（canvas），只下载对应缩放级别的图块
+// 不是上传图像时返回null；金字塔信息或图块加载失败时reject
+const loadTiledImage = async (imageUrl, maxWidth, maxHeight) => {
+  const base = getTileBaseUrl(imageUrl);
+  if (!base) return null;
+  const info = await fetchTileInfo(imageUrl);
+  const { width, height, tile_size: tileSize, max_zoom: maxZoom } = info;
+  
+  // 与原图相同的等比例缩放规则得到显示尺寸，按设备像素比选择不模糊的最低缩放级别
+  const displayScale = Math.min(1, maxWidth / width, maxHeight / height);
+  const pixelRatio = Math.max(1, window.devicePixelRatio || 1);
+  const targetWidth = width * displayScale * pixelRatio;
+  let zoom = maxZoom;
+  while (zoom > 0 && Math.ceil(width / 2 ** (maxZoom - zoom + 1)) >= targetWidth) {
+    zoom -= 1;
+  }
+  
+  // 该级别的图像尺寸；右侧和下侧边缘的图块可能小于图块边长
+  const factor = 2 ** (maxZoom - zoom);
+  const levelWidth = Math.ceil(width / factor);
+  const levelHeight = Math.ceil(height / factor);
+  const columns = Math.ceil(levelWidth / tileSize);
+  const rows = Math.ceil(levelHeight / tileSize);
+  
+  const tiles = [];
+  for (let y = 0; y < rows; y += 1) {
+    for (let x = 0; x < columns; x += 1) {
+      const url = `${base.origin}${info.url.replace('{z}', zoom).replace('{x}', x).replace('{y}', y)}`;
+      tiles.push(loadTile(url).then((tile) => ({ tile, x, y })));
+    }
+  }
+  
+  const canvas = document.createElement('canvas');
+  canvas.width = levelWidth;
+  canvas.height = levelHeight;
+  const context = canvas.getContext('2d');
+  for (const { tile, x, y } of await Promise.all(tiles)) {
+    context.drawImage(tile, x * tileSize, y * tileSize);
+  }
+  console.log(`使用图块加载图像: 缩放级别${zoom}/${maxZoom}, ${tiles.length}个图块, ${levelWidth}x${levelHeight}`);
+  return canvas;
+};
+
 // 主画布组件
 const ImageCanvas = ({ width, height, initialImageUrl, objectCoordinates }) => {
   const [images, setImages] = useState([]);
@@ -114,26 +191,12 @@ const ImageCanvas = ({ width, height, initialImageUrl, objectCoordinates }) => {
   useEffect(() => {
     if (initialImageUrl) {
       console.log('加载初始图像:', initialImageUrl);
-      const img = new window.Image();
-      // 设置跨域属性，确保图像可以正确导出
-      img.crossOrigin = 'anonymous';
-      
-      // 处理图像加载错误
-      img.onerror = (error) => {
-        console.error('图像加载失败:', error);
-        // 尝试不使用跨域加载
-        console.log('尝试不使用跨域方式加载图像');
-        const fallbackImg = new window.Image();
-        fallbackImg.src = initialImageUrl;
-        
-        fallbackImg.onload = () => handleImageLoaded(fallbackImg);
-        fallbackImg.onerror = (fallbackError) => {
-          console.error('备用图像加载方式也失败:', fallbackError);
-        };
-      };
+      // 依赖变化后忽略上一次尚未完成的加载
+      let cancelled = false;
       
       // 图像加载成功处理函数
       const handleImageLoaded = (loadedImg) => {
+        if (cancelled) return;
         // 计算图像尺寸，确保适合画布
         let imgWidth = loadedImg.width;
         let imgHeight = loadedImg.height;
@@ -180,16 +243,55 @@ const ImageCanvas = ({ width, height, initialImageUrl, objectCoordinates }) => {
         }, 100);
       };
       
-      // 设置加载事件
-      img.onload = () => handleImageLoaded(img);
+      // 下载原图（不是上传图像或图块不可用时使用）
+      const loadOriginalImage = () => {
+        const img = new window.Image();
+        // 设置跨域属性，确保图像可以正确导出
+        img.crossOrigin = 'anonymous';
+        
+        // 处理图像加载错误
+        img.onerror = (error) => {
+          console.error('图像加载失败:', error);
+          // 尝试不使用跨域加载
+          console.log('尝试不使用跨域方式加载图像');
+          const fallbackImg = new window.Image();
+          fallbackImg.src = initialImageUrl;
+          
+          fallbackImg.onload = () => handleImageLoaded(fallbackImg);
+          fallbackImg.onerror = (fallbackError) => {
+            console.error('备用图像加载方式也失败:', fallbackError);
+          };
+        };
+        
+        // 设置加载事件
+        img.onload = () => handleImageLoaded(img);
+        
+        // 开始加载图像
+        img.src = initialImageUrl;
+        
+        // 对于已经缓存的图像，onload可能不会触发
+        if (img.complete) {
+          handleImageLoaded(img);
+        }
+      };
       
-      // 开始加载图像
-      img.src = initialImageUrl;
+      // 优先只下载与画布显示尺寸相当的一层图块，不下载整幅原图
+      loadTiledImage(initialImageUrl, width * 0.8, height * 0.8)
+        .then((tiledImage) => {
+          if (tiledImage) {
+            handleImageLoaded(tiledImage);
+          } else {
+            loadOriginalImage();
+          }
+        })
+        .catch((error) => {
+          console.error('图块加载失败，改为下载原图:', error);
+          if (!cancelled) loadOriginalImage();
+        });
       
-      // 对于已经缓存的图像，onload可能不会触发
-      if (img.complete) {
-        handleImageLoaded(img);
-      }
+      return () => {
+        cancelled = true;
+      };
     }
   }, [initialImageUrl, width, height, objectCoordinates]);
   
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useMemo } from 'react';
 import Canvas from '../Canvas';
 import ImageCanvas from '../ImageCanvas';
 import { getChatMessages } from '../../services/api';
@@ -12,9 +12,15 @@ window.updateCanvasDisplay = function() {
   document.dispatchEvent(canvasUpdateEvent);
 };
 
+// 暴露一个全局函数，用于在检测任务完成前显示已经解析出的检测框
+window.showPendingDetections = function(detections) {
+  document.dispatchEvent(new CustomEvent('pendingDetections', { detail: detections }));
+};
+
 const CanvasDisplay = ({ width, height, onClose, activeChat }) => {
   const [canvasMode, setCanvasMode] = useState('image'); // 默认使用图像画布
   const [objectCoordinates, setObjectCoordinates] = useState(null);
+  const [pendingCoordinates, setPendingCoordinates] = useState(null); // 处理中任务的检测框
   const [imageUrl, setImageUrl] = useState(null);
   const [updateTrigger, setUpdateTrigger] = useState(0); // 用于触发重新加载
   
@@ -24,16 +30,24 @@ const CanvasDisplay = ({ width, height, onClose, activeChat }) => {
   // 监听自定义事件，当点击"在画布中查看"按钮时触发
   useEffect(() => {
     const handleCanvasUpdate = () => {
+      // 任务已完成，检测框改为从消息中加载
+      setPendingCoordinates(null);
       // 增加更新触发器计数，这将触发重新加载
       setUpdateTrigger(prev => prev + 1);
     };
     
+    const handlePendingDetections = (event) => {
+      setPendingCoordinates(event.detail);
+    };
+    
     // 添加事件监听器
     document.addEventListener('canvasUpdate', handleCanvasUpdate);
+    document.addEventListener('pendingDetections', handlePendingDetections);
     
     // 清理函数
     return () => {
       document.removeEventListener('canvasUpdate', handleCanvasUpdate);
+      document.removeEventListener('pendingDetections', handlePendingDetections);
     };
   }, []);
 
@@ -204,6 +218,14 @@ const CanvasDisplay = ({ width, height, onClose, activeChat }) => {
     loadObjectData();
   }, [activeChat, API_BASE_URL, updateTrigger]); // 添加updateTrigger到依赖数组中，这样当它变化时会触发重新加载
 
+  // 已保存的检测框加上处理中任务的检测框
+  const displayedCoordinates = useMemo(() => {
+    if (!pendingCoordinates || pendingCoordinates.length === 0) {
+      return objectCoordinates;
+    }
+    return [...(objectCoordinates || []), ...pendingCoordinates];
+  }, [objectCoordinates, pendingCoordinates]);
+
   return (
     <div className="canvas-display">
       <div className="canvas-content">
@@ -214,7 +236,7 @@ const CanvasDisplay = ({ width, height, onClose, activeChat }) => {
             width={width} 
             height={height} 
             initialImageUrl={imageUrl}
-            objectCoordinates={objectCoordinates}
+            objectCoordinates={displayedCoordinates}
           />
         )}
       </div>
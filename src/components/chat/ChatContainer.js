@@ -220,7 +220,9 @@ const ChatContainer = ({ activeChat, onFunctionSelect }) => {
                     : msg
                 ));
               }
-            }
+            },
+            // 在画布上先显示已经解析出的检测框
+            (status) => window.showPendingDetections && window.showPendingDetections(status.detections)
           );
           
           // 清除当前任务ID
@@ -276,7 +278,9 @@ const ChatContainer = ({ activeChat, onFunctionSelect }) => {
                     : msg
                 ));
               }
-            }
+            },
+            // 在画布上先显示已经解析出的检测框
+            (status) => window.showPendingDetections && window.showPendingDetections(status.detections)
           );
           
           // 清除当前任务ID
@@ -365,7 +369,9 @@ const ChatContainer = ({ activeChat, onFunctionSelect }) => {
                       : msg
                   ));
                 }
-              }
+              },
+              // 在画布上先显示已经解析出的检测框
+              (status) => window.showPendingDetections && window.showPendingDetections(status.detections)
             );
             
             // 清除当前任务ID
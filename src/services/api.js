@@ -503,13 +503,15 @@ const delay = (ms) => new Promise(resolve => setTimeout(resolve, ms));
  * @param {number} interval - 轮询间隔（毫秒）
  * @param {number} maxAttempts - 最大尝试次数
  * @param {Function} onProgress - 进度回调函数
+ * @param {Function} onPartialResult - 任务处理中返回检测结果时的回调，参数为任务状态
  * @returns {Promise<Object>} - 任务最终结果
  */
 export const pollTaskResult = async (
   taskId,
   interval = 3000,
   maxAttempts = 120,
-  onProgress = null
+  onProgress = null,
+  onPartialResult = null
 ) => {
   let attempts = 0;
 
@@ -535,6 +537,11 @@ export const pollTaskResult = async (
         return result;
       }
       
+      // 检测任务在模型输出过程中已经解析出的检测框
+      if (onPartialResult && result.detections && result.detections.length > 0) {
+        onPartialResult(result);
+      }
+      
       // 添加短暂延迟，避免连续请求
       await delay(interval);
       